@@ -0,0 +1,114 @@
+import random
+import time
+from functools import lru_cache
+import numpy as np
+from tictactoe import TicTacToe
+from bitboard import BitboardTicTacToe, win_lines
+
+
+# Batched random rollouts: many playouts of one leaf position in a few NumPy calls instead
+# of a Python loop per move. A random playout is the same as playing the empty cells in a
+# uniformly random order, so every playout is a random ranking of the empty cells (its
+# move times), with the player to move taking the even times. Each cell's owner is then
+# known for the full board, a line is completed at the time of its last stone, and the
+# winner is whoever completes a line first. The playouts never have to be played move by
+# move.
+
+
+@lru_cache(maxsize=None)
+def line_cells(size, win_condition):
+    # (lines, win_condition) array of the cells of every winning line
+    lines, _ = win_lines(size, win_condition)
+    return np.array([[cell for cell in range(size * size) if mask >> cell & 1] for mask in lines])
+
+
+def batch_playouts(game, batch=256, rng=None):
+    # (X wins, O wins, draws) of batch random playouts from game's position. game must be a
+    # BitboardTicTacToe: the kernel scores a playout by the first line completed, like
+    # BitboardTicTacToe.random_playout, while a TicTacToe plays on to a full board and
+    # check_winner then picks whichever line it finds first. Convert a TicTacToe with
+    # BitboardTicTacToe.from_board(game.board, game.current_player).
+    if not isinstance(game, BitboardTicTacToe):
+        raise TypeError("batch_playouts needs a BitboardTicTacToe, convert with BitboardTicTacToe.from_board")
+    rng = rng or np.random.default_rng()
+    winner = game.check_winner()
+    if winner is not None:
+        return (batch, 0, 0) if winner == 1 else (0, batch, 0) if winner == -1 else (0, 0, batch)
+    board = np.asarray(game.board).ravel()
+    size = game.size
+    lines = line_cells(size, getattr(game, 'win_condition', size))
+    empty = np.flatnonzero(board == 0)
+
+    times = np.full((batch, size * size), -1, dtype=np.int16)  # Stones already there: -1
+    times[:, empty] = rng.random((batch, len(empty))).argsort(axis=1).argsort(axis=1)
+    owners = np.repeat(board[np.newaxis].astype(np.int8), batch, axis=0)
+    owners[:, empty] = np.where(times[:, empty] % 2 == 0, game.current_player, -game.current_player)
+
+    line_owners = owners[:, lines]  # batch x lines x win_condition
+    line_times = times[:, lines].max(axis=2)  # When the last stone of each line was played
+    never = size * size
+    x_time = np.where((line_owners == 1).all(axis=2), line_times, never).min(axis=1)
+    o_time = np.where((line_owners == -1).all(axis=2), line_times, never).min(axis=1)
+    x_wins = int(np.count_nonzero(x_time < o_time))
+    o_wins = int(np.count_nonzero(o_time < x_time))
+    return x_wins, o_wins, batch - x_wins - o_wins
+
+
+def batch_MCTS(root, iterations=100, batch=64, rng=None):
+    # MCTS from tictactoe.py with batch playouts per leaf instead of one, backpropagated
+    # together with MCTSNode.update_batch. root.game must be a BitboardTicTacToe, see
+    # batch_playouts.
+    if not isinstance(root.game, BitboardTicTacToe):
+        raise TypeError("batch_MCTS needs a BitboardTicTacToe root, convert with BitboardTicTacToe.from_board")
+    for _ in range(iterations):
+        node = root
+        game = root.game.copy()
+
+        if game.check_winner() is None:
+            while node.untried_moves == [] and node.children != []:
+                node = node.select_child()
+                game.make_move(*node.move)
+
+            if node.untried_moves != []:
+                move = random.choice(node.untried_moves)
+                game.make_move(*move)
+                node = node.add_child(move)
+
+        results = batch_playouts(game, batch, rng)
+        while node is not None:
+            node.update_batch(*results)
+            node = node.parent
+
+
+def playout_cost(play, seconds):
+    # Microseconds per playout of play(), which returns how many playouts it ran
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        count += play()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def compare_rollouts(sizes=(3, 4, 5, 7, 9), batch=256, seconds=1.0):
+    # Cost per playout from the empty board of the numpy loop, the bitboard loop and the
+    # batched kernel, and the X/O/draw split of the kernel as a sanity check
+    rng = np.random.default_rng()
+    for size in sizes:
+        costs = []
+        for game in (TicTacToe(size), BitboardTicTacToe(size)):
+            def play(game=game):
+                rollout = game.copy()
+                rollout.random_playout()
+                rollout.check_winner()
+                return 1
+            costs.append(playout_cost(play, seconds / 3))
+        game = BitboardTicTacToe(size)
+        costs.append(playout_cost(lambda: batch_playouts(game, batch, rng) and batch, seconds / 3))
+        x_wins, o_wins, draws = batch_playouts(game, 10000, rng)
+        print(f"{size}x{size}: numpy {costs[0]:.1f} us, bitboard {costs[1]:.1f} us, "
+              f"batch of {batch} {costs[2]:.1f} us per playout ({costs[0] / costs[2]:.0f}x numpy, "
+              f"{costs[1] / costs[2]:.1f}x bitboard); X {x_wins / 100:.1f}% O {o_wins / 100:.1f}% draw {draws / 100:.1f}%")
+
+
+if __name__ == "__main__":
+    compare_rollouts()
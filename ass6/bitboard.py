@@ -0,0 +1,230 @@
+import random
+import time
+from functools import lru_cache
+import numpy as np
+from tictactoe import TicTacToe, MCTSNode, MCTS
+
+
+# Bitboard version of TicTacToe for the MCTS in tictactoe.py. Each player's stones are one
+# Python int with bit row * size + col set, so a move is an OR, a copy is two ints and the
+# win check only tests the precomputed lines through the cell that was just played.
+# Works for any size and win_condition (k in a row); win_condition defaults to size, the
+# full rows, columns and diagonals of the numpy version.
+
+
+@lru_cache(maxsize=None)
+def win_lines(size, win_condition):
+    # Bit masks of every run of win_condition cells (rows, columns, both diagonals) and,
+    # per cell, the masks of the runs that go through it
+    lines = []
+    for row in range(size):
+        for col in range(size):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row = row + d_row * (win_condition - 1)
+                end_col = col + d_col * (win_condition - 1)
+                if 0 <= end_row < size and 0 <= end_col < size:
+                    mask = 0
+                    for step in range(win_condition):
+                        mask |= 1 << ((row + d_row * step) * size + col + d_col * step)
+                    lines.append(mask)
+    through = tuple(tuple(mask for mask in lines if mask >> cell & 1) for cell in range(size * size))
+    return tuple(lines), through
+
+
+@lru_cache(maxsize=None)
+def cell_moves(size):
+    return tuple((cell // size, cell % size) for cell in range(size * size))
+
+
+class BitboardTicTacToe:
+    # Same interface as TicTacToe (make_move, check_winner, get_available_moves, copy,
+    # board, current_player) plus undo_move. Once somebody has won there are no moves left,
+    # so rollouts stop at the first win instead of filling the board.
+
+    def __init__(self, size=3, win_condition=None):
+        self.size = size
+        self.win_condition = size if win_condition is None else win_condition
+        if not 1 <= self.win_condition <= size:
+            raise ValueError(f"win_condition must be between 1 and {size}")
+        self.lines, self.lines_through = win_lines(size, self.win_condition)
+        self.moves = cell_moves(size)
+        self.full = (1 << size * size) - 1
+        self.x_bits = 0  # Player 1
+        self.o_bits = 0  # Player -1
+        self.current_player = 1
+        self.winner = None
+        self.history = []  # Cells played since this object was created or copied
+
+    def make_move(self, row, col):
+        cell = row * self.size + col
+        bit = 1 << cell
+        if (self.x_bits | self.o_bits) & bit or self.winner is not None:
+            return False
+        if self.current_player == 1:
+            self.x_bits |= bit
+            stones = self.x_bits
+        else:
+            self.o_bits |= bit
+            stones = self.o_bits
+        self.history.append(cell)
+        # Only the lines through the new stone can have been completed
+        for mask in self.lines_through[cell]:
+            if stones & mask == mask:
+                self.winner = self.current_player
+                break
+        else:
+            if self.x_bits | self.o_bits == self.full:
+                self.winner = 0
+        self.current_player = -self.current_player
+        return True
+
+    def undo_move(self):
+        # Take back the last move made on this object
+        bit = 1 << self.history.pop()
+        self.current_player = -self.current_player
+        if self.current_player == 1:
+            self.x_bits &= ~bit
+        else:
+            self.o_bits &= ~bit
+        self.winner = None  # Nobody had won before the move, or it couldn't have been made
+
+    def check_winner(self):
+        # 1 or -1 for a win, 0 for a draw, None while the game goes on
+        return self.winner
+
+    def empty_bits(self):
+        if self.winner is not None:
+            return 0
+        return self.full & ~(self.x_bits | self.o_bits)
+
+    def get_available_moves(self):
+        moves = []
+        empty = self.empty_bits()
+        while empty:
+            low = empty & -empty
+            moves.append(self.moves[low.bit_length() - 1])
+            empty ^= low
+        return moves
+
+    def random_move(self):
+        # Uniform random empty cell without building the move list, None if the game is over
+        empty = self.empty_bits()
+        if not empty:
+            return None
+        pick = random.randrange(bin(empty).count('1'))
+        for _ in range(pick):
+            empty &= empty - 1  # Drop the lowest set bit
+        return self.moves[(empty & -empty).bit_length() - 1]
+
+    def random_playout(self):
+        # Random moves until the game is over. Playing the empty cells in a shuffled order
+        # is the same as picking a uniform random empty cell at every turn, and the loop
+        # works on local ints instead of calling make_move.
+        if self.winner is not None:
+            return
+        empty = self.empty_bits()
+        cells = [cell for cell in range(self.size * self.size) if empty >> cell & 1]
+        random.shuffle(cells)
+        x_bits, o_bits, player, winner = self.x_bits, self.o_bits, self.current_player, None
+        lines_through = self.lines_through
+        played = 0
+        for cell in cells:
+            played += 1
+            if player == 1:
+                x_bits |= 1 << cell
+                stones = x_bits
+            else:
+                o_bits |= 1 << cell
+                stones = o_bits
+            for mask in lines_through[cell]:
+                if stones & mask == mask:
+                    winner = player
+                    break
+            player = -player
+            if winner is not None:
+                break
+        if winner is None and x_bits | o_bits == self.full:
+            winner = 0
+        self.x_bits, self.o_bits, self.current_player, self.winner = x_bits, o_bits, player, winner
+        self.history.extend(cells[:played])
+
+    def copy(self):
+        new_game = type(self).__new__(type(self))
+        new_game.__dict__.update(self.__dict__)
+        new_game.history = []
+        return new_game
+
+    @property
+    def board(self):
+        # numpy board like TicTacToe.board, for the GUI and printing
+        board = np.zeros((self.size, self.size), dtype=int)
+        for cell in range(self.size * self.size):
+            if self.x_bits >> cell & 1:
+                board[cell // self.size, cell % self.size] = 1
+            elif self.o_bits >> cell & 1:
+                board[cell // self.size, cell % self.size] = -1
+        return board
+
+    @classmethod
+    def from_board(cls, board, current_player=1, win_condition=None):
+        # Convert a numpy TicTacToe board
+        board = np.asarray(board)
+        game = cls(board.shape[0], win_condition)
+        for (row, col), value in np.ndenumerate(board):
+            if value == 1:
+                game.x_bits |= 1 << (row * game.size + col)
+            elif value == -1:
+                game.o_bits |= 1 << (row * game.size + col)
+        game.current_player = current_player
+        for mask in game.lines:
+            if game.x_bits & mask == mask:
+                game.winner = 1
+            elif game.o_bits & mask == mask:
+                game.winner = -1
+        if game.winner is None and game.x_bits | game.o_bits == game.full:
+            game.winner = 0
+        return game
+
+    def __str__(self):
+        return str(self.board)
+
+
+def rollouts_per_second(game, seconds=1.0):
+    # Engine speed alone: copy the position, play it out at random, read the winner
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for _ in range(100):
+            rollout = game.copy()
+            rollout.random_playout()
+            rollout.check_winner()
+        count += 100
+    return count / (time.perf_counter() - start)
+
+
+def playouts_per_second(game, seconds=2.0, iterations=200):
+    # MCTS playouts per second from game's position, in MCTS(root, iterations) chunks.
+    # Includes the tree selection, which costs the same for both engines.
+    root = MCTSNode(game)
+    done = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        MCTS(root, iterations)
+        done += iterations
+    return done / (time.perf_counter() - start)
+
+
+def compare_engines(sizes=(3, 4, 5, 6), seconds=2.0):
+    # Rollouts and MCTS playouts per second of the numpy board and the bitboard
+    for size in sizes:
+        numpy_rollouts = rollouts_per_second(TicTacToe(size), seconds / 2)
+        bitboard_rollouts = rollouts_per_second(BitboardTicTacToe(size), seconds / 2)
+        numpy_rate = playouts_per_second(TicTacToe(size), seconds)
+        bitboard_rate = playouts_per_second(BitboardTicTacToe(size), seconds)
+        print(f"{size}x{size}: rollouts numpy {numpy_rollouts:,.0f}/s, bitboard {bitboard_rollouts:,.0f}/s "
+              f"({bitboard_rollouts / numpy_rollouts:.1f}x); MCTS playouts numpy {numpy_rate:,.0f}/s, "
+              f"bitboard {bitboard_rate:,.0f}/s ({bitboard_rate / numpy_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    compare_engines()
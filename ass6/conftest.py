@@ -0,0 +1 @@
+# Lets the tests import the modules by name, like the scripts run from ass6 do
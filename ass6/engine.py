@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from multiprocessing import Pool
+import numpy as np
+from tictactoe import TicTacToe, MCTSNode, MCTS, advance_root
+from bitboard import BitboardTicTacToe
+from batch_rollout import batch_MCTS
+from transposition import ZobristTicTacToe, TranspositionMCTS
+
+
+# Headless engine API and a self-play benchmark, so the engines can be used and measured
+# without the GUI. Engine wraps one game and one search, keeps the search between moves
+# and limits each search by iterations or by a wall-clock budget.
+#
+#   engine = Engine(size=4, kind='bitboard')
+#   move, info = engine.think(seconds=0.5)  # info['iterations'] says how far it got
+#   engine.play(move)
+#
+# Kinds: 'numpy' (TicTacToe and MCTS, only win_condition == size), 'bitboard'
+# (BitboardTicTacToe and MCTS), 'batch' (BitboardTicTacToe and batch_MCTS, batch playouts
+# per iteration) and 'transposition' (TranspositionMCTS).
+#
+# The MCTS kinds choose moves like the GUI does, with root.select_child(). MCTSNode scores
+# every node for O, so in self-play X picks the moves that are best for O and the win rates
+# are not a measure of strength. They are still comparable between optimizations of the
+# same kind.
+KINDS = ['numpy', 'bitboard', 'batch', 'transposition']
+
+
+def count_nodes(root):
+    nodes = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        stack.extend(node.children)
+    return nodes
+
+
+class Engine:
+
+    def __init__(self, size=3, win_condition=None, kind='bitboard', batch=64, chunk=20):
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}")
+        self.size = size
+        self.win_condition = size if win_condition is None else win_condition
+        if kind == 'numpy' and self.win_condition != size:
+            raise ValueError("the numpy engine only plays win_condition == size")
+        self.kind = kind
+        self.batch = batch
+        self.chunk = chunk  # Iterations between checks of the clock
+        self.reset()
+
+    def reset(self):
+        if self.kind == 'numpy':
+            self.game = TicTacToe(self.size)
+        elif self.kind == 'transposition':
+            self.game = ZobristTicTacToe(self.size, self.win_condition)
+            self.search_tree = TranspositionMCTS()
+        else:
+            self.game = BitboardTicTacToe(self.size, self.win_condition)
+        if self.kind != 'transposition':
+            self.root = MCTSNode(self.game.copy())
+
+    def winner(self):
+        return self.game.check_winner()
+
+    def nodes(self):
+        # Nodes the search currently holds for this game
+        if self.kind == 'transposition':
+            return len(self.search_tree.table)
+        return count_nodes(self.root)
+
+    def playouts_per_iteration(self):
+        return self.batch if self.kind == 'batch' else 1
+
+    def run(self, iterations):
+        if self.kind == 'transposition':
+            self.search_tree.search(self.game, iterations)
+        elif self.kind == 'batch':
+            batch_MCTS(self.root, iterations, self.batch)
+        else:
+            MCTS(self.root, iterations)
+
+    def search(self, iterations=None, seconds=None):
+        # Search the current position for iterations iterations or until seconds have
+        # passed, whichever comes first (at least one of them must be given). The time
+        # budget is checked after every chunk iterations, so at least one chunk runs and
+        # there is a move to play even when the budget is already spent. Returns the
+        # iterations done and the time taken.
+        if iterations is None and seconds is None:
+            raise ValueError("give iterations or seconds")
+        done = 0
+        start = time.perf_counter()
+        while iterations is None or done < iterations:
+            step = self.chunk if iterations is None else min(self.chunk, iterations - done)
+            self.run(step)
+            done += step
+            if seconds is not None and time.perf_counter() - start >= seconds:
+                break
+        return {'iterations': done, 'seconds': time.perf_counter() - start}
+
+    def best_move(self):
+        if self.kind == 'transposition':
+            return self.search_tree.choose(self.game)
+        if not self.root.children:
+            return None
+        return self.root.select_child().move
+
+    def think(self, iterations=None, seconds=None):
+        # Search and return (move, search info)
+        info = self.search(iterations, seconds)
+        return self.best_move(), info
+
+    def play(self, move):
+        # Make a move, keeping the subtree (or table) for the new position
+        if move is None:
+            raise ValueError("No move to play: the game is over or nothing was searched")
+        if not self.game.make_move(*move):
+            raise ValueError(f"Invalid move {move}")
+        if self.kind != 'transposition':
+            self.root = advance_root(self.root, move)
+
+
+def self_play(kind='bitboard', size=3, win_condition=None, iterations=None, seconds=None, batch=64, seed=None):
+    # One game of the engine against itself. Search time and the nodes added by the
+    # searches are summed over the moves, counting the nodes costs time itself so it is
+    # done outside the searches.
+    random.seed(seed)
+    engine = Engine(size, win_condition, kind, batch)
+    moves, total_iterations, search_seconds, new_nodes = 0, 0, 0.0, 0
+    while engine.winner() is None:
+        before = engine.nodes()
+        move, info = engine.think(iterations, seconds)
+        new_nodes += max(engine.nodes() - before, 0)
+        total_iterations += info['iterations']
+        search_seconds += info['seconds']
+        engine.play(move)
+        moves += 1
+    return {'winner': int(engine.winner()), 'moves': moves, 'iterations': total_iterations,
+            'playouts': total_iterations * engine.playouts_per_iteration(), 'nodes': new_nodes,
+            'search_seconds': search_seconds}
+
+
+def play_task(task):
+    return task, self_play(**task)
+
+
+def memory_per_node(kind='bitboard', size=3, win_condition=None, iterations=2000, batch=64):
+    # Bytes allocated per search node for a fresh search of iterations iterations. A short
+    # search on another engine first, so one-time caches (win lines, keys) are not counted.
+    Engine(size, win_condition, kind, batch).search(10)
+    engine = Engine(size, win_condition, kind, batch)
+    tracemalloc.start()
+    engine.search(iterations)
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return allocated / max(engine.nodes(), 1)
+
+
+def summarize(config, games, memory):
+    search_seconds = sum(game['search_seconds'] for game in games)
+    winners = [game['winner'] for game in games]
+    per_second = lambda key: sum(game[key] for game in games) / search_seconds if search_seconds > 0 else 0.0
+    return dict(config, games=len(games),
+                x_win_rate=winners.count(1) / len(games), o_win_rate=winners.count(-1) / len(games),
+                draw_rate=winners.count(0) / len(games),
+                mean_moves=float(np.mean([game['moves'] for game in games])),
+                iterations_per_move=sum(game['iterations'] for game in games) / sum(game['moves'] for game in games),
+                playouts_per_sec=per_second('playouts'), iterations_per_sec=per_second('iterations'),
+                nodes_per_sec=per_second('nodes'), bytes_per_node=memory)
+
+
+def benchmark(kinds=('bitboard',), sizes=(3,), win_conditions=(None,), games=10, iterations=None, seconds=None,
+              batch=64, workers=None, seed=0):
+    # Self-play games for every kind, size and win_condition (None means the board size,
+    # ones larger than the board are skipped), played in parallel over workers processes.
+    # Returns one summary dict per configuration.
+    configs = []
+    for kind in kinds:
+        for size in sizes:
+            for win_condition in sorted({size if k is None else k for k in win_conditions}):
+                if win_condition > size or (kind == 'numpy' and win_condition != size):
+                    continue
+                configs.append({'kind': kind, 'size': size, 'win_condition': win_condition})
+    tasks = [dict(config, iterations=iterations, seconds=seconds, batch=batch, seed=seed + i)
+             for config in configs for i in range(games)]
+    results = {}
+    workers = workers or os.cpu_count()
+    if workers > 1:
+        with Pool(processes=workers) as pool:
+            finished = pool.map(play_task, tasks)
+    else:
+        finished = map(play_task, tasks)
+    for task, result in finished:
+        results.setdefault((task['kind'], task['size'], task['win_condition']), []).append(result)
+    summaries = []
+    for config in configs:
+        memory = memory_per_node(config['kind'], config['size'], config['win_condition'], batch=batch)
+        summaries.append(summarize(config, results[(config['kind'], config['size'], config['win_condition'])], memory))
+    return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Self-play benchmark of the TicTacToe engines, JSON on stdout')
+    parser.add_argument('--kinds', nargs='+', default=['bitboard'], choices=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[3])
+    parser.add_argument('--win-conditions', nargs='+', type=int, default=None,
+                        help='k in a row to win, default the board size')
+    parser.add_argument('--games', type=int, default=10, help='games per configuration')
+    parser.add_argument('--iterations', type=int, default=None, help='iterations per move')
+    parser.add_argument('--seconds', type=float, default=None, help='time budget per move')
+    parser.add_argument('--batch', type=int, default=64, help='playouts per iteration of the batch engine')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default one per core')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+    if args.iterations is None and args.seconds is None:
+        args.iterations = 1000
+
+    start = time.perf_counter()
+    summaries = benchmark(args.kinds, args.sizes, args.win_conditions or [None], args.games, args.iterations,
+                          args.seconds, args.batch, args.workers, args.seed)
+    report = {'iterations_per_move': args.iterations, 'seconds_per_move': args.seconds,
+              'workers': args.workers or os.cpu_count(), 'elapsed': time.perf_counter() - start,
+              'results': summaries}
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
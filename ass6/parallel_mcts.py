@@ -0,0 +1,166 @@
+import os
+import random
+import threading
+import time
+from multiprocessing import Pool
+from tictactoe import MCTSNode, MCTS
+from bitboard import BitboardTicTacToe
+
+
+# Parallel versions of MCTS from tictactoe.py, with the same nodes and scoring.
+#
+# Root parallelization: every worker process builds its own tree from the same position
+# with its share of the iterations and a different random seed, and the root children's
+# visits and wins are summed over the trees. The trees never talk to each other, so the
+# workers need no synchronization beyond the final merge. How far that scales has only
+# been measured on a single core so far (a flat curve); run scaling_curve() on a
+# multi-core machine for real numbers.
+#
+# Tree parallelization: several threads grow one shared tree. A thread adds a virtual
+# loss to the nodes of its path while its rollout runs: a visit scored like a lost game,
+# so those nodes look worse and the other threads are steered to different branches. It
+# is replaced with the real result when the thread backpropagates. The tree is only touched under a lock. Threads share the GIL,
+# so this mode gives no speedup on the pure Python rollouts, it is there for engines whose
+# rollouts release the GIL and to compare against root parallelization.
+
+
+def search_root(task):
+    # Worker process: one independent tree, {move: (visits, wins)} of the root's children
+    game, iterations, seed = task
+    random.seed(seed)
+    root = MCTSNode(game)
+    MCTS(root, iterations)
+    return {child.move: (child.visits, child.wins) for child in root.children}
+
+
+def merge_root_stats(results):
+    merged = {}
+    for stats in results:
+        for move, (visits, wins) in stats.items():
+            total_visits, total_wins = merged.get(move, (0, 0))
+            merged[move] = (total_visits + visits, total_wins + wins)
+    return merged
+
+
+class RootParallelMCTS:
+    # Keeps a pool of worker processes between searches, starting them costs more than a
+    # small search. The game has to be picklable (TicTacToe and BitboardTicTacToe are).
+
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.pool = Pool(processes=self.workers) if self.workers > 1 else None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, game, iterations=1000):
+        # Merged {move: (visits, wins)} of iterations split over the workers
+        shares = [iterations // self.workers + (i < iterations % self.workers) for i in range(self.workers)]
+        tasks = [(game, share, random.getrandbits(32)) for share in shares if share > 0]
+        if self.pool is None:
+            return merge_root_stats(map(search_root, tasks))
+        return merge_root_stats(self.pool.map(search_root, tasks))
+
+    def best_move(self, game, iterations=1000):
+        # The most visited move over all trees
+        stats = self.search(game, iterations)
+        if not stats:
+            return None
+        return max(stats, key=lambda move: stats[move][0])
+
+
+# What MCTSNode.update takes off wins for a lost game. The nodes are all scored for O (a
+# win is +1, an X win is -1000000) and select_child maximizes that value on every level,
+# so a loss always lowers wins and a bare extra visit would pull a losing node's negative
+# average up towards 0, a virtual win.
+LOSS = 1000000
+
+
+def add_virtual_loss(leaf, virtual_loss=1):
+    # Count virtual_loss lost visits on the path from leaf up to the root
+    node = leaf
+    while node is not None:
+        node.visits += virtual_loss
+        node.wins -= LOSS * virtual_loss
+        node = node.parent
+
+
+def remove_virtual_loss(leaf, virtual_loss=1):
+    node = leaf
+    while node is not None:
+        node.visits -= virtual_loss
+        node.wins += LOSS * virtual_loss
+        node = node.parent
+
+
+def tree_parallel_MCTS(root, iterations=1000, workers=4, virtual_loss=1):
+    # MCTS(root, iterations) with the iterations shared by workers threads on one tree
+    lock = threading.Lock()
+    remaining = [iterations]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+                node = root
+                game = root.game.copy()
+                if game.check_winner() is None:
+                    while node.untried_moves == [] and node.children != []:
+                        node = node.select_child()
+                        game.make_move(*node.move)
+                    if node.untried_moves != []:
+                        move = random.choice(node.untried_moves)
+                        game.make_move(*move)
+                        node = node.add_child(move)
+                leaf = node
+                add_virtual_loss(leaf, virtual_loss)
+
+            game.random_playout()
+
+            with lock:
+                result = game.check_winner()
+                remove_virtual_loss(leaf, virtual_loss)
+                node = leaf
+                while node is not None:
+                    node.update(result)
+                    node = node.parent
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def scaling_curve(size=5, max_workers=None, iterations=4000):
+    # Playouts per second of both modes for 1 .. max_workers workers, from the empty board
+    max_workers = max_workers or os.cpu_count()
+    game = BitboardTicTacToe(size)
+    print(f"{size}x{size}, {iterations} iterations per search, {os.cpu_count()} cores")
+    base = None
+    for workers in range(1, max_workers + 1):
+        with RootParallelMCTS(workers) as search:
+            search.search(game, workers)  # Start the workers
+            start = time.perf_counter()
+            search.search(game, iterations)
+            root_rate = iterations / (time.perf_counter() - start)
+        start = time.perf_counter()
+        tree_parallel_MCTS(MCTSNode(game), iterations, workers)
+        tree_rate = iterations / (time.perf_counter() - start)
+        base = base or root_rate
+        print(f"{workers} workers: root parallel {root_rate:,.0f} playouts/s ({root_rate / base:.2f}x), "
+              f"tree parallel {tree_rate:,.0f} playouts/s")
+
+
+if __name__ == "__main__":
+    scaling_curve()
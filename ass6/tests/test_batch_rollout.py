@@ -0,0 +1,66 @@
+import random
+import numpy as np
+import pytest
+from tictactoe import TicTacToe, MCTSNode
+from bitboard import BitboardTicTacToe
+from batch_rollout import batch_playouts, batch_MCTS
+
+
+def loop_playouts(game, count):
+    # (X wins, O wins, draws) of count BitboardTicTacToe.random_playout calls
+    results = [0, 0, 0]
+    for _ in range(count):
+        rollout = game.copy()
+        rollout.random_playout()
+        results[{1: 0, -1: 1, 0: 2}[rollout.check_winner()]] += 1
+    return results
+
+
+def position(moves, size=3, win_condition=None):
+    game = BitboardTicTacToe(size, win_condition)
+    for move in moves:
+        game.make_move(*move)
+    return game
+
+
+@pytest.mark.parametrize('moves, size, win_condition', [
+    ([], 3, None),
+    ([(1, 1), (0, 0)], 3, None),
+    ([(0, 0), (1, 1), (2, 2)], 4, 3),
+])
+def test_batch_matches_loop_rollouts(moves, size, win_condition):
+    game = position(moves, size, win_condition)
+    random.seed(0)
+    count = 20000
+    loop = np.array(loop_playouts(game, count)) / count
+    batch = np.array(batch_playouts(game, count, np.random.default_rng(0))) / count
+    assert np.abs(loop - batch).max() < 0.025
+
+
+def test_empty_board_probabilities():
+    # Exact X / O / draw probabilities of random 3x3 play: 737/1260, 121/420, 8/63
+    x_wins, o_wins, draws = batch_playouts(BitboardTicTacToe(3), 50000, np.random.default_rng(1))
+    assert abs(x_wins / 50000 - 737 / 1260) < 0.01
+    assert abs(o_wins / 50000 - 121 / 420) < 0.01
+    assert abs(draws / 50000 - 8 / 63) < 0.01
+
+
+def test_finished_game():
+    game = position([(0, 0), (1, 0), (0, 1), (1, 1), (0, 2)])
+    assert batch_playouts(game, 10) == (10, 0, 0)
+
+
+def test_numpy_games_are_rejected():
+    with pytest.raises(TypeError):
+        batch_playouts(TicTacToe(3), 10)
+    with pytest.raises(TypeError):
+        batch_MCTS(MCTSNode(TicTacToe(3)), 1, 10)
+    converted = BitboardTicTacToe.from_board(TicTacToe(3).board)
+    assert sum(batch_playouts(converted, 10)) == 10
+
+
+def test_batch_MCTS_counts_every_playout():
+    root = MCTSNode(BitboardTicTacToe(3))
+    batch_MCTS(root, 30, 8)
+    assert root.visits == 30 * 8
+    assert sum(child.visits for child in root.children) == 30 * 8
@@ -0,0 +1,83 @@
+import random
+import numpy as np
+import pytest
+from bitboard import BitboardTicTacToe
+from tictactoe import TicTacToe
+
+
+def random_games(size, count, seed=0):
+    # Move sequences of random games on an empty board, played to the end
+    rng = random.Random(seed)
+    for _ in range(count):
+        moves = [(row, col) for row in range(size) for col in range(size)]
+        rng.shuffle(moves)
+        yield moves
+
+
+@pytest.mark.parametrize('size', [3, 4, 5, 6])
+def test_winner_matches_numpy_board(size):
+    for moves in random_games(size, 200, seed=size):
+        game, reference = BitboardTicTacToe(size), TicTacToe(size)
+        for move in moves:
+            assert game.make_move(*move)
+            reference.make_move(*move)
+            assert (game.board == reference.board).all()
+            assert game.current_player == reference.current_player
+            assert game.check_winner() == reference.check_winner()
+            if game.check_winner() is not None:
+                break
+            assert game.get_available_moves() == reference.get_available_moves()
+        else:
+            pytest.fail("the board filled up without a result")
+
+
+def k_in_a_row(board, k):
+    # Brute force: every horizontal, vertical and diagonal window of k cells
+    size = len(board)
+    for row in range(size):
+        for col in range(size):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                cells = [(row + i * dr, col + i * dc) for i in range(k)]
+                if all(0 <= r < size and 0 <= c < size for r, c in cells):
+                    total = sum(board[r, c] for r, c in cells)
+                    if abs(total) == k:
+                        return int(np.sign(total))
+    return 0 if (board != 0).all() else None
+
+
+@pytest.mark.parametrize('size, k', [(4, 3), (5, 4), (6, 4)])
+def test_win_condition_matches_brute_force(size, k):
+    for moves in random_games(size, 200, seed=k):
+        game = BitboardTicTacToe(size, k)
+        for move in moves:
+            game.make_move(*move)
+            assert game.check_winner() == k_in_a_row(game.board, k)
+            if game.check_winner() is not None:
+                break
+
+
+def test_undo_and_from_board():
+    for moves in random_games(4, 50):
+        game = BitboardTicTacToe(4)
+        states = []
+        for move in moves:
+            states.append((game.x_bits, game.o_bits, game.current_player, game.winner))
+            game.make_move(*move)
+            copy = BitboardTicTacToe.from_board(game.board, game.current_player)
+            assert (copy.x_bits, copy.o_bits, copy.winner) == (game.x_bits, game.o_bits, game.winner)
+            if game.winner is not None:
+                break
+        while states:
+            game.undo_move()
+            assert (game.x_bits, game.o_bits, game.current_player, game.winner) == states.pop()
+
+
+def test_rejects_taken_cells_and_moves_after_a_win():
+    game = BitboardTicTacToe(3)
+    assert game.make_move(0, 0)
+    assert not game.make_move(0, 0)
+    for move in [(1, 0), (0, 1), (1, 1), (0, 2)]:
+        game.make_move(*move)
+    assert game.check_winner() == 1
+    assert not game.make_move(2, 2)
+    assert game.get_available_moves() == []
@@ -0,0 +1,31 @@
+import pytest
+from engine import Engine, KINDS, self_play
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_spent_budget_still_searches(kind):
+    engine = Engine(3, kind=kind)
+    move, info = engine.think(seconds=0)
+    assert info['iterations'] == engine.chunk
+    assert move in engine.game.get_available_moves()
+
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_self_play_with_zero_budget(kind):
+    result = self_play(kind, 3, seconds=0, seed=0)
+    assert result['winner'] in (1, -1, 0)
+    assert result['iterations'] >= result['moves']
+
+
+def test_iterations_limit():
+    engine = Engine(4, 3)
+    assert engine.search(iterations=45)['iterations'] == 45
+
+
+def test_play_rejects_missing_and_invalid_moves():
+    engine = Engine(3)
+    with pytest.raises(ValueError):
+        engine.play(None)
+    engine.play((0, 0))
+    with pytest.raises(ValueError):
+        engine.play((0, 0))
@@ -0,0 +1,60 @@
+import random
+import numpy as np
+import pytest
+from bitboard import BitboardTicTacToe
+from parallel_mcts import (RootParallelMCTS, merge_root_stats, search_root, tree_parallel_MCTS,
+                           add_virtual_loss, remove_virtual_loss)
+from tictactoe import MCTSNode, MCTS, TicTacToe
+
+# O to move, the side MCTSNode scores for, and (1, 2) wins on the spot
+WINNING = np.array([[1, 1, 0], [-1, -1, 0], [1, 0, 0]])
+
+
+@pytest.mark.parametrize('workers', [1, 2, 3])
+def test_root_parallel_spends_every_iteration(workers):
+    random.seed(0)
+    with RootParallelMCTS(workers) as search:
+        stats = search.search(BitboardTicTacToe(3), iterations=301)
+    assert set(stats) == set(BitboardTicTacToe(3).get_available_moves())
+    assert sum(visits for visits, _ in stats.values()) == 301
+
+
+def test_merge_sums_the_trees():
+    game = TicTacToe(3)
+    first, second = search_root((game, 100, 1)), search_root((game, 50, 2))
+    merged = merge_root_stats([first, second])
+    for move, (visits, wins) in merged.items():
+        assert visits == first.get(move, (0, 0))[0] + second.get(move, (0, 0))[0]
+        assert wins == first.get(move, (0, 0))[1] + second.get(move, (0, 0))[1]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_tree_parallel_removes_virtual_loss(workers):
+    random.seed(0)
+    root = MCTSNode(TicTacToe(3))
+    tree_parallel_MCTS(root, iterations=400, workers=workers)
+    assert root.visits == 400
+    assert sum(child.visits for child in root.children) == 400
+
+
+def test_both_take_the_winning_move():
+    random.seed(0)
+    with RootParallelMCTS(2) as search:
+        assert search.best_move(BitboardTicTacToe.from_board(WINNING, current_player=-1), iterations=400) == (1, 2)
+    root = MCTSNode(BitboardTicTacToe.from_board(WINNING, current_player=-1))
+    tree_parallel_MCTS(root, iterations=400, workers=2)
+    assert max(root.children, key=lambda child: child.visits).move == (1, 2)
+
+
+def test_virtual_loss_lowers_the_uct_of_in_flight_nodes():
+    random.seed(0)
+    root = MCTSNode(TicTacToe(3))
+    MCTS(root, iterations=300)
+    for child in root.children:
+        leaf = child.children[0] if child.children else child
+        before = [(node.visits, node.wins) for node in (leaf, child, root)]
+        scores = [node.UCT() for node in (leaf, child)]
+        add_virtual_loss(leaf, 2)
+        assert all(node.UCT() < score for node, score in zip((leaf, child), scores))
+        remove_virtual_loss(leaf, 2)
+        assert [(node.visits, node.wins) for node in (leaf, child, root)] == before
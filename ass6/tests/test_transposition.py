@@ -0,0 +1,97 @@
+import random
+import numpy as np
+import pytest
+from transposition import ZobristTicTacToe, TranspositionMCTS, TranspositionTable, TreeMCTS
+
+
+def symmetries(board):
+    # The 8 rotations and reflections of a numpy board
+    for flipped in (board, np.fliplr(board)):
+        for turns in range(4):
+            yield np.rot90(flipped, turns)
+
+
+def canonical(board):
+    return min(tuple(b.flatten().tolist()) for b in symmetries(board))
+
+
+def random_positions(size, count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        game = ZobristTicTacToe(size)
+        game.hashes  # Keep them up to date incrementally from the start
+        for _ in range(rng.randrange(size * size)):
+            moves = game.get_available_moves()
+            if not moves:
+                break
+            game.make_move(*rng.choice(moves))
+        yield game
+
+
+@pytest.mark.parametrize('size', [3, 4])
+def test_incremental_hashes_match_recomputed(size):
+    for game in random_positions(size, 200, seed=size):
+        fresh = ZobristTicTacToe.from_board(game.board, game.current_player)
+        assert game.hashes == fresh.hashes
+        if game.history:
+            game.undo_move()
+            fresh = ZobristTicTacToe.from_board(game.board, game.current_player)
+            assert game.hashes == fresh.hashes
+
+
+@pytest.mark.parametrize('size', [3, 4])
+def test_symmetric_positions_share_a_key(size):
+    keys = {}
+    for game in random_positions(size, 300, seed=size):
+        for board in symmetries(game.board):
+            assert ZobristTicTacToe.from_board(board, game.current_player).key == game.key
+        # And different positions don't share one
+        assert keys.setdefault(game.key, canonical(game.board)) == canonical(game.board)
+
+
+def test_canonical_cells_round_trip():
+    for game in random_positions(4, 50):
+        for cell in range(16):
+            assert game.board_cell(game.canonical_cell(cell)) == cell
+        # The position after a move has the key child_key promised
+        moves = game.get_available_moves()
+        if moves:
+            key = game.child_key(*moves[0])
+            game.make_move(*moves[0])
+            assert game.key == key
+
+
+def test_search_table_holds_distinct_positions():
+    # 3x3 tic-tac-toe has 765 positions up to symmetry
+    random.seed(0)
+    search = TranspositionMCTS()
+    search.search(ZobristTicTacToe(3), iterations=3000)
+    assert len(search.table) <= 765
+    assert search.table.stats()['hits'] > 0
+
+
+def test_takes_the_winning_move():
+    random.seed(0)
+    game = ZobristTicTacToe.from_board(np.array([[1, 1, 0], [-1, -1, 0], [0, 0, 0]]), current_player=1)
+    assert TranspositionMCTS().best_move(game, iterations=500) == (0, 2)
+
+
+def test_prune_keeps_the_root():
+    random.seed(0)
+    search = TranspositionMCTS(TranspositionTable(max_entries=50))
+    game = ZobristTicTacToe(3)
+    search.search(game, iterations=500)
+    assert len(search.table) <= 51
+    assert game.key in search.table.entries
+    assert search.table.evictions > 0
+
+
+def test_tree_search_is_never_pruned():
+    random.seed(0)
+    search = TreeMCTS()
+    search.search(ZobristTicTacToe(3), iterations=2000)
+    assert search.table.evictions == 0
+    # Every iteration that doesn't end on a known finished game adds a node
+    assert len(search.table) > 1000
+    search.table.prune()
+    assert search.table.evictions == 0
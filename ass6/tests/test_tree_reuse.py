@@ -0,0 +1,71 @@
+import random
+import threading
+import time
+import numpy as np
+from tictactoe import MCTSNode, MCTS, TicTacToe, TicTacToeGUI, advance_root
+
+
+def test_advance_keeps_the_subtree():
+    random.seed(0)
+    root = MCTSNode(TicTacToe(3))
+    MCTS(root, iterations=500)
+    child = max(root.children, key=lambda c: c.visits)
+    visits, wins = child.visits, child.wins
+    new_root = advance_root(root, child.move)
+    assert new_root is child and new_root.parent is None
+    assert (new_root.visits, new_root.wins) == (visits, wins)
+    # Searching on from the new root no longer backpropagates into the old one
+    root_visits = root.visits
+    MCTS(new_root, iterations=100)
+    assert new_root.visits == visits + 100
+    assert root.visits == root_visits
+
+
+def test_advance_to_an_unexpanded_move():
+    random.seed(0)
+    root = MCTSNode(TicTacToe(3))
+    MCTS(root, iterations=3)
+    move = root.untried_moves[0]
+    new_root = advance_root(root, move)
+    assert new_root.visits == 0 and new_root.parent is None
+    expected = TicTacToe(3)
+    expected.make_move(*move)
+    assert np.array_equal(new_root.game.board, expected.board)
+    assert new_root.game.current_player == -1
+    assert move not in new_root.untried_moves
+
+
+def searcher(ponder_iterations):
+    # The search state of a TicTacToeGUI without its window
+    gui = TicTacToeGUI.__new__(TicTacToeGUI)
+    gui.game = TicTacToe(3)
+    gui.root = MCTSNode(gui.game.copy())
+    gui.lock = threading.Lock()
+    gui.iterations = 0
+    gui.thinking = False
+    gui.ponder = True
+    gui.ponder_iterations = ponder_iterations
+    gui.chunk = 50
+    gui.poll_ms = 1
+    gui.stopped = threading.Event()
+    return gui
+
+
+def test_pondering_stops_at_its_budget():
+    gui = searcher(200)
+    worker = threading.Thread(target=gui.search_loop, daemon=True)
+    worker.start()
+    try:
+        deadline = time.time() + 10
+        while gui.iterations < 200 and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert gui.iterations == gui.root.visits == 200
+        # The AI's turn searches past the ponder budget
+        gui.thinking = True
+        while gui.iterations < 400 and time.time() < deadline:
+            time.sleep(0.01)
+        assert gui.iterations >= 400
+    finally:
+        gui.stopped.set()
+        worker.join()
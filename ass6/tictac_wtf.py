@@ -229,4 +229,5 @@ def main():
     app = TicTacToeGUI(root, size=3, win_condition=3, mcts_iterations=50)
     root.mainloop()
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
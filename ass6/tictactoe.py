@@ -1,6 +1,8 @@
 import numpy as np
 import random
 import math
+import threading
+import time
 import tkinter as tk
 
 
@@ -43,6 +45,12 @@ class TicTacToe:
 
         return new_game
 
+    def random_playout(self):
+        # Random moves until the board is full, the MCTS simulation step
+        while self.get_available_moves() != []:
+            move = random.choice(self.get_available_moves())
+            self.make_move(*move)
+
 class MCTSNode:
     def __init__(self, game, parent=None, move=None):
         self.game = game
@@ -61,10 +69,10 @@ class MCTSNode:
             return float('inf')
 
     def select_child(self):
-        sorted_children = sorted(self.children, key=lambda c: c.UCT())
-        #print([c.UCT() for c in sorted_children])
-        
-        selected_child = max(sorted_children, key=lambda c: c.UCT())
+        # Same value as UCT() for every child, with the parent's log computed once.
+        # max keeps the first of equal children, like max over the stably sorted list did
+        log_visits = math.log(self.visits)
+        selected_child = max(self.children, key=lambda c: c.wins / c.visits + math.sqrt(2) * math.sqrt(log_visits / c.visits))
         #print(f"Selected move: {selected_child.move} with UCT: {selected_child.UCT()}")
         
         return selected_child
@@ -91,6 +99,12 @@ class MCTSNode:
         
         elif result == 1:
             self.wins -= 1000000
+
+
+    def update_batch(self, x_wins, o_wins, draws):
+        # update() for many playout results at once
+        self.visits += x_wins + o_wins + draws
+        self.wins += o_wins + 0.5 * draws - 1000000 * x_wins
         
 
 def MCTS(root, iterations=1000):
@@ -109,19 +123,36 @@ def MCTS(root, iterations=1000):
                 game.make_move(*move)
                 node = node.add_child(move)
             
-            while game.get_available_moves() != []:
-                move = random.choice(game.get_available_moves())
-                game.make_move(*move)
+            game.random_playout()
 
             while node is not None:
                 node.update(game.check_winner())
                 node = node.parent
 
 
+def advance_root(root, move):
+    # The subtree after move becomes the new root, with all its statistics. The old root is
+    # cut off so the rest of the old tree can be freed (and MCTS stops backpropagating
+    # into it). A move that was never expanded gets a fresh node.
+    for child in root.children:
+        if child.move == move:
+            child.parent = None
+            return child
+    game = root.game.copy()
+    game.make_move(*move)
+    return MCTSNode(game)
+
+
 
 class TicTacToeGUI:
+    # The search tree is kept between turns: after every move the matching child becomes the
+    # root. A background thread keeps running MCTS on the current root in small chunks, also
+    # while the human is thinking (pondering). Pondering stops after ponder_iterations
+    # iterations on a position, every iteration adds a node, so a human who takes their
+    # time doesn't grow the tree without bound. The thread never touches Tk, ai_move polls
+    # it with after() and plays once it has done mtsc_iterations more iterations.
     
-    def __init__(self, master, size=3, mtsc_iterations=1000):
+    def __init__(self, master, size=3, mtsc_iterations=1000, ponder=True, chunk=50, poll_ms=50, ponder_iterations=20000):
         self.mtsc_iterations = mtsc_iterations
         self.master = master
         self.size = size 
@@ -129,6 +160,19 @@ class TicTacToeGUI:
         self.buttons = [[None for _ in range(self.size)] for _ in range(self.size)]
         self.initialize_board()
 
+        self.ponder = ponder
+        self.ponder_iterations = ponder_iterations
+        self.chunk = chunk
+        self.poll_ms = poll_ms
+        self.root = MCTSNode(self.game.copy())
+        self.lock = threading.Lock()  # Held while the worker runs MCTS on self.root
+        self.iterations = 0  # Iterations on the current root so far
+        self.thinking = False  # AI's turn, clicks are ignored
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.search_loop, daemon=True)
+        self.worker.start()
+        self.master.protocol('WM_DELETE_WINDOW', self.close)
+
 
     def initialize_board(self):
         for i in range(self.size):
@@ -139,14 +183,39 @@ class TicTacToeGUI:
                 self.buttons[i][j] = button
 
 
+    def search_loop(self):
+        # Worker thread: search the current root while the game is on. Without pondering
+        # it only searches on the AI's turn, with it also on the human's turn until the
+        # ponder budget is spent.
+        while not self.stopped.is_set():
+            with self.lock:
+                searching = self.game.check_winner() is None and (
+                    self.thinking or (self.ponder and self.iterations < self.ponder_iterations))
+                if searching:
+                    MCTS(self.root, iterations=self.chunk)
+                    self.iterations += self.chunk
+            if not searching:
+                time.sleep(self.poll_ms / 1000)
+
+
+    def play(self, move):
+        # Make a move on the board and in the tree
+        with self.lock:
+            self.game.make_move(*move)
+            self.root = advance_root(self.root, move)
+            self.iterations = 0
+
+
     def on_click(self, row, col):
-        if self.game.make_move(row, col):
-            self.update_buttons()
-            winner = self.game.check_winner()
-            if winner is not None:
-                self.end_game(winner)
-            else:
-                self.ai_move()
+        if self.thinking or self.game.board[row, col] != 0 or self.game.check_winner() is not None:
+            return
+        self.play((row, col))
+        self.update_buttons()
+        winner = self.game.check_winner()
+        if winner is not None:
+            self.end_game(winner)
+        else:
+            self.ai_move()
 
 
     def update_buttons(self):
@@ -157,16 +226,32 @@ class TicTacToeGUI:
 
 
     def ai_move(self):
-        root = MCTSNode(self.game)
-        MCTS(root, iterations=self.mtsc_iterations)
-        move = root.select_child().move
-        self.game.make_move(*move)
+        # Start the AI's turn, the move is made by check_search once mtsc_iterations
+        # iterations have been run on this position. What the tree already knows about it
+        # from earlier searches and pondering comes on top.
+        self.thinking = True
+        self.master.after(self.poll_ms, self.check_search)
+
+
+    def check_search(self):
+        if self.iterations < self.mtsc_iterations:
+            self.master.after(self.poll_ms, self.check_search)
+            return
+        with self.lock:
+            move = self.root.select_child().move
+        self.play(move)
+        self.thinking = False
         self.update_buttons()
         winner = self.game.check_winner()
         if winner is not None:
             self.end_game(winner)
 
 
+    def close(self):
+        self.stopped.set()
+        self.master.destroy()
+
+
     def end_game(self, winner):
         result = {1: 'X wins!', -1: 'O wins!', 0: 'Draw!'}[winner]
         message = tk.Message(self.master, text=result, width=200)
@@ -184,7 +269,8 @@ def main():
     app = TicTacToeGUI(root, size=4, mtsc_iterations=1000)
     root.mainloop()
 
-main()
+if __name__ == "__main__":
+    main()
 
 
 '''
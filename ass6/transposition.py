@@ -0,0 +1,315 @@
+import math
+import random
+from functools import lru_cache
+from operator import xor
+from bitboard import BitboardTicTacToe
+from tictactoe import MCTSNode, MCTS
+
+
+# Transposition table for MCTS. Positions are keyed by a Zobrist hash that is updated with
+# one XOR per move, and symmetric positions (the 8 rotations and reflections of the board)
+# share one key: the game keeps a hash for each symmetry and the key is the smallest one.
+# The search graph is then a DAG, positions reached through different move orders or
+# mirrored moves are one node. Node values are shared by every path into a node, visit
+# counts for the exploration term are kept per edge so each parent still explores its own
+# moves, and every iteration updates the nodes of the path it took.
+
+
+@lru_cache(maxsize=None)
+def dihedral_permutations(size):
+    # For each of the 8 symmetries of the square, the cell every cell is mapped to
+    def transforms(row, col):
+        last = size - 1
+        return [(row, col), (col, last - row), (last - row, last - col), (last - col, row),
+                (row, last - col), (last - row, col), (col, row), (last - col, last - row)]
+    images = [transforms(cell // size, cell % size) for cell in range(size * size)]
+    return tuple(tuple(images[cell][s][0] * size + images[cell][s][1] for cell in range(size * size)) for s in range(8))
+
+
+@lru_cache(maxsize=None)
+def inverse_permutations(size):
+    inverses = []
+    for permutation in dihedral_permutations(size):
+        inverse = [0] * len(permutation)
+        for cell, image in enumerate(permutation):
+            inverse[image] = cell
+        inverses.append(tuple(inverse))
+    return tuple(inverses)
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(size, seed=0):
+    # keys[player][cell]: the 8 symmetry hashes' keys for a stone of player (0 = X, 1 = O)
+    rng = random.Random(seed)
+    base = [[rng.getrandbits(64) for _ in range(size * size)] for _ in range(2)]
+    permutations = dihedral_permutations(size)
+    return tuple(tuple(tuple(base[player][permutation[cell]] for permutation in permutations)
+                       for cell in range(size * size)) for player in range(2))
+
+
+class ZobristTicTacToe(BitboardTicTacToe):
+    # BitboardTicTacToe that keeps its 8 symmetry hashes up to date. key is the same for a
+    # position and its rotations and reflections. Hash s is the hash of the board with every
+    # cell moved by permutation s, the canonical board is the one with the smallest hash, and
+    # canonical_cell/board_cell translate cells between this board and the canonical one.
+
+    def __init__(self, size=3, win_condition=None):
+        super().__init__(size, win_condition)
+        self.keys = zobrist_keys(size)
+        self.permutations = dihedral_permutations(size)
+        self.inverses = inverse_permutations(size)
+        self._hashes = None  # Recomputed from the stones when needed
+
+    @property
+    def hashes(self):
+        if self._hashes is None:
+            hashes = (0,) * 8
+            for player, stones in ((0, self.x_bits), (1, self.o_bits)):
+                for cell in range(self.size * self.size):
+                    if stones >> cell & 1:
+                        hashes = tuple(map(xor, hashes, self.keys[player][cell]))
+            self._hashes = hashes
+        return self._hashes
+
+    @property
+    def key(self):
+        return min(self.hashes)
+
+    @property
+    def symmetry(self):
+        hashes = self.hashes
+        return hashes.index(min(hashes))
+
+    def canonical_cell(self, cell):
+        return self.permutations[self.symmetry][cell]
+
+    def board_cell(self, canonical):
+        return self.inverses[self.symmetry][canonical]
+
+    def make_move(self, row, col):
+        mover = self.current_player
+        if not super().make_move(row, col):
+            return False
+        if self._hashes is not None:
+            self._hashes = tuple(map(xor, self._hashes, self.keys[0 if mover == 1 else 1][self.history[-1]]))
+        return True
+
+    def undo_move(self):
+        cell = self.history[-1]
+        super().undo_move()
+        if self._hashes is not None:
+            self._hashes = tuple(map(xor, self._hashes, self.keys[0 if self.current_player == 1 else 1][cell]))
+
+    def random_playout(self):
+        super().random_playout()
+        self._hashes = None
+
+    def child_key(self, row, col):
+        # Key of the position after a move, without keeping the move
+        self.make_move(row, col)
+        key = self.key
+        self.undo_move()
+        return key
+
+
+class TableEntry:
+    __slots__ = ('visits', 'wins', 'children', 'edge_visits')
+
+    def __init__(self):
+        self.visits = 0
+        self.wins = 0.0  # For the player who moved into this position: 1 win, 0.5 draw
+        self.children = None  # child key -> canonical cell of one move leading there
+        self.edge_visits = {}  # child key -> times this node went there
+
+
+class TranspositionTable:
+    # Entries by canonical key, at most max_entries of them. When full, the least visited
+    # quarter is dropped (never the entries passed as keep); a dropped position simply
+    # starts over if the search reaches it again.
+
+    def __init__(self, max_entries=500000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = self.entries[key] = TableEntry()
+        else:
+            self.hits += 1
+        return entry
+
+    def prune(self, keep=()):
+        if len(self.entries) <= self.max_entries:
+            return
+        target = self.max_entries * 3 // 4
+        ranked = sorted(self.entries.items(), key=lambda item: item[1].visits)
+        for key, _ in ranked[:len(self.entries) - target]:
+            if key not in keep:
+                del self.entries[key]
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0, 'evictions': self.evictions}
+
+
+def as_zobrist(game):
+    # ZobristTicTacToe copy of a TicTacToe, BitboardTicTacToe or ZobristTicTacToe position
+    if isinstance(game, ZobristTicTacToe):
+        return game.copy()
+    win_condition = getattr(game, 'win_condition', None)
+    return ZobristTicTacToe.from_board(game.board, game.current_player, win_condition)
+
+
+class TranspositionMCTS:
+    # UCT search over the transposition table. The table can be kept between moves (and
+    # shared between searches of the same game), everything learned about a position is
+    # reused whenever it comes up again.
+
+    def __init__(self, table=None, exploration=math.sqrt(2)):
+        self.table = table if table is not None else TranspositionTable()
+        self.exploration = exploration
+        self.max_depth = 0
+        self.total_depth = 0
+        self.iterations = 0
+
+    def expand(self, game, entry):
+        # One representative move per distinct child position, so mirrored moves count once.
+        # The move is stored on the canonical board: the same position can be reached again
+        # rotated or mirrored, and its moves have to be translated to that board.
+        entry.children = {}
+        for row, col in game.get_available_moves():
+            entry.children.setdefault(game.child_key(row, col), game.canonical_cell(row * game.size + col))
+
+    def select(self, entry):
+        # UCT: the child's shared value plus exploration from this node's own edge counts.
+        # Children not taken from this node yet come first.
+        untried = [key for key in entry.children if key not in entry.edge_visits]
+        if untried:
+            return random.choice(untried)
+        log_visits = math.log(sum(entry.edge_visits.values()))
+        entries = self.table.entries
+
+        def uct(key):
+            child = entries.get(key)
+            value = child.wins / child.visits if child is not None and child.visits else 0.5
+            return value + self.exploration * math.sqrt(log_visits / entry.edge_visits[key])
+
+        return max(entry.children, key=uct)
+
+    def iterate(self, root_game, root_key):
+        game = root_game.copy()
+        entry = self.table.lookup(root_key)
+        path = [(entry, None, None)]  # (entry, parent entry, key)
+        while game.winner is None:
+            if entry.children is None:
+                self.expand(game, entry)
+            key = self.select(entry)
+            game.make_move(*game.moves[game.board_cell(entry.children[key])])
+            parent, entry = entry, self.table.lookup(key)
+            path.append((entry, parent, key))
+            if entry.visits == 0:
+                # New position: play it out at random. A position seen before through
+                # another move order is searched further instead.
+                game.random_playout()
+                break
+        result = game.winner
+        depth = len(path) - 1
+        self.max_depth = max(self.max_depth, depth)
+        self.total_depth += depth
+        self.iterations += 1
+
+        # Each node on the path counts the result for the player who moved into it. Nodes
+        # at even depth were entered by the player who moved last into the root.
+        mover = -root_game.current_player
+        for entry, parent, key in path:
+            entry.visits += 1
+            entry.wins += 1.0 if result == mover else 0.5 if result == 0 else 0.0
+            if parent is not None:
+                parent.edge_visits[key] = parent.edge_visits.get(key, 0) + 1
+            mover = -mover
+
+    def search(self, game, iterations=1000):
+        game = as_zobrist(game)
+        root_key = game.key
+        for i in range(iterations):
+            self.iterate(game, root_key)
+            if len(self.table) > self.table.max_entries:
+                self.table.prune(keep={root_key})
+        return self.table.entries[root_key]
+
+    def choose(self, game):
+        # The most visited move from game's position so far, in game's own coordinates
+        game = as_zobrist(game)
+        root = self.table.entries.get(game.key)
+        if root is None or not root.edge_visits:
+            return None
+        key = max(root.edge_visits, key=root.edge_visits.get)
+        return game.moves[game.board_cell(root.children[key])]
+
+    def best_move(self, game, iterations=1000):
+        self.search(game, iterations)
+        return self.choose(game)
+
+    def stats(self):
+        return dict(self.table.stats(), max_depth=self.max_depth,
+                    mean_depth=self.total_depth / self.iterations if self.iterations else 0.0)
+
+
+class TreeMCTS(TranspositionMCTS):
+    # The same search without sharing: every child is keyed by its parent and move, so each
+    # move order and orientation of a position gets its own node, like an MCTSNode tree.
+    # Only for comparisons. Children are keyed by id() of their parent's entry, which is
+    # only unique while no entry is ever freed, so the table is never pruned.
+
+    def __init__(self, exploration=math.sqrt(2)):
+        super().__init__(TranspositionTable(max_entries=math.inf), exploration)
+
+    def expand(self, game, entry):
+        entry.children = {}
+        for row, col in game.get_available_moves():
+            cell = game.canonical_cell(row * game.size + col)
+            entry.children[(id(entry), cell)] = cell
+
+
+def tree_stats(root):
+    # (nodes, distinct positions up to symmetry, max depth) of an MCTSNode tree
+    nodes, max_depth, positions = 0, 0, set()
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        nodes += 1
+        positions.add(as_zobrist(node.game).key)
+        max_depth = max(max_depth, depth)
+        stack.extend((child, depth + 1) for child in node.children)
+    return nodes, len(positions), max_depth
+
+
+def compare_searches(sizes=(3, 4, 5), iterations=10000):
+    # Size and depth of the MCTS in tictactoe.py, of the same UCT search as a tree and of
+    # the transposition table after the same number of iterations from the empty board.
+    # A tree stores a position once for every move order and orientation it was reached in,
+    # the table once.
+    for size in sizes:
+        root = MCTSNode(BitboardTicTacToe(size))
+        MCTS(root, iterations)
+        nodes, positions, depth = tree_stats(root)
+        print(f"{size}x{size}, {iterations} iterations: MCTS {nodes:,} nodes ({positions:,} positions), depth {depth}")
+        for name, search in (('UCT tree', TreeMCTS()), ('table', TranspositionMCTS())):
+            search.search(ZobristTicTacToe(size), iterations)
+            stats = search.stats()
+            print(f"    {name}: {stats['entries']:,} nodes, depth {stats['max_depth']} (mean {stats['mean_depth']:.2f}), "
+                  f"hit rate {stats['hit_rate']:.2f}")
+
+
+if __name__ == "__main__":
+    compare_searches()
@@ -0,0 +1 @@
+# Lets the tests import the package as src.*, like the scripts run from spotify_proj do
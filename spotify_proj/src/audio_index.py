@@ -0,0 +1,414 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Nearest-neighbour index for the audio-feature recommender in recommendations.ipynb.
+# The notebook searches X_combined = [scaled audio features, one-hot genre * genre_weight]
+# with a brute-force NearestNeighbors. Because the genre block is one-hot, the squared
+# distance splits into
+#   ||x - q||^2 over the 9 audio features + genre_weight^2 * (|p|^2 + 1 - 2 * p[genre of x])
+# where p is the query's genre distribution (one-hot for a song, the average for a
+# playlist centroid). The genre term is a constant per genre, so the index only stores the
+# 9 scaled features as float32, partitioned by genre and, inside each genre, into k-means
+# cells (IVF). A query first scans the closest cells (genre term plus centroid distance),
+# then every cell whose triangle-inequality lower bound (genre term plus centroid distance
+# minus cell radius) can still beat the current k-th distance. That makes the default search exact; nprobe caps the
+# number of cells for an approximate search. Product quantization is not used: 9 float32
+# values per song are already 36 bytes.
+#
+# The index is a directory of .npy files plus meta.json, opened with memory maps.
+
+NUMERICAL_FEATURES = ['acousticness', 'danceability', 'energy', 'instrumentalness', 'liveness', 'loudness', 'speechiness', 'tempo', 'valence']
+INDEX_VERSION = 1
+ARRAYS = ['vectors', 'row_genre', 'order', 'cell_offsets', 'cell_genre', 'centroids', 'radii',
+          'genre_cells', 'key_hashes', 'key_positions', 'name_offsets', 'names']
+
+
+def normalize_key(artist, track):
+    # Case-insensitive like the notebook's str.lower() comparison
+    return f"{artist.lower()}\0{track.lower()}"
+
+
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def kmeans(vectors, cells, iterations=8, sample_size=20000, seed=0):
+    # Plain Lloyd iterations on a sample, then one assignment of every vector
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), cells, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroid(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        sizes = np.bincount(assignment, minlength=cells)
+        filled = sizes > 0
+        centroids[filled] = sums[filled] / sizes[filled, None]
+    return centroids, nearest_centroid(vectors, centroids)
+
+
+def nearest_centroid(vectors, centroids, chunk=65536):
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        assignment[start:start + chunk] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return assignment
+
+
+def build_audio_index(song_data, path, features=NUMERICAL_FEATURES, cells_per_genre=None, seed=0):
+    # song_data is the DataFrame read from song_data.csv, or any mapping of its columns
+    # (artist_name, track_name, genre and the audio features). Writes the index directory
+    # and returns it opened.
+    raw = np.column_stack([np.asarray(song_data[feature], dtype=np.float64) for feature in features])
+    mean = raw.mean(axis=0)
+    std = raw.std(axis=0)  # Population std, like StandardScaler
+    std[std == 0] = 1.0
+    scaled = ((raw - mean) / std).astype(np.float32)
+    # Sorted categories, like OneHotEncoder
+    genres, genre_ids = np.unique(np.asarray(song_data['genre']).astype(str), return_inverse=True)
+    genre_ids = genre_ids.reshape(-1)
+
+    order_parts, cell_sizes, cell_genre, centroid_parts, genre_cells = [], [], [], [], [0]
+    for genre in range(len(genres)):
+        members = np.flatnonzero(genre_ids == genre)
+        cells = cells_per_genre or max(1, min(1024, int(np.sqrt(len(members)))))
+        cells = min(cells, len(members))
+        centroids, assignment = kmeans(scaled[members], cells, seed=seed + genre)
+        sizes = np.bincount(assignment, minlength=cells)
+        used = np.flatnonzero(sizes)  # Drop empty cells
+        order_parts.append(members[np.argsort(assignment, kind='stable')])
+        cell_sizes.append(sizes[used])
+        cell_genre.append(np.full(len(used), genre, dtype=np.int32))
+        centroid_parts.append(centroids[used])
+        genre_cells.append(genre_cells[-1] + len(used))
+
+    order = np.concatenate(order_parts)
+    vectors = scaled[order]
+    cell_offsets = np.zeros(sum(len(s) for s in cell_sizes) + 1, dtype=np.int64)
+    np.cumsum(np.concatenate(cell_sizes), out=cell_offsets[1:])
+    centroids = np.concatenate(centroid_parts).astype(np.float32)
+    cell_of_row = np.repeat(np.arange(len(centroids)), np.diff(cell_offsets))
+    radii = np.zeros(len(centroids), dtype=np.float32)
+    np.maximum.at(radii, cell_of_row, np.sqrt(((vectors - centroids[cell_of_row]) ** 2).sum(axis=1)))
+
+    # Names and the hashed (artist, track) lookup, in index order. The first row of a
+    # duplicated song wins, like song_query.iloc[0] in the notebook.
+    artists = np.asarray(song_data['artist_name']).astype(str)[order]
+    tracks = np.asarray(song_data['track_name']).astype(str)[order]
+    encoded = [f"{artist}\0{track}".encode('utf-8') for artist, track in zip(artists, tracks)]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=name_offsets[1:])
+    hashes = np.fromiter((key_hash(normalize_key(a, t)) for a, t in zip(artists, tracks)), dtype=np.uint64, count=len(order))
+    by_hash = np.lexsort((order, hashes))  # Equal hashes in original row order
+    arrays = {
+        'vectors': vectors,
+        'row_genre': genre_ids[order].astype(np.int16),
+        'order': order,
+        'cell_offsets': cell_offsets,
+        'cell_genre': np.concatenate(cell_genre),
+        'centroids': centroids,
+        'radii': radii,
+        'genre_cells': np.array(genre_cells, dtype=np.int64),
+        'key_hashes': hashes[by_hash],
+        'key_positions': by_hash.astype(np.int64),
+        'name_offsets': name_offsets,
+        'names': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+    }
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+    meta = {'version': INDEX_VERSION, 'features': list(features), 'genres': genres.tolist(),
+            'mean': mean.tolist(), 'std': std.tolist(), 'songs': len(order)}
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+    return AudioFeatureIndex(path)
+
+
+def importance_weights(vectors):
+    # The notebook's playlist feature weighting: features the playlist agrees on count more
+    weights = 1 / (np.var(vectors, axis=0) + 1e-6)
+    return weights / weights.max()
+
+
+class AudioFeatureIndex:
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            meta = json.load(file)
+        if meta['version'] != INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} audio index")
+        self.features = meta['features']
+        self.genres = meta['genres']
+        self.mean = np.array(meta['mean'])
+        self.std = np.array(meta['std'])
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None))
+        # Arrays read by every query are kept in memory (36 bytes per song for the vectors),
+        # the names and the lookup table stay memory mapped
+        self.vectors = np.array(self.vectors)
+        self.row_genre = np.array(self.row_genre)
+        self.centroids = np.array(self.centroids)
+        self.radii = np.array(self.radii)
+        self.cell_offsets = np.array(self.cell_offsets)
+        self.genre_cells = np.array(self.genre_cells)
+        self.cell_genre_memory = np.array(self.cell_genre)
+        self.cell_sizes = np.diff(self.cell_offsets)
+
+    def __len__(self):
+        return len(self.order)
+
+    def song_position(self, artist, track):
+        # Index position of a song (case-insensitive), None if it is not in the index
+        key = normalize_key(artist, track)
+        target = np.uint64(key_hash(key))
+        start = int(np.searchsorted(self.key_hashes, target, side='left'))
+        while start < len(self.key_hashes) and self.key_hashes[start] == target:
+            position = int(self.key_positions[start])
+            if normalize_key(*self.song_name(position)) == key:
+                return position
+            start += 1
+        return None
+
+    def song_name(self, position):
+        name = self.names[self.name_offsets[position]:self.name_offsets[position + 1]].tobytes()
+        return tuple(name.decode('utf-8').split('\0', 1))
+
+    def scale(self, raw_features):
+        # Raw audio features -> the index's scaled space
+        return ((np.asarray(raw_features, dtype=np.float64) - self.mean) / self.std).astype(np.float32)
+
+    def genre_distribution(self, positions):
+        return np.bincount(np.asarray(self.row_genre[positions], dtype=np.int64), minlength=len(self.genres)) / len(positions)
+
+    def cell_positions(self, cells):
+        starts = self.cell_offsets[cells]
+        lengths = self.cell_offsets[cells + 1] - starts
+        return np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths) + np.arange(lengths.sum())
+
+    def search_one(self, query, genre_distribution, k=10, genre_weight=20, feature_weights=None, nprobe=None, exclude=()):
+        # k nearest positions and squared distances for one query in the combined space
+        genre_terms = genre_weight ** 2 * ((genre_distribution ** 2).sum() + 1 - 2 * genre_distribution)
+        scale = np.float32(1) if feature_weights is None else np.asarray(feature_weights, dtype=np.float32)
+        exclude = np.asarray(list(exclude), dtype=np.int64)
+        wanted = k + len(exclude)
+
+        # Lower bound of every cell: its genre term plus the distance to the cell's ball.
+        # The radii get a little slack for float32 rounding, so a bound never exceeds a true
+        # distance. With feature weights the smallest weight keeps the bound valid.
+        cell_terms = genre_terms[self.cell_genre_memory]
+        centroid_distances = ((self.centroids - query) ** 2).sum(axis=1)
+        gap = np.sqrt(centroid_distances) - self.radii * 1.0001 - 1e-4
+        gap = np.maximum(gap, 0) * float(np.min(scale))
+        bounds = cell_terms + gap * gap
+
+        # First the closest cells (genre term plus centroid distance, the usual IVF probe
+        # order) until there are enough candidates, or nprobe cells
+        sizes = self.cell_sizes
+        closeness = cell_terms + centroid_distances
+        count = min(len(bounds), nprobe if nprobe is not None else max(1, 4 * wanted * len(bounds) // len(self)))
+        first = np.argpartition(closeness, count - 1)[:count] if count < len(bounds) else np.arange(len(bounds))
+        first = first[np.argsort(closeness[first], kind='stable')]
+        if nprobe is None:
+            enough = int(np.searchsorted(np.cumsum(sizes[first]), max(4 * wanted, 256))) + 1
+            first = first[:enough]
+        positions, distances = self.scan(first, query, scale, genre_terms)
+        if nprobe is None and len(distances) >= wanted:
+            # Then every other cell whose bound can still beat the k-th distance
+            kth = np.partition(distances, wanted - 1)[wanted - 1]
+            visited = np.zeros(len(bounds), dtype=bool)
+            visited[first] = True
+            rest = np.flatnonzero((bounds < kth) & ~visited)
+            if len(rest):
+                more_positions, more_distances = self.scan(rest, query, scale, genre_terms)
+                positions = np.concatenate([positions, more_positions])
+                distances = np.concatenate([distances, more_distances])
+        elif nprobe is None:
+            # Fewer songs than wanted in the best cells, fall back to everything
+            positions, distances = self.scan(np.arange(len(bounds)), query, scale, genre_terms)
+
+        keep = ~np.isin(positions, exclude)
+        positions, distances = positions[keep], distances[keep]
+        if len(distances) > k:
+            best = np.argpartition(distances, k - 1)[:k]
+            positions, distances = positions[best], distances[best]
+        ranking = np.lexsort((positions, distances))
+        return positions[ranking], distances[ranking]
+
+    def scan(self, cells, query, scale, genre_terms):
+        # Exact squared distances of every song in the given cells
+        positions = self.cell_positions(cells)
+        diff = (np.asarray(self.vectors[positions]) - query) * scale
+        distances = (diff * diff).sum(axis=1, dtype=np.float64) + genre_terms[self.row_genre[positions]]
+        return positions, distances
+
+    def search(self, queries, genre_distributions, k=10, genre_weight=20, feature_weights=None, nprobe=None, excludes=None, block=16):
+        # Batched search: (positions, squared distances) arrays of shape (queries, k), -1 and
+        # inf where fewer than k songs were found. Same result as search_one per query, but
+        # every step runs on a block of queries at once: the cell bounds of the block with one
+        # matrix product, and each pass scans the (query, song) pairs of the cells every
+        # query needs in one go, without a Python loop over queries or cells.
+        queries = np.asarray(queries, dtype=np.float32)
+        genre_distributions = np.asarray(genre_distributions, dtype=np.float64)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf)
+        for start in range(0, len(queries), block):
+            end = min(start + block, len(queries))
+            found, found_distances = self.search_block(queries[start:end], genre_distributions[start:end], k, genre_weight,
+                                                       feature_weights, nprobe, excludes[start:end] if excludes is not None else None)
+            positions[start:end, :found.shape[1]] = found
+            distances[start:end, :found.shape[1]] = found_distances
+        return positions, distances
+
+    def search_block(self, queries, genre_distributions, k, genre_weight, feature_weights, nprobe, excludes):
+        scale = np.float32(1) if feature_weights is None else np.asarray(feature_weights, dtype=np.float32)
+        genre_terms = genre_weight ** 2 * ((genre_distributions ** 2).sum(axis=1, keepdims=True) + 1 - 2 * genre_distributions)
+        excludes = [np.asarray(list(exclude), dtype=np.int64) for exclude in excludes] if excludes is not None else [np.zeros(0, dtype=np.int64)] * len(queries)
+        wanted = k + np.array([len(exclude) for exclude in excludes], dtype=np.int64)
+
+        # Cell bounds and the first cells to scan, one row per query, as in search_one
+        cell_terms = genre_terms[:, self.cell_genre_memory]
+        centroids = self.centroids.astype(np.float64)
+        points = queries.astype(np.float64)
+        centroid_distances = np.maximum((centroids ** 2).sum(axis=1) - 2 * points @ centroids.T + (points ** 2).sum(axis=1)[:, None], 0)
+        gap = np.sqrt(centroid_distances) - self.radii * 1.0001 - 1e-4
+        gap = np.maximum(gap, 0) * float(np.min(scale))
+        bounds = cell_terms + gap * gap
+        closeness = cell_terms + centroid_distances
+        cells = len(self.cell_sizes)
+        count = np.minimum(cells, np.full(len(queries), nprobe) if nprobe is not None else np.maximum(1, 4 * wanted * cells // len(self)))
+        widest = int(count.max())
+        first = np.argpartition(closeness, widest - 1, axis=1)[:, :widest] if widest < cells else np.tile(np.arange(cells), (len(queries), 1))
+        first = np.take_along_axis(first, np.argsort(np.take_along_axis(closeness, first, axis=1), axis=1, kind='stable'), axis=1)
+        if nprobe is None:
+            filled = np.cumsum(self.cell_sizes[first], axis=1)
+            count = np.minimum(count, (filled < np.maximum(4 * wanted, 256)[:, None]).sum(axis=1) + 1)
+        probed = np.zeros(bounds.shape, dtype=bool)
+        np.put_along_axis(probed, first, np.arange(widest) < count[:, None], axis=1)
+
+        owners, positions, distances = self.scan_pairs(*np.nonzero(probed), queries, scale, genre_terms)
+        if nprobe is None:
+            # Then every other cell whose bound can still beat the query's k-th distance.
+            # Only songs closer than that can make the top k, the others are dropped before
+            # the final ranking.
+            kth = self.kth_distances(owners, distances, wanted, len(queries))
+            more_owners, more_positions, more_distances = self.scan_pairs(*np.nonzero((bounds < kth[:, None]) & ~probed),
+                                                                          queries, scale, genre_terms)
+            close = more_distances <= kth[more_owners]
+            owners = np.concatenate([owners, more_owners[close]])
+            positions = np.concatenate([positions, more_positions[close]])
+            distances = np.concatenate([distances, more_distances[close]])
+
+        # Drop the excluded songs: sort the pairs by (query, position) and look the
+        # (query, excluded position) pairs up
+        excluded_owners = np.repeat(np.arange(len(queries)), [len(exclude) for exclude in excludes])
+        if len(excluded_owners) and len(owners):
+            keys = owners * len(self) + positions
+            by_key = np.argsort(keys, kind='stable')
+            excluded = excluded_owners * len(self) + np.concatenate(excludes)
+            found = np.minimum(np.searchsorted(keys[by_key], excluded), len(keys) - 1)
+            keep = np.ones(len(keys), dtype=bool)
+            keep[by_key[found[keys[by_key[found]] == excluded]]] = False
+            owners, positions, distances = owners[keep], positions[keep], distances[keep]
+
+        # Best k of every query, ties broken by position
+        ranking = np.lexsort((positions, distances, owners))
+        owners, positions, distances = owners[ranking], positions[ranking], distances[ranking]
+        ranks = np.arange(len(owners)) - np.searchsorted(owners, owners)
+        top = ranks < k
+        result_positions = np.full((len(queries), k), -1, dtype=np.int64)
+        result_distances = np.full((len(queries), k), np.inf)
+        result_positions[owners[top], ranks[top]] = positions[top]
+        result_distances[owners[top], ranks[top]] = distances[top]
+        return result_positions, result_distances
+
+    def scan_pairs(self, owners, cells, queries, scale, genre_terms):
+        # Exact squared distances for the (query, cell) pairs given as two arrays: one
+        # (owner, position, distance) entry for every song of every pair's cell
+        sizes = self.cell_sizes[cells]
+        positions = self.cell_positions(cells)
+        owners = np.repeat(owners, sizes)
+        diff = (self.vectors[positions] - queries[owners]) * scale
+        distances = (diff * diff).sum(axis=1, dtype=np.float64) + genre_terms[owners, self.row_genre[positions]]
+        return owners, positions, distances
+
+    @staticmethod
+    def kth_distances(owners, distances, wanted, count):
+        # wanted[i]-th smallest distance of query i (inf if it has fewer), owners sorted
+        ranking = np.lexsort((distances, owners))
+        owners, distances = owners[ranking], distances[ranking]
+        ranks = np.arange(len(owners)) - np.searchsorted(owners, owners)
+        kth = np.full(count, np.inf)
+        at = ranks == wanted[owners] - 1
+        kth[owners[at]] = distances[at]
+        return kth
+
+    def playlist_query(self, playlist):
+        # (centroid, genre distribution, seed positions) of the known songs of a playlist
+        seeds = [p for p in (self.song_position(artist, track) for artist, track in playlist) if p is not None]
+        if not seeds:
+            return None
+        seeds = np.array(seeds, dtype=np.int64)
+        return np.asarray(self.vectors[seeds]).mean(axis=0), self.genre_distribution(seeds), seeds
+
+    def recommend_batch(self, playlists, k=10, genre_weight=20, weighted=False, nprobe=None):
+        # ((artist, track), distance) lists for many (artist, track) playlists; the seeds
+        # themselves are left out. weighted=True applies the notebook's importance weights.
+        # Unweighted playlists are searched together, weighted ones each with their own weights.
+        results = [[] for _ in playlists]
+        queries = [(i, query) for i, query in enumerate(map(self.playlist_query, playlists)) if query is not None]
+        if weighted:
+            found = [self.search_one(centroid, genre_distribution, k, genre_weight, importance_weights(np.asarray(self.vectors[seeds])),
+                                     nprobe, seeds) for _, (centroid, genre_distribution, seeds) in queries]
+        elif queries:
+            positions, distances = self.search([query[0] for _, query in queries], [query[1] for _, query in queries], k,
+                                               genre_weight, nprobe=nprobe, excludes=[query[2] for _, query in queries])
+            found = [(p[p >= 0], d[p >= 0]) for p, d in zip(positions, distances)]
+        else:
+            found = []
+        for (i, _), (positions, distances) in zip(queries, found):
+            results[i] = [(self.song_name(p), float(np.sqrt(d))) for p, d in zip(positions.tolist(), distances.tolist())]
+        return results
+
+    def recommend(self, playlist, k=10, genre_weight=20, weighted=False, nprobe=None):
+        return self.recommend_batch([playlist], k, genre_weight, weighted, nprobe)[0]
+
+    def similar_songs(self, artist, track, k=10, genre_weight=20, nprobe=None):
+        return self.recommend([(artist, track)], k, genre_weight, nprobe=nprobe)
+
+
+def brute_force_search(index, queries, genre_distributions, k=10, genre_weight=20, chunk=1 << 18):
+    # Reference search over every song in float64, what NearestNeighbors does on X_combined
+    vectors = np.asarray(index.vectors, dtype=np.float64)
+    genres = np.asarray(index.row_genre, dtype=np.int64)
+    positions = np.zeros((len(queries), k), dtype=np.int64)
+    distances = np.zeros((len(queries), k))
+    for i, (query, p) in enumerate(zip(np.asarray(queries, dtype=np.float64), genre_distributions)):
+        genre_terms = genre_weight ** 2 * ((p ** 2).sum() + 1 - 2 * p)
+        all_distances = np.empty(len(vectors))
+        for start in range(0, len(vectors), chunk):
+            diff = vectors[start:start + chunk] - query
+            all_distances[start:start + chunk] = (diff * diff).sum(axis=1) + genre_terms[genres[start:start + chunk]]
+        best = np.argpartition(all_distances, k - 1)[:k]
+        best = best[np.argsort(all_distances[best], kind='stable')]
+        positions[i], distances[i] = best, all_distances[best]
+    return positions, distances
+
+
+def measure_recall(index, sample_size=200, k=10, genre_weight=20, playlist_size=5, nprobe=None, seed=0):
+    # Recall@k of the index against brute force on random playlist centroids. A hit is a
+    # returned song whose true distance is within the brute-force k-th distance (ties count).
+    rng = np.random.default_rng(seed)
+    seeds = [rng.choice(len(index), playlist_size, replace=False) for _ in range(sample_size)]
+    queries = np.array([np.asarray(index.vectors[s]).mean(axis=0) for s in seeds])
+    distributions = [index.genre_distribution(s) for s in seeds]
+    exact_positions, exact_distances = brute_force_search(index, queries, distributions, k, genre_weight)
+    found_positions, found_distances = index.search(queries, distributions, k, genre_weight, nprobe=nprobe)
+    hits = 0
+    for i in range(sample_size):
+        threshold = exact_distances[i, -1] * (1 + 1e-5) + 1e-6
+        hits += int((found_distances[i] <= threshold).sum())
+    return hits / (sample_size * k)
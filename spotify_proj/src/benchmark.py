@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+from src.collaborative_filtering import update_co_occurrences_from_folder, find_top_co_occurrences, get_database_recommendations
+from src.database import numerical_sort_key, setup_database, bulk_update_co_occurrences_from_folder_database, update_co_occurrences_from_folder_database, CoOccurrenceQuery
+from src.metrics import peak_rss_bytes
+from src.scoring import PlaylistScorer
+from src.slice_reader import iter_playlists
+from src.synthetic_mpd import generate_slices
+
+# Benchmark runner for the ingestion and query paths. Every back end runs in a fresh
+# process so its peak RSS is its own. Typical use, from spotify_proj:
+#   python -m src.benchmark --generate --slices 3 --output benchmark.json
+# and diff the JSON files of two runs.
+
+
+def latency_summary(seconds):
+    milliseconds = np.array(seconds) * 1000
+    if len(milliseconds) == 0:
+        return {'count': 0}
+    return {
+        'count': len(milliseconds),
+        'p50_ms': float(np.percentile(milliseconds, 50)),
+        'p99_ms': float(np.percentile(milliseconds, 99)),
+        'mean_ms': float(milliseconds.mean()),
+    }
+
+
+def time_calls(function, arguments):
+    timings = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return latency_summary(timings)
+
+
+def slice_filenames(folder_path, slice_limit):
+    # The first slice_limit slices in numerical order, the order every back end ingests them
+    # in (alphabetically mpd.slice.10000-10999 would come before mpd.slice.1000-1999)
+    return sorted((f for f in os.listdir(folder_path) if f.endswith('.json')), key=numerical_sort_key)[:slice_limit]
+
+
+def count_pairs(folder_path, slice_limit):
+    # Pairs the ingestion has to count: n * (n - 1) / 2 per playlist
+    filenames = slice_filenames(folder_path, slice_limit)
+    playlists = pairs = 0
+    for filename in filenames:
+        for playlist in iter_playlists(os.path.join(folder_path, filename)):
+            playlists += 1
+            pairs += len(playlist) * (len(playlist) - 1) // 2
+    return playlists, pairs
+
+
+def sample_queries(folder_path, slice_limit, count, seeds_per_query, seed):
+    # Query playlists drawn from the ingested slices, so every seed is known
+    filenames = slice_filenames(folder_path, slice_limit)
+    playlists = [p for filename in filenames for p in iter_playlists(os.path.join(folder_path, filename)) if len(p) >= seeds_per_query]
+    rng = random.Random(seed)
+    return [rng.sample(playlist, seeds_per_query) for playlist in rng.sample(playlists, min(count, len(playlists)))]
+
+
+def run_memory(config):
+    start = time.perf_counter()
+    co_occurrences = update_co_occurrences_from_folder(config['data'], config['slices'], workers=config['workers'])
+    ingest_seconds = time.perf_counter() - start
+    queries = sample_queries(config['data'], config['slices'], config['queries'], config['seeds'], config['seed'])
+    scorer = PlaylistScorer(co_occurrences)
+    co_occurrences.symmetric  # Built lazily, keep it out of the first query's latency
+    return {
+        'ingest_seconds': ingest_seconds,
+        'songs': len(co_occurrences),
+        'stored_pairs': int(co_occurrences.nnz),
+        'matrix_bytes': int(co_occurrences.upper.data.nbytes + co_occurrences.upper.indices.nbytes + co_occurrences.upper.indptr.nbytes),
+        'find_top_latency': time_calls(lambda q: find_top_co_occurrences(co_occurrences, q[0][0], q[0][1], 10), queries),
+        'recommend_latency': time_calls(lambda q: scorer.recommend(q, 10), queries),
+        'peak_rss_bytes': peak_rss_bytes(),
+    }
+
+
+def run_sqlite(config):
+    db_path = os.path.join(config['workdir'], f"benchmark_v{config['schema']}.db")
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    setup_database(db_path, schema_version=config['schema'])
+    start = time.perf_counter()
+    if config['loader'] == 'per-pair':
+        update_co_occurrences_from_folder_database(config['data'], db_path, config['slices'])
+    else:
+        bulk_update_co_occurrences_from_folder_database(config['data'], db_path, config['slices'])
+    ingest_seconds = time.perf_counter() - start
+    queries = sample_queries(config['data'], config['slices'], config['queries'], config['seeds'], config['seed'])
+    with CoOccurrenceQuery(db_path) as query:
+        result = {
+            'ingest_seconds': ingest_seconds,
+            'loader': config['loader'],
+            'schema_version': config['schema'],
+            'db_bytes': sum(os.path.getsize(db_path + suffix) for suffix in ('', '-wal') if os.path.exists(db_path + suffix)),
+            'find_top_latency': time_calls(lambda q: query.top_neighbours(q[0][0], q[0][1], 10), queries),
+            'recommend_latency': time_calls(lambda q: get_database_recommendations(q, query, 10), queries),
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+    if not config['keep_db']:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    return result
+
+
+BACKENDS = {'memory': run_memory, 'sqlite': run_sqlite}
+
+
+def run_benchmark(config):
+    if config['generate']:
+        generate_slices(config['data'], config['slices'], config['playlists'], config['tracks'], seed=config['seed'])
+    playlists, pairs = count_pairs(config['data'], config['slices'])
+    report = {
+        'config': config,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__},
+        'dataset': {'playlists': playlists, 'pairs': pairs},
+        'results': {},
+    }
+    for backend in config['backends']:
+        print(f"Running {backend} benchmark")
+        # A fresh process per back end, so peak RSS and caches don't leak between them
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(BACKENDS[backend], config).result()
+        result['pairs_per_sec'] = pairs / result['ingest_seconds'] if result['ingest_seconds'] > 0 else 0.0
+        report['results'][backend] = result
+        print(f"{backend}: {result['pairs_per_sec']:,.0f} pairs/sec, peak RSS {result['peak_rss_bytes'] / 2**20:.0f} MiB, "
+              f"recommend p50 {result['recommend_latency'].get('p50_ms', 0):.2f} ms / p99 {result['recommend_latency'].get('p99_ms', 0):.2f} ms")
+
+    with open(config['output'], 'w') as file:
+        json.dump(report, file, indent=2, sort_keys=True)
+    print(f"Results written to {config['output']}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and recommendation latency")
+    parser.add_argument('--data', default='benchmark_data', help="folder with mpd.slice.*.json files")
+    parser.add_argument('--generate', action='store_true', help="write synthetic slices into --data first")
+    parser.add_argument('--slices', type=int, default=3)
+    parser.add_argument('--playlists', type=int, default=1000, help="playlists per generated slice")
+    parser.add_argument('--tracks', type=int, default=100000, help="songs in the generated catalogue")
+    parser.add_argument('--backends', nargs='+', choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parser.add_argument('--workers', type=int, default=1, help="processes for the in-memory ingestion")
+    parser.add_argument('--loader', choices=['bulk', 'per-pair'], default='bulk', help="SQLite ingestion path")
+    parser.add_argument('--schema', type=int, choices=[1, 2], default=2, help="SQLite schema version")
+    parser.add_argument('--queries', type=int, default=200, help="recommendation requests to time")
+    parser.add_argument('--seeds', type=int, default=5, help="seed songs per request")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default='.', help="where the benchmark database is written")
+    parser.add_argument('--keep-db', action='store_true')
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+    run_benchmark(vars(args))
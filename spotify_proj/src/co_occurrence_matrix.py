@@ -0,0 +1,177 @@
+import numpy as np
+from scipy import sparse
+
+
+class CoOccurrenceMatrix:
+    # Compact co-occurrence store. Every (artist, track) key is interned into a dense
+    # integer id, pair counts are appended to flat COO buffers and periodically compacted
+    # into an upper-triangle CSR matrix (each unordered pair is stored once).
+
+    def __init__(self, buffer_size=1 << 21, dtype=np.int32):
+        self.songs = []  # id -> (artist_name, track_name)
+        self.song_ids = {}  # (artist_name, track_name) -> id
+        self.dtype = np.dtype(dtype)
+        self.buffer_size = buffer_size
+        self.version = 0  # Bumped every time new counts are added
+        self._upper = sparse.csr_matrix((0, 0), dtype=self.dtype)
+        self._symmetric = None
+        self._allocate_buffers()
+
+    @classmethod
+    def from_dict(cls, co_occurrences):
+        # Convert the nested dict built by the old slice_to_csv. It stores both directions of
+        # every pair and self pairs twice, the matrix keeps the upper triangle once.
+        matrix = cls()
+        for key1, neighbours in co_occurrences.items():
+            id1 = matrix.intern(key1)
+            for key2, count in neighbours.items():
+                id2 = matrix.intern(key2)
+                if id1 < id2:
+                    matrix.add_pairs(np.array([id1]), np.array([id2]), count)
+                elif id1 == id2:
+                    matrix.add_pairs(np.array([id1]), np.array([id1]), count // 2)
+        matrix.compact()
+        return matrix
+
+    def _allocate_buffers(self):
+        self._rows = np.empty(self.buffer_size, dtype=np.int32)
+        self._cols = np.empty(self.buffer_size, dtype=np.int32)
+        self._counts = np.empty(self.buffer_size, dtype=self.dtype)
+        self._fill = 0
+
+    def __getstate__(self):
+        # Pickle only the compacted matrix, not the (mostly empty) COO buffers
+        self.compact()
+        state = self.__dict__.copy()
+        for name in ('_rows', '_cols', '_counts', '_fill', '_symmetric'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._symmetric = None
+        self._allocate_buffers()
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, key):
+        return key in self.song_ids
+
+    def intern(self, key):
+        # Return the id of the key, assigning the next free one if it is new
+        song_id = self.song_ids.get(key)
+        if song_id is None:
+            song_id = len(self.songs)
+            self.song_ids[key] = song_id
+            self.songs.append(key)
+        return song_id
+
+    def add_playlist(self, tracks, strategy=None):
+        # tracks is a list of (artist_name, track_name) keys from one playlist. A PairStrategy
+        # picks which pairs are counted, by default every one.
+        rows, cols, weights = self.playlist_pairs(tracks, strategy)
+        if len(rows):
+            self.add_pairs(rows, cols, weights)
+
+    def playlist_pairs(self, tracks, strategy=None):
+        # (rows, cols, weights) of one playlist, interning its songs on the way
+        weights = 1
+        if strategy is not None:
+            tracks, first, second, weights = strategy.pairs(tracks)
+            weights = 1 if weights is None else weights
+        ids = np.fromiter((self.intern(key) for key in tracks), dtype=np.int32, count=len(tracks))
+        if len(ids) < 2:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, empty, 1
+        if strategy is None:
+            # Every unordered pair of positions, like the nested loop in slice_to_csv
+            first, second = np.triu_indices(len(ids), k=1)
+        a, b = ids[first], ids[second]
+        return np.minimum(a, b), np.maximum(a, b), weights
+
+    def add_pairs(self, rows, cols, counts=1):
+        # rows <= cols is expected, the matrix only keeps the upper triangle
+        counts = np.broadcast_to(np.asarray(counts, dtype=self.dtype), rows.shape)
+        start = 0
+        while start < len(rows):
+            space = self.buffer_size - self._fill
+            if space == 0:
+                self.compact()
+                continue
+            end = min(len(rows), start + space)
+            chunk = slice(self._fill, self._fill + end - start)
+            self._rows[chunk] = rows[start:end]
+            self._cols[chunk] = cols[start:end]
+            self._counts[chunk] = counts[start:end]
+            self._fill += end - start
+            start = end
+        self._symmetric = None
+        self.version += 1
+
+    def merge(self, other):
+        # Add the counts of another matrix into this one. Songs of `other` that are new
+        # here get ids after the existing ones, in the order `other` first saw them.
+        remap = np.fromiter((self.intern(key) for key in other.songs), dtype=np.int32, count=len(other.songs))
+        upper = other.upper.tocoo()
+        rows, cols = remap[upper.row], remap[upper.col]
+        self.add_pairs(np.minimum(rows, cols), np.maximum(rows, cols), upper.data)
+        self.compact()
+        return self
+
+    def compact(self):
+        # Fold the COO buffers into the CSR matrix, summing duplicate pairs
+        n = len(self.songs)
+        if self._upper.shape != (n, n):
+            self._upper.resize((n, n))
+        if self._fill == 0:
+            return
+        fill = self._fill
+        batch = sparse.coo_matrix(
+            (self._counts[:fill], (self._rows[:fill], self._cols[:fill])), shape=(n, n)
+        ).tocsr()
+        self._upper = (self._upper + batch).tocsr()
+        self._fill = 0
+
+    @property
+    def upper(self):
+        self.compact()
+        return self._upper
+
+    @property
+    def symmetric(self):
+        # Full symmetric CSR matrix, built lazily and cached until new counts arrive
+        if self._symmetric is None:
+            upper = self.upper
+            self._symmetric = (upper + upper.T).tocsr()
+        return self._symmetric
+
+    @property
+    def nnz(self):
+        return self.upper.nnz
+
+    def neighbours(self, song_id):
+        # (ids, counts) of every song that shares a playlist with song_id
+        matrix = self.symmetric
+        start, end = matrix.indptr[song_id], matrix.indptr[song_id + 1]
+        return matrix.indices[start:end], matrix.data[start:end]
+
+    def top_neighbours(self, key, top_n=10):
+        song_id = self.song_ids.get(key)
+        if song_id is None:
+            return []
+        ids, counts = self.neighbours(song_id)
+        # Stable sort so ties keep the order the songs were first seen in
+        order = np.argsort(-counts, kind='stable')[:top_n]
+        return [(self.songs[ids[i]], counts[i].item()) for i in order]
+
+    def get(self, key, default=None):
+        # Dict-like access so code written for the nested defaultdict keeps working
+        song_id = self.song_ids.get(key)
+        if song_id is None:
+            return default
+        ids, counts = self.neighbours(song_id)
+        return {self.songs[i]: c for i, c in zip(ids.tolist(), counts.tolist())}
+
+    def __getitem__(self, key):
+        return self.get(key, {})
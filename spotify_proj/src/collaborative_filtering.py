@@ -1,18 +1,51 @@
-import json
 from collections import defaultdict
+from contextlib import nullcontext
+from functools import partial
 import os
+import time
+from multiprocessing import Pool
+import numpy as np
+from scipy import sparse
 from src.database import *
+from src.co_occurrence_matrix import CoOccurrenceMatrix
+from src.slice_reader import iter_playlists
+from src.topk_index import TopKIndex
+from src.scoring import PlaylistScorer
+from src.sketch import ApproxCoOccurrences
+from src.recommendation_cache import RecommendationCache
+from src.metrics import SliceMetrics, SamplingProfiler, emit, ingest_event, timed_query
 
-def slice_to_csv(slice_path="", co_occurrences=None):
+def slice_to_csv(slice_path="", co_occurrences=None, strategy=None, metrics=None):
+    # strategy is an optional PairStrategy limiting the pairs counted per playlist,
+    # metrics an optional SliceMetrics that gets the stage timings and counters
     if co_occurrences is None:
-        co_occurrences = defaultdict(lambda: defaultdict(int))
-    with open(slice_path, 'r') as file:
-        data = json.load(file)
-    # Process each playlist in the JSON data
-    for playlist in data['playlists']:
-        # Extract all artist-song pairs in the current playlist
-        playlist_artist_song_pairs = [(track['artist_name'], track['track_name']) for track in playlist['tracks']]
-        
+        co_occurrences = CoOccurrenceMatrix(dtype=strategy.dtype) if strategy is not None else CoOccurrenceMatrix()
+    playlists = iter_playlists(slice_path)
+    if metrics is not None:
+        playlists = metrics.playlists_from(playlists)
+    # Stream the artist-song pairs of one playlist at a time from the slice
+    for playlist_artist_song_pairs in playlists:
+        if isinstance(co_occurrences, CoOccurrenceMatrix):
+            # Interned ids and vectorized pair counting
+            if metrics is None:
+                co_occurrences.add_playlist(playlist_artist_song_pairs, strategy)
+                continue
+            with metrics.stage('pairs'):
+                rows, cols, weights = co_occurrences.playlist_pairs(playlist_artist_song_pairs, strategy)
+            with metrics.stage('store'):
+                if len(rows):
+                    co_occurrences.add_pairs(rows, cols, weights)
+            metrics.pairs += len(rows)
+            continue
+
+        if strategy is not None:
+            tracks, first, second, weights = strategy.pairs(playlist_artist_song_pairs)
+            weights = [1] * len(first) if weights is None else weights.tolist()
+            for i, j, weight in zip(first.tolist(), second.tolist(), weights):
+                co_occurrences[tracks[i]][tracks[j]] += weight
+                co_occurrences[tracks[j]][tracks[i]] += weight
+            continue
+
         # Update co-occurrence counts for each pair of artist-song in the playlist
         for i, pair1 in enumerate(playlist_artist_song_pairs):
             for pair2 in playlist_artist_song_pairs[i+1:]:  # Ensure we don't count a pair with itself
@@ -24,14 +57,19 @@ def find_top_co_occurrences(co_occurrences, artist_name, song_name, top_n=10):
     # Create a key from the provided artist name and song name
     search_key = (artist_name, song_name)
 
-    # Find the co-occurring songs for the given artist and song
-    co_occurring_songs = co_occurrences.get(search_key, {})
+    if isinstance(co_occurrences, (CoOccurrenceMatrix, TopKIndex, ApproxCoOccurrences)):
+        # The matrix sorts only the row of the seed song, the top-K index and the
+        # approximate heavy hitters are already sorted
+        top_co_occurring_songs = co_occurrences.top_neighbours(search_key, top_n)
+    else:
+        # Find the co-occurring songs for the given artist and song
+        co_occurring_songs = co_occurrences.get(search_key, {})
 
-    # Sort the co-occurring songs by their co-occurrence count in descending order
-    sorted_co_occurring_songs = sorted(co_occurring_songs.items(), key=lambda x: x[1], reverse=True)
+        # Sort the co-occurring songs by their co-occurrence count in descending order
+        sorted_co_occurring_songs = sorted(co_occurring_songs.items(), key=lambda x: x[1], reverse=True)
 
-    # Take the top_n items from the sorted list
-    top_co_occurring_songs = sorted_co_occurring_songs[:top_n]
+        # Take the top_n items from the sorted list
+        top_co_occurring_songs = sorted_co_occurring_songs[:top_n]
 
     if not top_co_occurring_songs:
         print(f"No co-occurring songs found for '{artist_name} - {song_name}'")
@@ -42,21 +80,133 @@ def find_top_co_occurrences(co_occurrences, artist_name, song_name, top_n=10):
         result[f"{co_song[0]} - {co_song[1]}"] = count
     return result
 
-def update_co_occurrences_from_folder(folder_path, slice_limit=5):
-    # Initialize an empty co_occurrences dictionary
-    co_occurrences = defaultdict(lambda: defaultdict(int))
-
+def update_co_occurrences_from_folder(folder_path, slice_limit=5, workers=1, slice_range=None, co_occurrences=None, strategy=None, profile=False):
+    # Per-slice 'slice' events and a final 'ingest' event go to the metrics hooks. With
+    # profile=True a SamplingProfiler runs during the load and emits a 'profile' event.
     # List all files in the given folder and sort them
     filenames = [f for f in os.listdir(folder_path) if f.endswith('.json')]
-    filenames.sort()  # Sorts the files in ascending alphanumeric order
+    filenames.sort(key=numerical_sort_key)  # Same numerical order as the database loaders
+
+    # slice_range=(start, stop) picks the slices by position and overrides slice_limit
+    if slice_range is not None:
+        filenames = filenames[slice_range[0]:slice_range[1]]
+        slice_limit = len(filenames)
+
+    start_time = time.perf_counter()
+    profiler = SamplingProfiler(label='update_co_occurrences_from_folder') if profile else nullcontext()
+    with profiler:
+        if workers > 1:
+            file_paths = [os.path.join(folder_path, f) for f in filenames[:slice_limit]]
+            result, slice_events = update_co_occurrences_parallel(file_paths, workers, strategy, return_metrics=True)
+            # Adding to an existing (e.g. loaded) matrix keeps its ids
+            if co_occurrences is not None:
+                result = co_occurrences.merge(result)
+            emit(ingest_event('memory', slice_events, time.perf_counter() - start_time))
+            return result
 
-    # Process files up to the slice_limit
-    for i, filename in enumerate(filenames[:slice_limit]):
-        print(f"Processing slice {i+1}/{slice_limit}: {filename}")
-        file_path = os.path.join(folder_path, filename)
-        # Check if the file is a JSON file and exists (redundant check removed)
-        co_occurrences = slice_to_csv(file_path, co_occurrences)
+        # Initialize an empty co-occurrence matrix, unless we are adding to an existing one
+        if co_occurrences is None:
+            co_occurrences = CoOccurrenceMatrix(dtype=strategy.dtype) if strategy is not None else CoOccurrenceMatrix()
 
+        # Process files up to the slice_limit
+        slice_events = []
+        for i, filename in enumerate(filenames[:slice_limit]):
+            print(f"Processing slice {i+1}/{slice_limit}: {filename}")
+            file_path = os.path.join(folder_path, filename)
+            # Check if the file is a JSON file and exists (redundant check removed)
+            metrics = SliceMetrics(filename, 'memory')
+            co_occurrences = slice_to_csv(file_path, co_occurrences, strategy, metrics)
+            metrics.distinct_keys = len(co_occurrences)
+            slice_events.append(metrics.as_event())
+            emit(slice_events[-1])
+
+        # Fold the remaining buffered pairs into the matrix
+        co_occurrences.compact()
+        emit(ingest_event('memory', slice_events, time.perf_counter() - start_time))
+    return co_occurrences
+
+def count_slices(file_paths, strategy=None):
+    # Map step: count a run of slices into a partial matrix. The slice events are handed
+    # back to the parent, whose metrics hooks emit them.
+    co_occurrences = CoOccurrenceMatrix(dtype=strategy.dtype) if strategy is not None else CoOccurrenceMatrix()
+    slice_events = []
+    for file_path in file_paths:
+        print(f"Processing slice {os.path.basename(file_path)}")
+        metrics = SliceMetrics(os.path.basename(file_path), 'memory')
+        slice_to_csv(file_path, co_occurrences, strategy, metrics)
+        metrics.distinct_keys = len(co_occurrences)
+        slice_events.append(metrics.as_event())
+    co_occurrences.compact()
+    return co_occurrences, slice_events
+
+def merge_co_occurrence_pair(pair):
+    # Reduce step: fold the right partial into the left one
+    left, right = pair
+    return left.merge(right)
+
+def update_co_occurrences_parallel(file_paths, workers=4, strategy=None, return_metrics=False):
+    if not file_paths:
+        empty = CoOccurrenceMatrix(dtype=strategy.dtype) if strategy is not None else CoOccurrenceMatrix()
+        return (empty, []) if return_metrics else empty
+    # Contiguous runs of slices, so merging neighbours keeps the serial id order
+    chunk_count = min(workers, len(file_paths))
+    bounds = [len(file_paths) * i // chunk_count for i in range(chunk_count + 1)]
+    chunks = [file_paths[bounds[i]:bounds[i + 1]] for i in range(chunk_count)]
+
+    with Pool(processes=chunk_count) as pool:
+        results = pool.map(partial(count_slices, strategy=strategy), chunks)
+        partials = [co_occurrences for co_occurrences, _ in results]
+        slice_events = [event for _, events in results for event in events]
+        for event in slice_events:
+            emit(event)
+        # Tree merge: combine neighbouring partials in parallel until one is left
+        while len(partials) > 1:
+            pairs = [(partials[i], partials[i + 1]) for i in range(0, len(partials) - 1, 2)]
+            leftover = [partials[-1]] if len(partials) % 2 else []
+            partials = pool.map(merge_co_occurrence_pair, pairs) + leftover
+
+    return (partials[0], slice_events) if return_metrics else partials[0]
+
+SNAPSHOT_VERSION = 1
+
+def save_co_occurrences(co_occurrences, path, compress=True):
+    # Write a versioned .npz snapshot: the vocabulary plus the upper-triangle CSR arrays.
+    # The old nested dict is converted first. compress=False trades file size for load time.
+    if not isinstance(co_occurrences, CoOccurrenceMatrix):
+        co_occurrences = CoOccurrenceMatrix.from_dict(co_occurrences)
+    upper = co_occurrences.upper
+    # The vocabulary is one string of alternating artist/track names, joined by a character
+    # that appears in none of them, so loading is a single decode and split
+    names = [name for key in co_occurrences.songs for name in key]
+    separator = next(c for c in '\n\x1f\x1e\x00' + ''.join(map(chr, range(0xE000, 0xF900))) if not any(c in name for name in names))
+    vocabulary = separator.join(names).encode('utf-8')
+    save = np.savez_compressed if compress else np.savez
+    with open(path, 'wb') as file:
+        save(
+            file,
+            version=np.array(SNAPSHOT_VERSION),
+            separator=np.array(ord(separator)),
+            songs=np.array(len(co_occurrences.songs)),
+            vocabulary=np.frombuffer(vocabulary, dtype=np.uint8),
+            indptr=upper.indptr,
+            indices=upper.indices,
+            data=upper.data,
+        )
+
+def load_co_occurrences(path):
+    # Read a snapshot written by save_co_occurrences back into a CoOccurrenceMatrix that
+    # can keep ingesting slices
+    with np.load(path) as snapshot:
+        version = int(snapshot['version'])
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} in {path}")
+        n = int(snapshot['songs'])
+        names = snapshot['vocabulary'].tobytes().decode('utf-8').split(chr(int(snapshot['separator']))) if n else []
+        data = snapshot['data']
+        co_occurrences = CoOccurrenceMatrix(dtype=data.dtype)
+        co_occurrences.songs = list(zip(names[0::2], names[1::2]))
+        co_occurrences.song_ids = {key: i for i, key in enumerate(co_occurrences.songs)}
+        co_occurrences._upper = sparse.csr_matrix((data, snapshot['indices'], snapshot['indptr']), shape=(n, n))
     return co_occurrences
 
 def normalize_co_occurrences(co_occurrences):
@@ -92,13 +242,86 @@ def print_combined_co_occurrences(co_occurrences, top_n=10, playlist=[]):
 def artist_song_string_split(str):
     return str.split(' - ')[0], str.split(' - ', 1)[1].split(':')[0]
 
-def get_recommendations(playlist, co_occurences, top_n=10, use_database=False, database_path="co_occurrences.db"):
+def normalize_neighbours(neighbours):
+    # Divide a seed's (song_id, count) list by its total, like normalize_co_occurrences
+    total = sum(count for _, count in neighbours)
+    return [(song_id, count / total) for song_id, count in neighbours]
+
+def combine_neighbour_lists(neighbour_lists, exclude=(), top_n=10, normalized=False):
+    # Same scoring as normalize_co_occurrences + combine_co_occurence_list, but on
+    # structured (song_id, count) lists: each seed's counts are normalized by their sum,
+    # summed across seeds, and the seeds themselves are left out
+    combined = defaultdict(float)
+    for neighbours in neighbour_lists:
+        for song_id, weight in (neighbours if normalized else normalize_neighbours(neighbours)):
+            combined[song_id] += weight
+    for song_id in exclude:
+        combined.pop(song_id, None)
+    return sorted(combined.items(), key=lambda item: item[1], reverse=True)[:top_n]
+
+# Neighbours read per seed by the database recommendations, like find_top_co_occurrences(..., 50)
+DATABASE_SEED_NEIGHBOURS = 50
+
+def get_database_recommendations(playlist, query, top_n=10, cache=None):
+    # One batched lookup for the whole playlist, scores are kept as ids until the end.
+    # With a RecommendationCache only seeds missing from it are looked up.
+    return get_database_recommendations_batch([playlist], query, top_n, cache)[0]
+
+def get_database_recommendations_batch(playlists, query, top_n=10, cache=None):
+    # Many playlists in one pass: every distinct seed of the batch is looked up once with
+    # a single top_neighbours_batch call and the names of all recommended songs are fetched
+    # together
+    with timed_query('sqlite', sum(len(playlist) for playlist in playlists), top_n):
+        results = [None] * len(playlists)
+        if cache is not None:
+            cache.validate(query.db_path, query.data_version())
+            keys = [cache.playlist_key(playlist, top_n, ('sqlite', DATABASE_SEED_NEIGHBOURS)) for playlist in playlists]
+            results = [cache.results.get(key) for key in keys]
+        todo = [i for i, result in enumerate(results) if result is None]
+
+        seeds = {}
+        for i in todo:
+            for key in playlists[i]:
+                if key not in seeds:
+                    seeds[key] = cache.seeds.get(key) if cache is not None else None
+        missing = [key for key, seed in seeds.items() if seed is None]
+        for key, (seed_id, neighbours) in zip(missing, query.top_neighbours_batch(missing, DATABASE_SEED_NEIGHBOURS)):
+            seeds[key] = (seed_id, normalize_neighbours(neighbours))
+            if cache is not None:
+                cache.seeds.put(key, seeds[key])
+
+        tops = {}
+        for i in todo:
+            playlist_seeds = [seeds[key] for key in playlists[i]]
+            seed_ids = [seed_id for seed_id, _ in playlist_seeds if seed_id is not None]
+            tops[i] = combine_neighbour_lists([neighbours for _, neighbours in playlist_seeds], exclude=seed_ids, top_n=top_n, normalized=True)
+        names = query.song_names({song_id for top in tops.values() for song_id, _ in top})
+        for i, top in tops.items():
+            results[i] = [(names[song_id], score) for song_id, score in top]
+            if cache is not None:
+                cache.results.put(keys[i], results[i])
+        return results
+
+# Shared by get_recommendations calls, emptied whenever the data they read changes
+RECOMMENDATION_CACHE = RecommendationCache()
+
+def get_recommendations(playlist, co_occurences, top_n=10, use_database=False, database_path="co_occurrences.db", cache=RECOMMENDATION_CACHE):
+    if use_database:
+        # co_occurences is the database path (or an already open CoOccurrenceQuery)
+        query = co_occurences if isinstance(co_occurences, CoOccurrenceQuery) else get_query(co_occurences)
+        for (artist, song), score in get_database_recommendations(playlist, query, top_n, cache):
+            print(f"{artist} - {song} - {score}")
+        return
+
+    if isinstance(co_occurences, (CoOccurrenceMatrix, TopKIndex)):
+        # Vectorized scoring, seeds are masked by id instead of by re-splitting strings
+        for (artist, song), score in PlaylistScorer(co_occurences, cache=cache).recommend(playlist, top_n):
+            print(f"{artist} - {song} - {score}")
+        return
+
     co_occurences_list = []
     for artist, song in playlist:
-        if use_database:
-            top_co_occurences = find_top_co_occurrences_database(co_occurences, artist, song, 50)
-        else:
-            top_co_occurences = find_top_co_occurrences(co_occurences, artist, song, 50)
+        top_co_occurences = find_top_co_occurrences(co_occurences, artist, song, 50)
         co_occorences_normalized = normalize_co_occurrences(top_co_occurences)
         co_occurences_list.append(co_occorences_normalized)
 
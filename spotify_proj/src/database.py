@@ -1,73 +1,439 @@
 import sqlite3
-import json
+import argparse
+import hashlib
 import os
 import re
+import threading
+import time
+from contextlib import nullcontext
+from urllib.request import pathname2url
+import numpy as np
+from src.slice_reader import iter_playlists
+from src.metrics import SliceMetrics, SamplingProfiler, emit, ingest_event
 
-def setup_database(db_path="co_occurrences.db"):
+# Schema version 2: songs are stored once in a dimension table and pairs refer to them by
+# integer id. The pair table is clustered on (song1, song2) for upserts and the pairs_top
+# index (which also carries song2, the rest of the primary key) answers "top N neighbours
+# of song X" as an index range scan without a sort.
+PAIRS_TOP_INDEX = 'CREATE INDEX IF NOT EXISTS pairs_top ON pairs (song1, count DESC)'
+SCHEMA_V2 = [
+    '''CREATE TABLE IF NOT EXISTS songs
+       (id INTEGER PRIMARY KEY, artist TEXT NOT NULL, track TEXT NOT NULL, UNIQUE (artist, track))''',
+    '''CREATE TABLE IF NOT EXISTS pairs
+       (song1 INTEGER NOT NULL, song2 INTEGER NOT NULL, count INTEGER NOT NULL,
+        PRIMARY KEY (song1, song2)) WITHOUT ROWID''',
+    PAIRS_TOP_INDEX,
+    'PRAGMA user_version = 2',
+]
+
+# Slices already applied to the database, written in the same transaction as their counts
+MANIFEST_TABLE = '''CREATE TABLE IF NOT EXISTS ingested_slices
+    (filename TEXT PRIMARY KEY, content_hash TEXT NOT NULL, file_size INTEGER NOT NULL,
+     ingested_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)'''
+
+# Single row counter bumped by every transaction that changes the counts, so readers can
+# tell when their cached results are stale
+DATA_VERSION_TABLE = '''CREATE TABLE IF NOT EXISTS data_version
+    (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)'''
+
+def setup_database(db_path="co_occurrences.db", schema_version=1):
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
-    # Create table
-    c.execute('''CREATE TABLE IF NOT EXISTS co_occurrences
-                 (song1 TEXT, song2 TEXT, count INTEGER, PRIMARY KEY (song1, song2))''')
+    c.execute(MANIFEST_TABLE)
+    c.execute(DATA_VERSION_TABLE)
+    if schema_version == 2:
+        for statement in SCHEMA_V2:
+            c.execute(statement)
+    else:
+        # Create table
+        c.execute('''CREATE TABLE IF NOT EXISTS co_occurrences
+                     (song1 TEXT, song2 TEXT, count INTEGER, PRIMARY KEY (song1, song2))''')
     conn.commit()
     conn.close()
 
+def get_schema_version(conn):
+    # Version 1 databases were created before user_version was set, so they report 0
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    return version if version > 0 else 1
+
+class SongTable:
+    # In-memory copy of the songs table of a v2 database, used to intern songs while loading
+
+    def __init__(self, conn):
+        self.ids = {(artist, track): song_id for song_id, artist, track in conn.execute('SELECT id, artist, track FROM songs')}
+        self.next_id = (conn.execute('SELECT MAX(id) FROM songs').fetchone()[0] or 0) + 1
+        self.new_songs = []
+
+    def intern(self, key):
+        song_id = self.ids.get(key)
+        if song_id is None:
+            song_id = self.next_id
+            self.next_id += 1
+            self.ids[key] = song_id
+            self.new_songs.append((song_id, key[0], key[1]))
+        return song_id
+
+    def flush(self, conn):
+        # Write the songs seen for the first time since the last flush
+        conn.executemany('INSERT INTO songs (id, artist, track) VALUES (?, ?, ?)', self.new_songs)
+        self.new_songs = []
+
 def numerical_sort_key(filename):
     # Extract numbers from the filename using regular expressions
     numbers = map(int, re.findall(r'\d+', filename))
     return tuple(numbers)  # Return a tuple of numbers as the sort key
 
-def update_database_with_slice(file_path, db_path="co_occurrences.db"):
-    # Open the JSON file and load its content
-    with open(file_path, 'r') as file:
-        data = json.load(file)
-    
+def file_hash(file_path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def slice_changed(file_path, content_hash, file_size, ingested_at):
+    # Whether an applied slice differs from the file now on disk. A different size settles
+    # it; a file last modified before it was ingested (ingested_at in epoch seconds) is
+    # taken as unchanged, anything else is hashed.
+    if os.path.getsize(file_path) != file_size:
+        return True
+    if ingested_at is not None and os.path.getmtime(file_path) < ingested_at:
+        return False
+    return file_hash(file_path) != content_hash
+
+def pending_slices(conn, folder_path, slice_limit=5):
+    # The next slice_limit slices of the folder (in numerical order) that are not in the
+    # manifest yet, as (filename, file_path, content_hash). A slice is skipped if its name
+    # is already recorded, or if its content was already applied under another name.
+    conn.execute(MANIFEST_TABLE)
+    applied = {filename: (content_hash, file_size, ingested_at) for filename, content_hash, file_size, ingested_at
+               in conn.execute("SELECT filename, content_hash, file_size, CAST(strftime('%s', ingested_at) AS INTEGER) FROM ingested_slices")}
+    applied_hashes = {content_hash: filename for filename, (content_hash, _, _) in applied.items()}
+
+    filenames = [f for f in os.listdir(folder_path) if f.endswith('.json')]
+    filenames.sort(key=numerical_sort_key)
+    pending = []
+    skipped = 0
+    for filename in filenames:
+        if len(pending) >= slice_limit:
+            break
+        file_path = os.path.join(folder_path, filename)
+        if filename in applied:
+            # Counts can't be taken back out, so a changed slice is reported and left alone
+            if slice_changed(file_path, *applied[filename]):
+                print(f"Warning: {filename} changed since it was ingested, skipping it")
+            skipped += 1
+            continue
+        content_hash = file_hash(file_path)
+        if content_hash in applied_hashes:
+            print(f"Skipping {filename}, same content as {applied_hashes[content_hash]}")
+            skipped += 1
+            continue
+        pending.append((filename, file_path, content_hash))
+    if skipped:
+        print(f"Skipping {skipped} slices that are already in the database")
+    return pending
+
+def record_slice(conn, filename, file_path, content_hash):
+    # Add the manifest entry; the caller commits it together with the slice's counts
+    conn.execute('INSERT INTO ingested_slices (filename, content_hash, file_size) VALUES (?, ?, ?)',
+                 (filename, content_hash, os.path.getsize(file_path)))
+
+def bump_data_version(conn):
+    # Call inside the transaction that changes the counts
+    conn.execute(DATA_VERSION_TABLE)
+    conn.execute('INSERT INTO data_version (id, version) VALUES (0, 1) ON CONFLICT(id) DO UPDATE SET version = version + 1')
+
+def update_database_with_slice(file_path, db_path="co_occurrences.db", manifest_entry=None, strategy=None, metrics=None):
     # Connect to the SQLite database
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
+    # v2 databases get the pairs by song id, new songs are added to the songs table
+    songs = SongTable(conn) if get_schema_version(conn) == 2 else None
+    playlists = iter_playlists(file_path)
+    if metrics is not None:
+        playlists = metrics.playlists_from(playlists)
     
-    # Process each playlist in the JSON data
-    for playlist in data['playlists']:
-        # Extract all artist-song pairs in the current playlist
-        playlist_artist_song_pairs = [(track['artist_name'], track['track_name']) for track in playlist['tracks']]
-        
-        # Update co-occurrence counts for each pair of artist-song in the playlist
-        for i, pair1 in enumerate(playlist_artist_song_pairs):
-            for pair2 in playlist_artist_song_pairs[i+1:]:  # Ensure we don't count a pair with itself
-                # Ensure symmetric updates for both pair1 -> pair2 and pair2 -> pair1
-                for song1, song2 in [(pair1, pair2), (pair2, pair1)]:
-                    # Convert the artist-song pairs into a single string key for each song
-                    song1_key = f"{song1[0]} - {song1[1]}"
-                    song2_key = f"{song2[0]} - {song2[1]}"
-                    # Update the database with the new count
-                    c.execute('''
-                        INSERT INTO co_occurrences (song1, song2, count)
-                        VALUES (?, ?, 1)
-                        ON CONFLICT(song1, song2) DO UPDATE SET count = count + 1
-                    ''', (song1_key, song2_key))
+    # Stream the artist-song pairs of one playlist at a time from the slice
+    for playlist_artist_song_pairs in playlists:
+        # Pairs are generated and written in the same loop, so it all counts as store time
+        with metrics.stage('store') if metrics is not None else nullcontext():
+            pairs = write_playlist_pairs(c, playlist_artist_song_pairs, strategy, songs)
+        if metrics is not None:
+            metrics.pairs += pairs
+    if songs is not None:
+        songs.flush(conn)
+
+    # The manifest entry goes into the same transaction as the counts
+    if manifest_entry is not None:
+        record_slice(conn, *manifest_entry)
+    bump_data_version(conn)
                     
     # Commit the transaction and close the connection
+    with metrics.stage('store') if metrics is not None else nullcontext():
+        conn.commit()
+    conn.close()
+
+def write_playlist_pairs(c, playlist_artist_song_pairs, strategy=None, songs=None):
+    # One upsert per pair and direction, returns the number of pairs. With a SongTable
+    # the pairs go into the v2 pairs table by song id, otherwise into co_occurrences by
+    # "artist - track" key.
+    if songs is None:
+        table = 'co_occurrences'
+        song_key = lambda song: f"{song[0]} - {song[1]}"
+    else:
+        table = 'pairs'
+        song_key = songs.intern
+
+    if strategy is not None:
+        # Only the pairs picked by the PairStrategy, with their weights
+        tracks, first, second, weights = strategy.pairs(playlist_artist_song_pairs)
+        weights = [1] * len(first) if weights is None else weights.tolist()
+        for i, j, weight in zip(first.tolist(), second.tolist(), weights):
+            song1_key = song_key(tracks[i])
+            song2_key = song_key(tracks[j])
+            for key1, key2 in [(song1_key, song2_key), (song2_key, song1_key)]:
+                c.execute(f'''
+                    INSERT INTO {table} (song1, song2, count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(song1, song2) DO UPDATE SET count = count + excluded.count
+                ''', (key1, key2, weight))
+        return len(weights)
+
+    # Update co-occurrence counts for each pair of artist-song in the playlist
+    for i, pair1 in enumerate(playlist_artist_song_pairs):
+        for pair2 in playlist_artist_song_pairs[i+1:]:  # Ensure we don't count a pair with itself
+            # Ensure symmetric updates for both pair1 -> pair2 and pair2 -> pair1
+            for song1, song2 in [(pair1, pair2), (pair2, pair1)]:
+                # Convert the artist-song pairs into a single key for each song
+                song1_key = song_key(song1)
+                song2_key = song_key(song2)
+                # Update the database with the new count
+                c.execute(f'''
+                    INSERT INTO {table} (song1, song2, count)
+                    VALUES (?, ?, 1)
+                    ON CONFLICT(song1, song2) DO UPDATE SET count = count + 1
+                ''', (song1_key, song2_key))
+    return len(playlist_artist_song_pairs) * (len(playlist_artist_song_pairs) - 1) // 2
+
+def tune_connection(conn, cache_size_mb=256):
+    # Pragmas for bulk loading: WAL journal, fewer fsyncs, a big page cache and
+    # temporary tables kept in memory
+    c = conn.cursor()
+    c.execute('PRAGMA journal_mode = WAL')
+    c.execute('PRAGMA synchronous = NORMAL')
+    c.execute(f'PRAGMA cache_size = -{cache_size_mb * 1024}')
+    c.execute('PRAGMA temp_store = MEMORY')
+
+def count_slice_pairs(file_path, songs=None, strategy=None, metrics=None):
+    # Aggregate the co-occurrence counts of a whole slice in memory. With a SongTable the
+    # songs are counted by their v2 id, otherwise by their position in a per-slice list of
+    # "artist - track" keys (schema v1) that is mapped back to the keys at the end.
+    # A PairStrategy limits the pairs counted per playlist. A SliceMetrics gets the parse
+    # and pair generation timings.
+    # Returns (song1, song2, counts) lists, one entry per directed row to write.
+    keys = {}  # v1: "artist - track" -> number in this slice
+    if songs is None:
+        intern = lambda key: keys.setdefault(f"{key[0]} - {key[1]}", len(keys))
+    else:
+        intern = songs.intern
+    song1, song2, counts = count_slice_pair_ids(file_path, intern, strategy, metrics)
+    with metrics.stage('pairs') if metrics is not None else nullcontext():
+        song1, song2, counts = song1.tolist(), song2.tolist(), counts.tolist()
+        if songs is None:
+            names = list(keys)
+            song1 = [names[i] for i in song1]
+            song2 = [names[i] for i in song2]
+    return song1, song2, counts
+
+def count_slice_pair_ids(file_path, intern, strategy=None, metrics=None):
+    # (song1, song2, counts) arrays of a slice, songs numbered by intern((artist, track)).
+    # The pairs of every playlist are generated as numpy arrays in both directions and the
+    # whole slice is summed at once by aggregate_pairs.
+    song1_parts, song2_parts, weight_parts = [], [], []
+    playlists = iter_playlists(file_path)
+    if metrics is not None:
+        playlists = metrics.playlists_from(playlists)
+    for playlist_artist_song_pairs in playlists:
+        with metrics.stage('pairs') if metrics is not None else nullcontext():
+            song1, song2, weights = playlist_pair_arrays(playlist_artist_song_pairs, intern, strategy)
+            song1_parts.append(song1)
+            song2_parts.append(song2)
+            weight_parts.append(weights)
+            if metrics is not None:
+                metrics.pairs += len(song1) // 2
+    with metrics.stage('pairs') if metrics is not None else nullcontext():
+        return aggregate_pairs(song1_parts, song2_parts, weight_parts)
+
+def playlist_pair_arrays(playlist_artist_song_pairs, intern, strategy=None):
+    # (song1, song2, weights) of one playlist, each pair in both directions. weights is
+    # None when every pair counts once.
+    if strategy is not None:
+        tracks, first, second, weights = strategy.pairs(playlist_artist_song_pairs)
+    else:
+        tracks = playlist_artist_song_pairs
+        first, second = np.triu_indices(len(tracks), 1)
+        weights = None
+    ids = np.array([intern(key) for key in tracks], dtype=np.int64)
+    a, b = ids[first], ids[second]
+    if weights is not None:
+        weights = np.concatenate([weights, weights])
+    return np.concatenate([a, b]), np.concatenate([b, a]), weights
+
+def aggregate_pairs(song1_parts, song2_parts, weight_parts):
+    # Sum equal (song1, song2) rows. Song numbers are below 2**31, so a row packs into
+    # one int64 and np.unique does the grouping. Counts stay integers unless a strategy
+    # gave fractional weights.
+    if not song1_parts:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    packed = np.concatenate(song1_parts) << 32 | np.concatenate(song2_parts)
+    if all(weights is None for weights in weight_parts):
+        packed, counts = np.unique(packed, return_counts=True)
+    else:
+        weights = np.concatenate([np.ones(len(part)) if weights is None else weights
+                                  for part, weights in zip(song1_parts, weight_parts)])
+        packed, inverse = np.unique(packed, return_inverse=True)
+        counts = np.bincount(inverse.ravel(), weights=weights)
+        if np.array_equal(counts, np.round(counts)):
+            counts = counts.astype(np.int64)
+    return packed >> 32, packed & 0xFFFFFFFF, counts
+
+def stage_pair_counts(conn, pair_counts, table="staging"):
+    # Write the aggregated (song1, song2, counts) rows with a single executemany into an
+    # index-free table
+    song1, song2, counts = pair_counts
+    c = conn.cursor()
+    c.executemany(f'INSERT INTO {table} (song1, song2, count) VALUES (?, ?, ?)', zip(song1, song2, counts))
+    return len(counts)
+
+def merge_staged_counts(conn, table="staging", target="co_occurrences"):
+    # Fold the staged rows into the pair table with one INSERT ... SELECT ... GROUP BY
+    c = conn.cursor()
+    c.execute(f'''
+        INSERT INTO {target} (song1, song2, count)
+        SELECT song1, song2, SUM(count) FROM {table} WHERE true GROUP BY song1, song2
+        ON CONFLICT(song1, song2) DO UPDATE SET count = count + excluded.count
+    ''')
+    c.execute(f'DELETE FROM {table}')
+
+def bulk_update_database_with_slice(file_path, db_path="co_occurrences.db", strategy=None):
+    # Same result as update_database_with_slice, but the slice is counted in memory first
+    # and written in one transaction instead of one statement per pair
+    conn = sqlite3.connect(db_path)
+    tune_connection(conn)
+    c = conn.cursor()
+    songs = SongTable(conn) if get_schema_version(conn) == 2 else None
+    pair_counts = count_slice_pairs(file_path, songs, strategy)
+
+    c.execute('CREATE TEMP TABLE IF NOT EXISTS staging (song1, song2, count INTEGER)')
+    if songs is not None:
+        songs.flush(conn)
+    rows = stage_pair_counts(conn, pair_counts)
+    merge_staged_counts(conn, target="pairs" if songs is not None else "co_occurrences")
+    bump_data_version(conn)
     conn.commit()
     conn.close()
+    return rows
 
-def update_co_occurrences_from_folder_database(folder_path, db_path="co_occurrences.db", slice_limit=5):
-    # List all JSON files in the given folder and sort them
-    filenames = [f for f in os.listdir(folder_path) if f.endswith('.json')]
-    # Implement a custom sort function if needed, like numerical_sort_key, to ensure correct order
-    filenames.sort(key=numerical_sort_key)  # Assuming numerical_sort_key function is defined elsewhere
+def bulk_update_co_occurrences_from_folder_database(folder_path, db_path="co_occurrences.db", slice_limit=5, defer_index=False, strategy=None, profile=False):
+    # Bulk version of update_co_occurrences_from_folder_database. With defer_index the
+    # slices are all staged into a plain table first and merged into the indexed
+    # co_occurrences table once at the end, so the primary key index is only built once.
+    # Like the per-pair version it only applies slices missing from the manifest, and each
+    # slice is committed together with its manifest entry. Slices staged by an interrupted
+    # defer_index run are recorded already and get merged by the next run.
+    # Slice and ingest events go to the metrics hooks, profile=True adds a 'profile' event.
+    conn = sqlite3.connect(db_path)
+    tune_connection(conn)
+    c = conn.cursor()
+    pending = pending_slices(conn, folder_path, slice_limit)
+    songs = SongTable(conn) if get_schema_version(conn) == 2 else None
+    target = "pairs" if songs is not None else "co_occurrences"
+    leftover = c.execute("SELECT 1 FROM sqlite_master WHERE name = 'co_occurrences_staging'").fetchone() is not None
+    if defer_index or leftover:
+        c.execute('CREATE TABLE IF NOT EXISTS co_occurrences_staging (song1, song2, count INTEGER)')
+    if defer_index:
+        table = "co_occurrences_staging"
+        if songs is not None:
+            # The top-N index is rebuilt once after the load
+            c.execute('DROP INDEX IF EXISTS pairs_top')
+    else:
+        c.execute('CREATE TEMP TABLE IF NOT EXISTS staging (song1, song2, count INTEGER)')
+        table = "staging"
+    conn.commit()
 
-    # Process files up to the slice_limit
-    for i, filename in enumerate(filenames[:slice_limit]):
-        print(f"Processing slice {i+1}/{slice_limit}: {filename}")
-        file_path = os.path.join(folder_path, filename)
-        # Update the database with co-occurrences from this slice
-        update_database_with_slice(file_path, db_path)
+    start_time = time.perf_counter()
+    total_rows = 0
+    slice_events = []
+    with SamplingProfiler(label='bulk_update_co_occurrences_from_folder_database') if profile else nullcontext():
+        for i, (filename, file_path, content_hash) in enumerate(pending):
+            print(f"Processing slice {i+1}/{len(pending)}: {filename}")
+            metrics = SliceMetrics(filename, 'sqlite')
+            pair_counts = count_slice_pairs(file_path, songs, strategy, metrics)
+            with metrics.stage('store'):
+                if songs is not None:
+                    songs.flush(conn)
+                total_rows += stage_pair_counts(conn, pair_counts, table)
+                if not defer_index:
+                    merge_staged_counts(conn, table, target)
+                    bump_data_version(conn)
+                record_slice(conn, filename, file_path, content_hash)
+                conn.commit()
+            # Songs known so far in v2; v1 has no song table to count without a scan
+            metrics.distinct_keys = len(songs.ids) if songs is not None else None
+            slice_events.append(metrics.as_event())
+            emit(slice_events[-1])
+
+        if defer_index or leftover:
+            table = "co_occurrences_staging"
+            print(f"Merging staged rows into {target}")
+            merge_staged_counts(conn, table, target)
+            c.execute(f'DROP TABLE {table}')
+            if songs is not None:
+                c.execute(PAIRS_TOP_INDEX)
+            bump_data_version(conn)
+            conn.commit()
+        conn.close()
+
+    elapsed = time.perf_counter() - start_time
+    emit(ingest_event('sqlite', slice_events, elapsed))
+    rows_per_sec = total_rows / elapsed if elapsed > 0 else 0.0
+    print(f"Finished updating co-occurrences in the database: {total_rows} rows in {elapsed:.1f}s ({rows_per_sec:,.0f} rows/sec)")
+    return rows_per_sec
+
+def update_co_occurrences_from_folder_database(folder_path, db_path="co_occurrences.db", slice_limit=5, strategy=None, profile=False):
+    # Find the next slice_limit slices (numerical order) that are not in the manifest yet,
+    # so reruns don't double count and an interrupted run resumes where it stopped
+    conn = sqlite3.connect(db_path)
+    pending = pending_slices(conn, folder_path, slice_limit)
+    conn.commit()
+    conn.close()
+
+    # Process the pending files
+    start_time = time.perf_counter()
+    slice_events = []
+    with SamplingProfiler(label='update_co_occurrences_from_folder_database') if profile else nullcontext():
+        for i, (filename, file_path, content_hash) in enumerate(pending):
+            print(f"Processing slice {i+1}/{len(pending)}: {filename}")
+            # Update the database with co-occurrences from this slice, recording it in the manifest
+            metrics = SliceMetrics(filename, 'sqlite')
+            update_database_with_slice(file_path, db_path, manifest_entry=(filename, file_path, content_hash), strategy=strategy, metrics=metrics)
+            metrics.distinct_keys = None  # v1 keys, not counted without a table scan
+            slice_events.append(metrics.as_event())
+            emit(slice_events[-1])
+    emit(ingest_event('sqlite', slice_events, time.perf_counter() - start_time))
 
     # Since the database is being updated directly, there's no dictionary to return
     print("Finished updating co-occurrences in the database.")
 
 
 def find_top_co_occurrences_database(db_path, artist_name, song_name, top_n=10):
+    if os.path.isdir(db_path):
+        # A sharded store, the router asks the song's shard
+        from src.sharded_store import ShardedCoOccurrenceQuery
+        with ShardedCoOccurrenceQuery(db_path) as router:
+            return router.find_top_co_occurrences(artist_name, song_name, top_n)
+
     # Construct the search key from artist name and song name
     search_key = f"{artist_name} - {song_name}"
     
@@ -75,15 +441,28 @@ def find_top_co_occurrences_database(db_path, artist_name, song_name, top_n=10):
     conn = sqlite3.connect(db_path)
     c = conn.cursor()
     
-    # Execute a query to find the top co-occurring songs for the given song
-    query = '''
-    SELECT song2, count 
-    FROM co_occurrences 
-    WHERE song1 = ? 
-    ORDER BY count DESC 
-    LIMIT ?
-    '''
-    c.execute(query, (search_key, top_n))
+    if get_schema_version(conn) == 2:
+        # Range scan of pairs_top for the seed's id, names joined back from songs
+        query = '''
+        SELECT s2.artist || ' - ' || s2.track, p.count
+        FROM songs s1
+        JOIN pairs p ON p.song1 = s1.id
+        JOIN songs s2 ON s2.id = p.song2
+        WHERE s1.artist = ? AND s1.track = ?
+        ORDER BY p.count DESC
+        LIMIT ?
+        '''
+        c.execute(query, (artist_name, song_name, top_n))
+    else:
+        # Execute a query to find the top co-occurring songs for the given song
+        query = '''
+        SELECT song2, count 
+        FROM co_occurrences 
+        WHERE song1 = ? 
+        ORDER BY count DESC 
+        LIMIT ?
+        '''
+        c.execute(query, (search_key, top_n))
     
     # Fetch the results
     results = c.fetchall()
@@ -98,6 +477,163 @@ def find_top_co_occurrences_database(db_path, artist_name, song_name, top_n=10):
     
     return top_co_occurrences
 
+class CoOccurrenceQuery:
+    # Reusable read-only query object for the recommender. Each thread gets its own
+    # connection, opened once and kept; sqlite3 caches the prepared statements of each
+    # connection, so repeated lookups skip both connection setup and SQL parsing.
+    # Songs are identified by integer id in v2 databases and by "artist - track" in v1.
+
+    # SQLite allows at most 500 SELECTs in one compound statement (SQLITE_MAX_COMPOUND_SELECT)
+    # and, in builds before 3.32, 999 host parameters (SQLITE_MAX_VARIABLE_NUMBER). Every
+    # seed takes one SELECT and 4 parameters.
+    SEEDS_PER_STATEMENT = 999 // 4
+
+    def __init__(self, db_path="co_occurrences.db", cached_statements=256):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.schema_version = get_schema_version(self.connection())
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            # Only this thread uses it, close() may run on another one
+            conn = sqlite3.connect(uri, uri=True, cached_statements=self.cached_statements, check_same_thread=False)
+            conn.execute('PRAGMA query_only = ON')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _seed_query(self):
+        # Top-N neighbours of one seed, selected by (artist, track)
+        if self.schema_version == 2:
+            return '''SELECT * FROM (
+                SELECT ? AS seed, p.song1, p.song2, p.count
+                FROM songs s JOIN pairs p ON p.song1 = s.id
+                WHERE s.artist = ? AND s.track = ?
+                ORDER BY p.count DESC LIMIT ?)'''
+        return '''SELECT * FROM (
+            SELECT ? AS seed, song1, song2, count
+            FROM co_occurrences
+            WHERE song1 = ? || ' - ' || ?
+            ORDER BY count DESC LIMIT ?)'''
+
+    def top_neighbours_batch(self, playlist, top_n=50):
+        # Resolve a playlist with one statement per SEEDS_PER_STATEMENT seeds: one bounded
+        # index range scan per seed, glued together with UNION ALL. Returns a list aligned
+        # with the playlist of (seed_id, [(song_id, count), ...]); seed_id is None for
+        # unknown seeds.
+        results = [(None, []) for _ in playlist]
+        conn = self.connection()
+        for start in range(0, len(playlist), self.SEEDS_PER_STATEMENT):
+            chunk = playlist[start:start + self.SEEDS_PER_STATEMENT]
+            query = ' UNION ALL '.join([self._seed_query()] * len(chunk))
+            params = []
+            for i, (artist, track) in enumerate(chunk, start):
+                params.extend((i, artist, track, top_n))
+            for seed, song1, song2, count in conn.execute(query, params):
+                results[seed] = (song1, results[seed][1])
+                results[seed][1].append((song2, count))
+        return results
+
+    def data_version(self):
+        # Counter bumped by every ingest, 0 for databases written before it existed
+        try:
+            row = self.connection().execute('SELECT version FROM data_version').fetchone()
+        except sqlite3.OperationalError:
+            return 0
+        return row[0] if row is not None else 0
+
+    def top_neighbours(self, artist_name, song_name, top_n=50):
+        return self.top_neighbours_batch([(artist_name, song_name)], top_n)[0][1]
+
+    def song_names(self, song_ids):
+        # {song_id: (artist_name, track_name)} for the given ids
+        song_ids = list(song_ids)
+        if self.schema_version != 2:
+            return {key: tuple(key.split(' - ', 1)) for key in song_ids}
+        names = {}
+        conn = self.connection()
+        # Stay below SQLite's limit on host parameters
+        for start in range(0, len(song_ids), 500):
+            chunk = song_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for song_id, artist, track in conn.execute(f'SELECT id, artist, track FROM songs WHERE id IN ({placeholders})', chunk):
+                names[song_id] = (artist, track)
+        return names
+
+QUERY_OBJECTS = {}
+
+def get_query(db_path="co_occurrences.db"):
+    # One shared CoOccurrenceQuery per database file (a router for a sharded store)
+    if db_path not in QUERY_OBJECTS:
+        if os.path.isdir(db_path):
+            from src.sharded_store import ShardedCoOccurrenceQuery
+            QUERY_OBJECTS[db_path] = ShardedCoOccurrenceQuery(db_path)
+        else:
+            QUERY_OBJECTS[db_path] = CoOccurrenceQuery(db_path)
+    return QUERY_OBJECTS[db_path]
+
+def migrate_database_to_v2(old_db_path, new_db_path):
+    # Convert a v1 database ("artist - track" TEXT keys) into a new v2 database file.
+    # Keys are split on the first " - ", like artist_song_string_split does.
+    setup_database(new_db_path, schema_version=2)
+    conn = sqlite3.connect(new_db_path)
+    tune_connection(conn)
+    c = conn.cursor()
+    c.execute('ATTACH DATABASE ? AS old', (old_db_path,))
+
+    print("Collecting songs")
+    c.execute('CREATE TEMP TABLE song_keys (id INTEGER PRIMARY KEY, key TEXT UNIQUE)')
+    c.execute('''INSERT INTO song_keys (key)
+                 SELECT song1 FROM old.co_occurrences UNION SELECT song2 FROM old.co_occurrences''')
+    c.execute('''INSERT INTO songs (id, artist, track)
+                 SELECT id, substr(key, 1, instr(key, ' - ') - 1), substr(key, instr(key, ' - ') + 3)
+                 FROM song_keys''')
+
+    print("Copying pairs")
+    c.execute('DROP INDEX pairs_top')  # Built once after the copy
+    c.execute('''INSERT INTO pairs (song1, song2, count)
+                 SELECT k1.id, k2.id, o.count
+                 FROM old.co_occurrences o
+                 JOIN song_keys k1 ON k1.key = o.song1
+                 JOIN song_keys k2 ON k2.key = o.song2
+                 ORDER BY k1.id, k2.id''')
+    print("Building index")
+    c.execute(PAIRS_TOP_INDEX)
+
+    # The counts came with their slices, so the manifest comes along and later incremental
+    # runs skip them; the data version carries on from the old one. Databases from before
+    # the manifest have neither table.
+    old_tables = {name for name, in c.execute("SELECT name FROM old.sqlite_master WHERE type = 'table'")}
+    if 'ingested_slices' in old_tables:
+        c.execute('''INSERT INTO ingested_slices (filename, content_hash, file_size, ingested_at)
+                     SELECT filename, content_hash, file_size, ingested_at FROM old.ingested_slices''')
+    if 'data_version' in old_tables:
+        c.execute('INSERT INTO data_version (id, version) SELECT id, version FROM old.data_version')
+    bump_data_version(conn)
+    conn.commit()
+    c.execute('DETACH DATABASE old')
+    conn.close()
+    print(f"Migrated {old_db_path} to schema version 2 in {new_db_path}")
+
 """def get_recommendations(playlist, co_occurences, top_n=10, database=False):
     co_occurences_list = []
     for artist, song in playlist:
@@ -107,4 +643,15 @@ def find_top_co_occurrences_database(db_path, artist_name, song_name, top_n=10):
 
     # Combined co-occurences
     combined_co_occurences = combine_co_occurence_list(co_occurences_list)
-    print_combined_co_occurrences(combined_co_occurences, top_n=top_n, playlist=playlist)"""
\ No newline at end of file
+    print_combined_co_occurrences(combined_co_occurences, top_n=top_n, playlist=playlist)"""
+
+if __name__ == "__main__":
+    # python -m src.database migrate old.db new.db
+    parser = argparse.ArgumentParser(description="Co-occurrence database tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="convert a v1 database to schema version 2")
+    migrate.add_argument("old_db")
+    migrate.add_argument("new_db")
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate_database_to_v2(args.old_db, args.new_db)
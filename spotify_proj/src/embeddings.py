@@ -0,0 +1,212 @@
+import json
+import os
+import sqlite3
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import sparse
+from src.topk_index import name_table, find_song
+from src.metrics import timed_query
+
+# Dense song embeddings trained offline from the co-occurrence counts. The counts are
+# turned into a positive PMI matrix and factorized with a randomized truncated SVD, every
+# song becomes U[i] * sqrt(s), so the dot product of two songs approximates their PMI. A
+# playlist query is then the mean of its seed vectors and one matrix-vector product
+# against all songs, so serving needs O(songs * dim) memory instead of O(pairs), and songs that never shared
+# a playlist with the seeds can still be recommended.
+#
+# The embeddings are a directory like the audio index: vectors.npy (float32, opened with a
+# memory map), the song names in the top-K index layout and meta.json.
+EMBEDDING_VERSION = 1
+ARRAYS = ['vectors', 'name_offsets', 'names', 'sorted_ids']
+
+
+def ppmi_matrix(counts, alpha=0.75, shift=1.0):
+    # Positive PMI of a symmetric count matrix. The context counts are raised to alpha
+    # (context distribution smoothing, stops rare songs from getting huge PMI values) and
+    # shift > 1 subtracts log(shift) like the negative samples of word2vec. Self pairs
+    # (a song twice in one playlist) are dropped.
+    counts = sparse.coo_matrix(counts)
+    keep = counts.row != counts.col
+    rows, cols = counts.row[keep], counts.col[keep]
+    data = counts.data[keep].astype(np.float64)
+    n = counts.shape[0]
+    song_totals = np.bincount(rows, weights=data, minlength=n)
+    context_totals = np.bincount(cols, weights=data, minlength=n) ** alpha
+    pmi = (np.log(data) - np.log(song_totals[rows])
+           - np.log(context_totals[cols]) + np.log(context_totals.sum()) - np.log(shift))
+    positive = pmi > 0
+    return sparse.csr_matrix((pmi[positive].astype(np.float32), (rows[positive], cols[positive])), shape=(n, n))
+
+
+def sparse_product(matrix, dense, workers=1):
+    # matrix @ dense, split into row blocks over a thread pool (scipy releases the GIL in
+    # the sparse kernels, numpy's BLAS threads the dense steps on its own)
+    if workers <= 1:
+        return matrix @ dense
+    bounds = np.linspace(0, matrix.shape[0], workers + 1).astype(np.int64)
+    result = np.empty((matrix.shape[0], dense.shape[1]), dtype=np.result_type(matrix.dtype, dense.dtype))
+
+    def block(i):
+        result[bounds[i]:bounds[i + 1]] = matrix[bounds[i]:bounds[i + 1]] @ dense
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(block, range(workers)))
+    return result
+
+
+def randomized_svd(matrix, dim, oversample=10, power_iterations=4, seed=0, workers=1):
+    # Truncated SVD of a sparse matrix (Halko, Martinsson & Tropp): project onto a random
+    # subspace, sharpen it with a few power iterations (re-orthonormalized each time so
+    # float32 is enough), then take the exact SVD of the small projected matrix.
+    # Returns U (n x dim) and s (dim).
+    rng = np.random.default_rng(seed)
+    transposed = matrix.T.tocsr()
+    width = min(dim + oversample, min(matrix.shape))
+    basis = sparse_product(matrix, rng.standard_normal((matrix.shape[1], width)).astype(np.float32), workers)
+    basis, _ = np.linalg.qr(basis)
+    for _ in range(power_iterations):
+        basis, _ = np.linalg.qr(sparse_product(transposed, basis, workers))
+        basis, _ = np.linalg.qr(sparse_product(matrix, basis, workers))
+    projected = sparse_product(transposed, basis, workers).T  # width x n
+    small_u, s, _ = np.linalg.svd(projected, full_matrices=False)
+    return (basis @ small_u[:, :dim]).astype(np.float32), s[:dim]
+
+
+def embed(counts, dim=128, alpha=0.75, shift=1.0, oversample=10, power_iterations=4, seed=0, workers=1):
+    # Song vectors and the singular values. The vectors are not normalized: on held-out
+    # playlists the dot product ranked better than the cosine, the vector length carries
+    # how well a song is known. Songs without any positive PMI entry get a zero vector.
+    u, s = randomized_svd(ppmi_matrix(counts, alpha, shift), dim, oversample, power_iterations, seed, workers)
+    return u * np.sqrt(s).astype(np.float32), s
+
+
+def write_embeddings(path, songs, vectors, meta):
+    name_offsets, names, sorted_ids = name_table(songs)
+    os.makedirs(path, exist_ok=True)
+    arrays = {'vectors': np.ascontiguousarray(vectors, dtype=np.float32), 'name_offsets': name_offsets,
+              'names': names, 'sorted_ids': sorted_ids}
+    for name, values in arrays.items():
+        np.save(os.path.join(path, f"{name}.npy"), values)
+    with open(os.path.join(path, 'meta.json'), 'w') as file:
+        json.dump(dict(meta, version=EMBEDDING_VERSION, songs=len(songs), dim=int(vectors.shape[1])), file)
+
+
+def train_embeddings(co_occurrences, path, dim=128, alpha=0.75, shift=1.0, power_iterations=4, seed=0, workers=1):
+    # Train from a CoOccurrenceMatrix and write the embeddings to path
+    vectors, s = embed(co_occurrences.symmetric, dim, alpha, shift, power_iterations=power_iterations, seed=seed, workers=workers)
+    write_embeddings(path, co_occurrences.songs, vectors,
+                     {'alpha': alpha, 'shift': shift, 'singular_values': s.tolist()})
+    return SongEmbeddings(path)
+
+
+def database_counts(db_path):
+    # (songs, symmetric CSR counts) of a schema v2 database, ids renumbered densely in id
+    # order like build_topk_index_from_database
+    conn = sqlite3.connect(db_path)
+    if conn.execute('PRAGMA user_version').fetchone()[0] != 2:
+        conn.close()
+        raise ValueError(f"{db_path} is not a schema version 2 database, migrate it first")
+    db_ids, songs = [], []
+    for song_id, artist, track in conn.execute('SELECT id, artist, track FROM songs ORDER BY id'):
+        db_ids.append(song_id)
+        songs.append((artist, track))
+    song1, song2, counts = array('q'), array('q'), array('d')
+    # v2 stores both directions of every pair
+    for row in conn.execute('SELECT song1, song2, count FROM pairs'):
+        song1.append(row[0])
+        song2.append(row[1])
+        counts.append(row[2])
+    conn.close()
+    db_ids = np.array(db_ids, dtype=np.int64)
+    rows = np.searchsorted(db_ids, np.frombuffer(song1, dtype=np.int64))
+    cols = np.searchsorted(db_ids, np.frombuffer(song2, dtype=np.int64))
+    matrix = sparse.csr_matrix((np.frombuffer(counts, dtype=np.float64), (rows, cols)), shape=(len(songs), len(songs)))
+    return songs, matrix
+
+
+def train_embeddings_from_database(db_path, path, dim=128, alpha=0.75, shift=1.0, power_iterations=4, seed=0, workers=1):
+    songs, counts = database_counts(db_path)
+    vectors, s = embed(counts, dim, alpha, shift, power_iterations=power_iterations, seed=seed, workers=workers)
+    write_embeddings(path, songs, vectors, {'alpha': alpha, 'shift': shift, 'singular_values': s.tolist()})
+    return SongEmbeddings(path)
+
+
+class SongEmbeddings:
+    # Read side: every array is memory mapped, so opening is instant and processes share pages
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        if self.meta['version'] != EMBEDDING_VERSION:
+            raise ValueError(f"{path} is not a version {EMBEDDING_VERSION} embedding directory")
+        for name in ARRAYS:
+            # Plain ndarray views of the maps, np.memmap indexing is slow in the name lookups
+            setattr(self, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None)))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    def song_id(self, key):
+        return find_song(self.names, self.name_offsets, self.sorted_ids, key)
+
+    def song_name(self, song_id):
+        name = self.names[self.name_offsets[song_id]:self.name_offsets[song_id + 1]].tobytes()
+        return tuple(name.decode('utf-8').split('\0', 1))
+
+    def __contains__(self, key):
+        return self.song_id(key) is not None
+
+
+class EmbeddingScorer:
+    # Same interface as PlaylistScorer: the query vector is the mean of the seed vectors and
+    # the scores are its dot products with every song, batch_size playlists per matrix
+    # product
+
+    def __init__(self, embeddings, batch_size=32):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+
+    def song_id(self, key):
+        return self.embeddings.song_id(key)
+
+    def song_name(self, song_id):
+        return self.embeddings.song_name(song_id)
+
+    def query_vectors(self, playlists):
+        # (playlists x dim) query matrix and the seed ids of every playlist
+        queries = np.zeros((len(playlists), self.embeddings.dim), dtype=np.float32)
+        seeds = []
+        for i, playlist in enumerate(playlists):
+            ids = [song_id for song_id in (self.song_id(key) for key in playlist) if song_id is not None]
+            seeds.append(np.array(ids, dtype=np.int64))
+            if ids:
+                queries[i] = self.embeddings.vectors[ids].mean(axis=0)
+        return queries, seeds
+
+    def recommend_batch(self, playlists, top_n=10):
+        # Top-n ((artist, track), score) lists for many playlists at once
+        with timed_query('embedding', sum(len(playlist) for playlist in playlists), top_n):
+            queries, seeds = self.query_vectors(playlists)
+            results = []
+            for start in range(0, len(playlists), self.batch_size):
+                scores = queries[start:start + self.batch_size] @ self.embeddings.vectors.T  # batch x songs
+                for row, ids in zip(scores, seeds[start:start + self.batch_size]):
+                    count = min(top_n, len(row) - len(np.unique(ids)))
+                    if len(ids) == 0 or count <= 0:
+                        results.append([])
+                        continue
+                    row[ids] = -np.inf
+                    best = np.argpartition(-row, count - 1)[:count]
+                    best = best[np.lexsort((best, -row[best]))]
+                    results.append([(self.song_name(song_id), score) for song_id, score
+                                    in zip(best.tolist(), row[best].astype(np.float64).tolist())])
+            return results
+
+    def recommend(self, playlist, top_n=10):
+        return self.recommend_batch([playlist], top_n)[0]
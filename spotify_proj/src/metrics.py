@@ -0,0 +1,201 @@
+import json
+import logging
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Instrumentation for the ingestion and query paths. Code on those paths fills a
+# SliceMetrics (or a plain dict for queries) and hands it to emit(), which passes it to
+# every registered hook. A hook is any callable taking one event dict, e.g.
+#   add_metrics_hook(log_metrics)          # one JSON log line per event
+#   recorder = MetricsRecorder(); add_metrics_hook(recorder)
+# Every event has an 'event' field: 'slice', 'ingest', 'query' or 'profile'.
+
+METRICS_HOOKS = []
+logger = logging.getLogger('spotify_proj.metrics')
+
+
+def add_metrics_hook(hook):
+    METRICS_HOOKS.append(hook)
+    return hook
+
+
+def remove_metrics_hook(hook):
+    if hook in METRICS_HOOKS:
+        METRICS_HOOKS.remove(hook)
+
+
+def hooks_active():
+    return bool(METRICS_HOOKS)
+
+
+def emit(event):
+    for hook in list(METRICS_HOOKS):
+        hook(event)
+
+
+def log_metrics(event):
+    # Structured log line hook
+    logger.info(json.dumps(event, sort_keys=True, default=str))
+
+
+class MetricsRecorder:
+    # Hook that keeps the events in memory, handy in a notebook
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event):
+        self.events.append(event)
+
+    def of_type(self, name):
+        return [event for event in self.events if event['event'] == name]
+
+
+def peak_rss_bytes():
+    # Memory high-water mark of the process; ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class SliceMetrics:
+    # Timings and counters of one ingested slice. Stages:
+    #   parse: reading playlists out of the JSON
+    #   pairs: turning playlists into pairs (interning, triu / PairStrategy, aggregation)
+    #   store: adding the pairs to the matrix or writing them to SQLite
+
+    def __init__(self, filename, backend):
+        self.filename = filename
+        self.backend = backend
+        self.timings = {'parse': 0.0, 'pairs': 0.0, 'store': 0.0}
+        self.playlists = 0
+        self.tracks = 0
+        self.pairs = 0
+        self.distinct_keys = 0
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - start
+
+    def playlists_from(self, playlists):
+        # Wrap a playlist iterator: the time spent producing playlists counts as parse time
+        iterator = iter(playlists)
+        while True:
+            start = time.perf_counter()
+            playlist = next(iterator, None)
+            self.timings['parse'] += time.perf_counter() - start
+            if playlist is None:
+                return
+            self.playlists += 1
+            self.tracks += len(playlist)
+            yield playlist
+
+    def as_event(self):
+        seconds = time.perf_counter() - self.start
+        return {
+            'event': 'slice',
+            'backend': self.backend,
+            'slice': self.filename,
+            'seconds': seconds,
+            'parse_seconds': self.timings['parse'],
+            'pairs_seconds': self.timings['pairs'],
+            'store_seconds': self.timings['store'],
+            'playlists': self.playlists,
+            'tracks': self.tracks,
+            'pairs': self.pairs,
+            'pairs_per_sec': self.pairs / seconds if seconds > 0 else 0.0,
+            'distinct_keys': self.distinct_keys,
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+
+
+def ingest_event(backend, slice_events, seconds):
+    # Totals of a whole folder run, from its slice events
+    totals = Counter()
+    for event in slice_events:
+        for name in ('parse_seconds', 'pairs_seconds', 'store_seconds', 'playlists', 'tracks', 'pairs'):
+            totals[name] += event[name]
+    return dict(totals, event='ingest', backend=backend, slices=len(slice_events), seconds=seconds,
+                distinct_keys=slice_events[-1]['distinct_keys'] if slice_events else 0,
+                peak_rss_bytes=peak_rss_bytes())
+
+
+@contextmanager
+def timed_query(backend, seeds, top_n):
+    # Emit a 'query' event around one recommendation request, only if anyone listens
+    if not METRICS_HOOKS:
+        yield
+        return
+    start = time.perf_counter()
+    yield
+    emit({'event': 'query', 'backend': backend, 'seeds': seeds, 'top_n': top_n, 'seconds': time.perf_counter() - start})
+
+
+class SamplingProfiler:
+    # Statistical profiler: a background thread looks at the stack of the profiled thread
+    # every `interval` seconds and counts the functions it sees. Cheap enough to leave on
+    # during a long load. Use as a context manager; the results are emitted as a
+    # 'profile' event on exit.
+
+    def __init__(self, interval=0.005, top_n=25, label=None):
+        self.interval = interval
+        self.top_n = top_n
+        self.label = label
+        self.samples = 0
+        self.self_counts = Counter()  # innermost function
+        self.total_counts = Counter()  # anywhere on the stack
+        self.stacks = Counter()  # collapsed stacks, root first, for flame graphs
+        self._stop = threading.Event()
+        self._thread = None
+        self._target = None
+
+    def __enter__(self):
+        self._target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        emit(self.as_event())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            self.samples += 1
+            self.self_counts[stack[0]] += 1
+            self.total_counts.update(set(stack))
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def as_event(self):
+        samples = max(self.samples, 1)
+        return {
+            'event': 'profile',
+            'label': self.label,
+            'samples': self.samples,
+            'interval': self.interval,
+            'self': [(name, count / samples) for name, count in self.self_counts.most_common(self.top_n)],
+            'total': [(name, count / samples) for name, count in self.total_counts.most_common(self.top_n)],
+        }
+
+    def write_collapsed(self, path):
+        # "frame;frame;frame count" lines, the input format of flamegraph.pl and speedscope
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
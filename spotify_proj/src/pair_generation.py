@@ -0,0 +1,140 @@
+import os
+import random
+import time
+import zlib
+import numpy as np
+
+
+def sample_distinct(rng, total, count):
+    # count distinct integers below total, sorted, uniformly among all such sets, in
+    # O(count log count) without touching all of total: draw a few more integers than
+    # needed (about count**2 / 2total repeats are expected), keep the distinct ones and drop
+    # the surplus at random, drawing again in the rare case there are too few. Above half
+    # of total the complement is sampled instead, so the repeats never dominate.
+    if count > total // 2:
+        dropped = sample_distinct(rng, total, total - count)
+        return np.setdiff1d(np.arange(total), dropped, assume_unique=True)
+    draws = count + count * count // total + 16
+    while True:
+        drawn = np.sort(rng.integers(total, size=draws))
+        distinct = drawn[np.concatenate(([True], drawn[1:] != drawn[:-1]))]
+        if len(distinct) >= count:
+            break
+    surplus = len(distinct) - count
+    if surplus:
+        distinct = np.delete(distinct, rng.choice(len(distinct), surplus, replace=False))
+    return distinct
+
+
+class PairStrategy:
+    # Which pairs of a playlist get counted. The default counts every unordered pair of
+    # positions like the nested loop in slice_to_csv. Long playlists can be limited with
+    #   window: only pair tracks at most `window` positions apart
+    #   budget: count at most `budget` pairs per playlist, sampled deterministically from
+    #           the playlist's contents and reweighted by (candidate pairs / budget) so the
+    #           expected counts stay the same
+    #   dedupe: drop repeated tracks of a playlist before pairing
+    # With a window or a budget the work per playlist is linear in its length.
+
+    def __init__(self, window=None, budget=None, dedupe=False, seed=0):
+        self.window = window
+        self.budget = budget
+        self.dedupe = dedupe
+        self.seed = seed
+
+    def __repr__(self):
+        return f"PairStrategy(window={self.window}, budget={self.budget}, dedupe={self.dedupe})"
+
+    @property
+    def dtype(self):
+        # Sampled pairs carry fractional weights
+        return np.float32 if self.budget is not None else np.int32
+
+    def candidate_count(self, n):
+        # Number of pairs the strategy would count without a budget
+        if self.window is None or self.window >= n - 1:
+            return n * (n - 1) // 2
+        w = self.window
+        return w * n - w * (w + 1) // 2
+
+    def candidate_positions(self, indices, n):
+        # (first, second) positions of the candidate pairs with the given linear indices,
+        # numbered like np.triu_indices (all pairs) or by distance (window)
+        if self.window is None or self.window >= n - 1:
+            # Invert the row-major numbering of the upper triangle
+            total = n * (n - 1) // 2
+            first = n - 2 - np.floor(np.sqrt(-8 * indices + 4 * n * (n - 1) - 7) / 2 - 0.5).astype(np.int64)
+            second = indices + first + 1 - total + (n - first) * (n - first - 1) // 2
+            return first, second
+        # Pairs at distance d are numbered after all pairs at distances below d
+        starts = np.cumsum([0] + [n - d for d in range(1, self.window)])
+        distance = np.searchsorted(starts, indices, side='right')
+        first = indices - starts[distance - 1]
+        return first, first + distance
+
+    def positions(self, n, playlist_seed=0):
+        # (first, second, weights) for a playlist of n tracks, weights is None when every
+        # candidate pair is counted once
+        if n < 2:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, None
+        total = self.candidate_count(n)
+        if self.budget is not None and total > self.budget:
+            rng = np.random.default_rng([self.seed, playlist_seed])
+            indices = sample_distinct(rng, total, self.budget)
+            first, second = self.candidate_positions(indices, n)
+            return first, second, np.full(self.budget, total / self.budget)
+        if self.window is None or self.window >= n - 1:
+            first, second = np.triu_indices(n, k=1)
+            return first, second, None
+        first, second = self.candidate_positions(np.arange(total), n)
+        return first, second, None
+
+    def pairs(self, tracks):
+        # (tracks, first, second, weights) for a list of (artist_name, track_name) keys. The
+        # returned tracks are deduplicated if asked, first/second index into them.
+        if self.dedupe:
+            tracks = list(dict.fromkeys(tracks))
+        playlist_seed = 0
+        if self.budget is not None and self.candidate_count(len(tracks)) > self.budget:
+            # Same playlist, same sample, whatever order the slices are read in
+            playlist_seed = zlib.crc32('\0'.join(f"{artist}\0{track}" for artist, track in tracks).encode('utf-8'))
+        first, second, weights = self.positions(len(tracks), playlist_seed)
+        return tracks, first, second, weights
+
+
+def benchmark_pair_strategies(folder_path, strategies, slice_limit=5, holdout_playlists=500, top_n=10, seed=0):
+    # Ingest the first slice_limit slices with every strategy and measure the time and the
+    # recommendation quality. Quality is hit@top_n on playlists of the next slice: one random
+    # track is hidden and must show up in the recommendations for the rest of the playlist.
+    from src.collaborative_filtering import update_co_occurrences_from_folder
+    from src.scoring import PlaylistScorer
+    from src.slice_reader import iter_playlists
+
+    filenames = sorted(f for f in os.listdir(folder_path) if f.endswith('.json'))
+    if len(filenames) <= slice_limit:
+        raise ValueError(f"Need more than {slice_limit} slices in {folder_path} to hold one out")
+    holdout = [p for p in iter_playlists(os.path.join(folder_path, filenames[slice_limit])) if len(set(p)) >= 2]
+    rng = random.Random(seed)
+    holdout = rng.sample(holdout, min(holdout_playlists, len(holdout)))
+    queries, hidden = [], []
+    for playlist in holdout:
+        target = rng.choice(playlist)
+        queries.append([key for key in playlist if key != target])
+        hidden.append(target)
+
+    results = []
+    for strategy in [None] + list(strategies):
+        start = time.perf_counter()
+        co_occurrences = update_co_occurrences_from_folder(folder_path, slice_limit, strategy=strategy)
+        seconds = time.perf_counter() - start
+        recommendations = PlaylistScorer(co_occurrences).recommend_batch(queries, top_n)
+        hits = sum(target in [key for key, _ in recs] for target, recs in zip(hidden, recommendations))
+        results.append({
+            'strategy': repr(strategy) if strategy is not None else 'all pairs',
+            'seconds': seconds,
+            'pairs_stored': int(co_occurrences.nnz),
+            'hit_rate': hits / len(queries) if queries else 0.0,
+        })
+        print(f"{results[-1]['strategy']}: {seconds:.2f}s, {results[-1]['pairs_stored']:,} pairs, hit@{top_n} {results[-1]['hit_rate']:.3f}")
+    return results
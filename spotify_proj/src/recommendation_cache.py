@@ -0,0 +1,133 @@
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+
+def size_of(value):
+    # Rough memory footprint of a cached value: arrays by their buffers, containers
+    # recursively, everything else by sys.getsizeof
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(np.empty(0))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(size_of(item) for item in value)
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    # Least recently used cache bounded both by entry count and by (estimated) bytes.
+    # The whole cache belongs to one version stamp of the data; validate() with a new
+    # stamp empties it, which is how ingesting new slices invalidates cached results.
+
+    def __init__(self, max_entries=10000, max_bytes=64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.nbytes = 0
+        self.stamp = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def validate(self, stamp):
+        # Drop everything if the data changed since the entries were stored
+        with self._lock:
+            if self.stamp != stamp:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.nbytes = 0
+                self.stamp = stamp
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = size_of(key) + size_of(value)
+        with self._lock:
+            if size > self.max_bytes:
+                return  # Would evict everything else and still not fit
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.nbytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+class RecommendationCache:
+    # Two-level cache for the recommender:
+    #   seeds: normalized top-k neighbour vector of one seed song
+    #   results: final recommendations, keyed by the scorer, the sorted seeds of the playlist
+    #            and top_n
+    # Both levels are stamped with (source generation, version) and emptied when either
+    # moves, i.e. when the cache is used with another matrix or database or when new slices
+    # were added to the matrix or ingested into the database.
+
+    def __init__(self, seed_entries=100000, seed_bytes=256 << 20, result_entries=10000, result_bytes=64 << 20):
+        self.seeds = LRUCache(seed_entries, seed_bytes)
+        self.results = LRUCache(result_entries, result_bytes)
+        self.source = None  # Database path, or a weak reference to the matrix
+        self.generation = 0
+
+    def validate(self, source, version):
+        # A matrix is only held weakly, so a module-level cache does not keep a replaced
+        # matrix alive. A new matrix that gets the old one's id() is still a new source,
+        # the weak reference to the old one is dead by then. Paths compare by value.
+        if isinstance(source, str):
+            same = self.source == source
+        else:
+            same = isinstance(self.source, weakref.ref) and self.source() is source
+        if not same:
+            self.source = source if isinstance(source, str) else weakref.ref(source)
+            self.generation += 1
+        stamp = (self.generation, version)
+        self.seeds.validate(stamp)
+        self.results.validate(stamp)
+
+    @staticmethod
+    def playlist_key(playlist, top_n, scorer=None):
+        # Canonical key: the order of the seeds does not change the scores, how often a seed
+        # appears does, so duplicates are kept. scorer tells apart scorers with different
+        # settings (e.g. k) that share the cache, their results differ for the same playlist.
+        return scorer, tuple(sorted(playlist)), top_n
+
+    def clear(self):
+        self.seeds.clear()
+        self.results.clear()
+
+    def stats(self):
+        return {'seeds': self.seeds.stats(), 'results': self.results.stats()}
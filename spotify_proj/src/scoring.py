@@ -0,0 +1,143 @@
+import numpy as np
+from scipy import sparse
+from src.co_occurrence_matrix import CoOccurrenceMatrix
+from src.topk_index import TopKIndex, top_k_rows
+from src.metrics import timed_query
+
+
+class PlaylistScorer:
+    # Vectorized version of the get_recommendations pipeline. Each seed's top-k neighbour
+    # counts are normalized by their sum (normalize_co_occurrences), summed over the seeds
+    # with one sparse product (combine_co_occurence_list), the seeds are masked out and the
+    # best top_n are picked with argpartition. Works on a CoOccurrenceMatrix or a TopKIndex.
+    # With a RecommendationCache the per-seed rows and the final results are reused until
+    # the matrix gets new counts.
+
+    def __init__(self, co_occurrences, k=50, cache=None):
+        if not isinstance(co_occurrences, (CoOccurrenceMatrix, TopKIndex)):
+            raise TypeError("PlaylistScorer needs a CoOccurrenceMatrix or a TopKIndex")
+        self.co_occurrences = co_occurrences
+        self.k = k
+        self.cache = cache
+
+    @property
+    def version(self):
+        # A TopKIndex never changes once written
+        return getattr(self.co_occurrences, 'version', 0)
+
+    @property
+    def cache_scope(self):
+        # Part of the result cache keys, results of another k are different results
+        return type(self).__name__, self.k
+
+    def song_id(self, key):
+        if isinstance(self.co_occurrences, TopKIndex):
+            return self.co_occurrences.song_id(key)
+        return self.co_occurrences.song_ids.get(key)
+
+    def song_name(self, song_id):
+        if isinstance(self.co_occurrences, TopKIndex):
+            return self.co_occurrences.song_name(song_id)
+        return self.co_occurrences.songs[song_id]
+
+    def normalized_rows(self, seed_ids):
+        # CSR matrix with one row per seed holding its top-k neighbours, each row summing to 1
+        if self.cache is None:
+            return self._normalized_rows(seed_ids)
+        self.cache.validate(self.co_occurrences, self.version)
+        rows = [self.cache.seeds.get((self.k, song_id)) for song_id in seed_ids.tolist()]
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = self._normalized_rows(seed_ids[missing])
+            for i, position in enumerate(missing):
+                start, end = computed.indptr[i], computed.indptr[i + 1]
+                rows[position] = (computed.indices[start:end].copy(), computed.data[start:end].copy())
+                self.cache.seeds.put((self.k, int(seed_ids[position])), rows[position])
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids, _ in rows], out=offsets[1:])
+        ids = np.concatenate([ids for ids, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+        weights = np.concatenate([weights for _, weights in rows]) if rows else np.zeros(0)
+        return sparse.csr_matrix((weights, ids, offsets), shape=(len(rows), len(self.co_occurrences)))
+
+    def _normalized_rows(self, seed_ids):
+        if isinstance(self.co_occurrences, TopKIndex):
+            index = self.co_occurrences
+            starts = index.offsets[seed_ids]
+            lengths = np.minimum(index.offsets[seed_ids + 1] - starts, self.k)
+            offsets = np.zeros(len(seed_ids) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            # Gather the rows' entries from the index in one fancy-indexing step
+            positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+            ids, counts = index.ids[positions], index.counts[positions]
+            n = len(index)
+        else:
+            matrix = self.co_occurrences.symmetric
+            offsets, ids, counts = top_k_rows(matrix[seed_ids], self.k)
+            n = matrix.shape[0]
+        lengths = np.diff(offsets)
+        rows = np.repeat(np.arange(len(seed_ids)), lengths)
+        totals = np.bincount(rows, weights=counts, minlength=len(seed_ids))
+        counts = counts / totals[rows]
+        return sparse.csr_matrix((counts, ids, offsets), shape=(len(seed_ids), n))
+
+    def seed_matrix(self, playlists):
+        # Sparse (playlists x unique seeds) matrix counting each seed in each playlist, plus
+        # the unique seed ids. Unknown songs are skipped.
+        rows, seed_ids = [], []
+        for i, playlist in enumerate(playlists):
+            for key in playlist:
+                song_id = self.song_id(key)
+                if song_id is not None:
+                    rows.append(i)
+                    seed_ids.append(song_id)
+        unique_ids, columns = np.unique(np.array(seed_ids, dtype=np.int64), return_inverse=True)
+        seeds = sparse.csr_matrix(
+            (np.ones(len(rows)), (np.array(rows, dtype=np.int64), columns.reshape(-1))),
+            shape=(len(playlists), len(unique_ids)),
+        )
+        return seeds, unique_ids
+
+    def score_batch(self, playlists):
+        # (playlists x songs) sparse score matrix with the seeds of each playlist masked out
+        seeds, unique_ids = self.seed_matrix(playlists)
+        scores = (seeds @ self.normalized_rows(unique_ids)).tocsr()
+        # Seed positions in song space, removed from the scores
+        seed_positions = sparse.csr_matrix(
+            (np.ones(seeds.nnz), unique_ids[seeds.indices], seeds.indptr), shape=scores.shape
+        ).sorted_indices()
+        scores = (scores - scores.multiply(seed_positions)).tocsr()
+        scores.eliminate_zeros()
+        return scores
+
+    def recommend_batch(self, playlists, top_n=10):
+        # Top-n ((artist, track), score) lists for many playlists at once
+        with timed_query('memory', sum(len(playlist) for playlist in playlists), top_n):
+            if self.cache is None:
+                return self._recommend_batch(playlists, top_n)
+            self.cache.validate(self.co_occurrences, self.version)
+            keys = [self.cache.playlist_key(playlist, top_n, self.cache_scope) for playlist in playlists]
+            results = [self.cache.results.get(key) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                computed = self._recommend_batch([playlists[i] for i in missing], top_n)
+                for position, result in zip(missing, computed):
+                    results[position] = result
+                    self.cache.results.put(keys[position], result)
+            return results
+
+    def _recommend_batch(self, playlists, top_n=10):
+        scores = self.score_batch(playlists)
+        results = []
+        for i in range(scores.shape[0]):
+            start, end = scores.indptr[i], scores.indptr[i + 1]
+            data, ids = scores.data[start:end], scores.indices[start:end]
+            if len(data) > top_n:
+                best = np.argpartition(-data, top_n - 1)[:top_n]
+            else:
+                best = np.arange(len(data))
+            best = best[np.argsort(-data[best], kind='stable')]
+            results.append([(self.song_name(song_id), score) for song_id, score in zip(ids[best].tolist(), data[best].tolist())])
+        return results
+
+    def recommend(self, playlist, top_n=10):
+        return self.recommend_batch([playlist], top_n)[0]
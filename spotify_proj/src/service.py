@@ -0,0 +1,329 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from src.collaborative_filtering import get_database_recommendations_batch, load_co_occurrences, RECOMMENDATION_CACHE
+from src.database import CoOccurrenceQuery
+from src.scoring import PlaylistScorer
+
+# Local HTTP/JSON recommendation service, stdlib asyncio only. From spotify_proj:
+#   python -m src.service --db co_occurrences.db --port 8080
+#   curl -d '{"playlist": [["Drake", "One Dance"]], "top_n": 5}' localhost:8080/recommend
+#   curl localhost:8080/health
+#
+# Requests that arrive within batch_window of each other are coalesced into one batch and
+# scored with one call of the back end's batch function (one SQLite lookup per distinct
+# seed of the batch, or one sparse product for a snapshot), which runs in a bounded thread
+# pool. When max_pending requests are already queued new ones get 503, and a request that
+# is not answered within the timeout gets 504.
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+           500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class LatencyHistogram:
+    # Counts per latency bucket (upper bounds in milliseconds, plus one overflow bucket)
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        milliseconds = seconds * 1000
+        position = next((i for i, bound in enumerate(self.buckets) if milliseconds <= bound), len(self.buckets))
+        self.counts[position] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if self.count == 0:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + [self.max], self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        labels = [f"le_{bound}ms" for bound in self.buckets] + ['inf']
+        return {
+            'buckets': dict(zip(labels, self.counts)),
+            'count': self.count,
+            'mean_ms': self.total / self.count if self.count else None,
+            'p50_ms': self.quantile(0.5),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': self.max,
+        }
+
+
+class MicroBatcher:
+    # Collects (playlist, top_n) requests for up to batch_window seconds (or max_batch
+    # requests) and hands them to recommend_batch(playlists, top_n) in the executor. At most
+    # max_batches batches run at once, further requests wait in the queue.
+
+    def __init__(self, recommend_batch, executor, max_batches, batch_window=0.002, max_batch=64, max_pending=1024):
+        self.recommend_batch = recommend_batch
+        self.executor = executor
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.slots = asyncio.Semaphore(max_batches)
+        self.in_flight = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.batch_latency = LatencyHistogram()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def submit(self, playlist, top_n):
+        # Future for the recommendations, 503 right away if the queue is full
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((playlist, top_n, future))
+        except asyncio.QueueFull:
+            raise ServiceError(503, "too many pending requests") from None
+        return future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Requests that timed out while queued are dropped here
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            await self.slots.acquire()
+            asyncio.create_task(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            # One pass with the largest top_n of the batch, each request gets its own prefix
+            top_n = max(top_n for _, top_n, _ in batch)
+            results = await loop.run_in_executor(self.executor, self.recommend_batch, [playlist for playlist, _, _ in batch], top_n)
+            for (_, wanted, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result[:wanted])
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self.in_flight -= 1
+            self.slots.release()
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.batch_latency.observe(time.perf_counter() - start)
+
+
+class RecommendationService:
+
+    def __init__(self, recommend_batch, backend, workers=4, batch_window=0.002, max_batch=64, max_pending=1024,
+                 timeout=2.0, cache=None):
+        self.backend = backend
+        self.timeout = timeout
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recommend')
+        self.batcher = MicroBatcher(recommend_batch, self.executor, workers, batch_window, max_batch, max_pending)
+        self.latency = LatencyHistogram()
+        self.responses = Counter()
+        self.started = time.time()
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.batcher.start()
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        await self.batcher.stop()
+        self.executor.shutdown(wait=False)
+
+    async def recommend(self, body):
+        try:
+            request = json.loads(body or b'null')
+            playlist = [(str(artist), str(track)) for artist, track in request['playlist']]
+            top_n = int(request.get('top_n', 10))
+        except (ValueError, TypeError, KeyError, AttributeError):
+            raise ServiceError(400, 'expected {"playlist": [[artist, track], ...], "top_n": 10}') from None
+        if top_n < 1:
+            raise ServiceError(400, "top_n must be positive")
+        future = self.batcher.submit(playlist, top_n)
+        try:
+            results = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise ServiceError(504, f"no answer within {self.timeout}s") from None
+        return {'recommendations': [{'artist': artist, 'track': track, 'score': float(score)}
+                                    for (artist, track), score in results]}
+
+    def health(self):
+        batcher = self.batcher
+        return {
+            'status': 'ok',
+            'backend': self.backend,
+            'uptime_seconds': time.time() - self.started,
+            'pending': batcher.queue.qsize(),
+            'max_pending': batcher.queue.maxsize,
+            'in_flight_batches': batcher.in_flight,
+            'batches': batcher.batches,
+            'mean_batch_size': batcher.batched_requests / batcher.batches if batcher.batches else None,
+            'responses': {str(status): count for status, count in sorted(self.responses.items())},
+            'latency': self.latency.as_dict(),
+            'batch_latency': batcher.batch_latency.as_dict(),
+            'cache': self.cache.stats() if self.cache is not None else None,
+        }
+
+    async def route(self, method, path, body):
+        if path == '/recommend':
+            if method != 'POST':
+                raise ServiceError(405, "use POST")
+            return await self.recommend(body)
+        if path == '/health':
+            if method != 'GET':
+                raise ServiceError(405, "use GET")
+            return self.health()
+        raise ServiceError(404, f"no route {path}")
+
+    async def handle_connection(self, reader, writer):
+        # Minimal HTTP/1.1: one request after the other on a keep-alive connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start = time.perf_counter()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, {'error': "malformed request line"}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {'error': "invalid Content-Length"}, False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': "request body too large"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = 200, await self.route(method, target.split('?', 1)[0], body)
+                except ServiceError as error:
+                    status, payload = error.status, {'error': error.message}
+                except Exception as error:
+                    status, payload = 500, {'error': repr(error)}
+                if target.startswith('/recommend'):
+                    self.latency.observe(time.perf_counter() - start)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        self.responses[status] += 1
+        body = json.dumps(payload).encode('utf-8')
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def database_service(db_path, cache=RECOMMENDATION_CACHE, **options):
+    # Service over a co-occurrence database; every executor thread opens its own read-only
+    # connection through the shared CoOccurrenceQuery
+    query = CoOccurrenceQuery(db_path)
+    return RecommendationService(lambda playlists, top_n: get_database_recommendations_batch(playlists, query, top_n, cache),
+                                 'sqlite', cache=cache, **options)
+
+
+def snapshot_service(snapshot_path, cache=RECOMMENDATION_CACHE, **options):
+    # Service over a save_co_occurrences snapshot held in memory
+    scorer = PlaylistScorer(load_co_occurrences(snapshot_path), cache=cache)
+    scorer.co_occurrences.symmetric  # Built lazily, keep it out of the first request
+    return RecommendationService(scorer.recommend_batch, 'memory', cache=cache, **options)
+
+
+async def serve(service, host, port):
+    server = await service.start(host, port)
+    print(f"Serving {service.backend} recommendations on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local recommendation service")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--db', help="co-occurrence database")
+    source.add_argument('--snapshot', help="co-occurrence snapshot (.npz) to serve from memory")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help="scoring threads, also the number of concurrent batches")
+    parser.add_argument('--batch-window-ms', type=float, default=2.0)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-pending', type=int, default=1024, help="queued requests before answering 503")
+    parser.add_argument('--timeout', type=float, default=2.0, help="seconds before answering 504")
+    args = parser.parse_args()
+    options = {'workers': args.workers, 'batch_window': args.batch_window_ms / 1000, 'max_batch': args.max_batch,
+               'max_pending': args.max_pending, 'timeout': args.timeout}
+    service = database_service(args.db, **options) if args.db else snapshot_service(args.snapshot, **options)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
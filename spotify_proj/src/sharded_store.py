@@ -0,0 +1,331 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool, get_context
+from queue import Full
+import numpy as np
+from src.database import (setup_database, tune_connection, file_hash, numerical_sort_key, record_slice,
+                          bump_data_version, merge_staged_counts, count_slice_pair_ids, CoOccurrenceQuery, MANIFEST_TABLE)
+from src.metrics import SliceMetrics, emit, ingest_event
+
+# Co-occurrence store split over N SQLite files so N processes can write at once (SQLite
+# allows one writer per file) and every file stays small enough to vacuum and back up.
+# Each shard is an ordinary schema v2 database holding the rows (song1, song2, count)
+# whose song1 belongs to it, so find_top_co_occurrences_database and CoOccurrenceQuery
+# work on a single shard as they are.
+#
+# Song ids are not sequential here but a 63-bit hash of the (artist, track) key. The
+# shard of a song is id % N, so the router finds a song's shard from its key alone, and
+# it merges the results of different shards by id.
+# The ingest hands out the ids (SongIds), a song whose hash collides with another song's
+# gets the next free id in the same shard. The songs tables hold the full keys, so
+# lookups by key find it either way.
+#
+# Layout: <path>/shards.json and <path>/shard-000.db ... shard-<N-1>.db
+STORE_VERSION = 1
+
+
+def song_key_id(key):
+    digest = hashlib.blake2b(f"{key[0]}\0{key[1]}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') & ((1 << 63) - 1)
+
+
+def shard_paths(path, shards):
+    return [os.path.join(path, f"shard-{i:03d}.db") for i in range(shards)]
+
+
+def setup_sharded_store(path, shards=8):
+    os.makedirs(path, exist_ok=True)
+    meta_path = os.path.join(path, 'shards.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            meta = json.load(file)
+        if meta['shards'] != shards:
+            raise ValueError(f"{path} already has {meta['shards']} shards")
+    else:
+        with open(meta_path, 'w') as file:
+            json.dump({'version': STORE_VERSION, 'shards': shards, 'song_id': 'blake2b-63'}, file)
+    for shard_path in shard_paths(path, shards):
+        setup_database(shard_path, schema_version=2)
+
+
+def read_store_meta(path):
+    with open(os.path.join(path, 'shards.json')) as file:
+        meta = json.load(file)
+    if meta['version'] != STORE_VERSION:
+        raise ValueError(f"{path} is not a version {STORE_VERSION} sharded store")
+    return meta
+
+
+def pending_shard_slices(paths, folder_path, slice_limit=5):
+    # Like pending_slices, over all shards: the next slice_limit slices missing from at
+    # least one shard's manifest, and for every shard the ones among them it still needs.
+    # After an interrupted run the shards that fell behind catch up first.
+    applied = []
+    for shard_path in paths:
+        conn = sqlite3.connect(shard_path)
+        conn.execute(MANIFEST_TABLE)
+        rows = conn.execute('SELECT filename, content_hash FROM ingested_slices').fetchall()
+        conn.close()
+        applied.append((dict(rows), {content_hash for _, content_hash in rows}))
+
+    filenames = sorted((f for f in os.listdir(folder_path) if f.endswith('.json')), key=numerical_sort_key)
+    selected = []
+    per_shard = [[] for _ in paths]
+    for filename in filenames:
+        if len(selected) >= slice_limit:
+            break
+        if all(filename in names for names, _ in applied):
+            continue
+        file_path = os.path.join(folder_path, filename)
+        content_hash = file_hash(file_path)
+        needed = [i for i, (names, hashes) in enumerate(applied) if filename not in names and content_hash not in hashes]
+        if not needed:
+            continue
+        selected.append(filename)
+        for i in needed:
+            per_shard[i].append((filename, file_path, content_hash))
+    return per_shard
+
+
+class SongIds:
+    # Ids of the songs of a store, kept by the ingesting process. A song's id is its
+    # song_key_id unless another song already has that id (a hash collision), then it is
+    # the next free id with the same remainder mod shards: the song stays in the shard its
+    # hash picks, so the router still finds it from the key, and the shard's songs table
+    # maps the full key to the id it got.
+
+    def __init__(self, shards, known=()):
+        self.shards = shards
+        self.ids = {}  # (artist, track) -> id
+        self.keys = {}  # id -> (artist, track)
+        for song_id, artist, track in known:
+            self.ids[(artist, track)] = song_id
+            self.keys[song_id] = (artist, track)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def id(self, key, hashed=None):
+        song_id = self.ids.get(key)
+        if song_id is None:
+            song_id = song_key_id(key) if hashed is None else hashed
+            while song_id in self.keys:
+                song_id += self.shards
+                if song_id >= 1 << 63:
+                    song_id %= self.shards
+            self.ids[key] = song_id
+            self.keys[song_id] = key
+        return song_id
+
+
+def read_slice(task):
+    # Reader process: parse a slice once and count its pairs by a per-slice song number.
+    # Returns the slice's keys (in number order), their song_key_ids, the aggregated
+    # (song1, song2, counts) arrays and the slice event with the parse and pair timings.
+    filename, file_path, strategy = task
+    metrics = SliceMetrics(filename, 'sqlite-sharded')
+    keys = {}
+    song1, song2, counts = count_slice_pair_ids(file_path, lambda key: keys.setdefault(key, len(keys)), strategy, metrics)
+    with metrics.stage('pairs'):
+        hashes = np.array([song_key_id(key) for key in keys], dtype=np.int64)
+    metrics.distinct_keys = len(keys)
+    return list(keys), hashes, song1, song2, counts, metrics.as_event()
+
+
+def shard_writer(shard_path, shard, queue, results):
+    # Writer process of one shard: takes (filename, file_path, content_hash, new songs,
+    # song1, song2, counts) off its queue and merges every slice in one transaction,
+    # together with its manifest entry, until it gets None. Puts (shard, slice events,
+    # rows) or (shard, error) on results.
+    try:
+        conn = sqlite3.connect(shard_path)
+        tune_connection(conn)
+        c = conn.cursor()
+        c.execute('CREATE TEMP TABLE IF NOT EXISTS staging (song1, song2, count INTEGER)')
+        songs = c.execute('SELECT COUNT(*) FROM songs').fetchone()[0]
+        events, rows = [], 0
+        for filename, file_path, content_hash, new_songs, song1, song2, counts in iter(queue.get, None):
+            metrics = SliceMetrics(filename, f"sqlite-shard-{shard}")
+            with metrics.stage('store'):
+                c.executemany('INSERT INTO songs (id, artist, track) VALUES (?, ?, ?)', new_songs)
+                c.executemany('INSERT INTO staging (song1, song2, count) VALUES (?, ?, ?)',
+                              zip(song1.tolist(), song2.tolist(), counts.tolist()))
+                merge_staged_counts(conn, 'staging', 'pairs')
+                record_slice(conn, filename, file_path, content_hash)
+                bump_data_version(conn)
+                conn.commit()
+            songs += len(new_songs)
+            rows += len(counts)
+            metrics.distinct_keys = songs
+            events.append(metrics.as_event())
+        conn.close()
+        results.put((shard, events, rows))
+    except Exception as error:
+        results.put((shard, error))
+
+
+def put_checked(queue, item, process):
+    # Blocking put that gives up if the process reading the queue has died
+    while True:
+        try:
+            queue.put(item, timeout=1)
+            return
+        except Full:
+            if not process.is_alive():
+                raise RuntimeError(f"shard writer {process.name} exited early")
+
+
+def update_sharded_store_from_folder(folder_path, path, slice_limit=5, strategy=None, readers=None, queue_slices=2):
+    # Sharded counterpart of bulk_update_co_occurrences_from_folder_database. Every pending
+    # slice is parsed and counted once, by a pool of reader processes, and this process
+    # gives the songs their ids and routes each row to the writer process of its song1's
+    # shard through a queue (queue_slices slices deep, so readers can't run far ahead of
+    # the writers). Each writer only writes its own rows.
+    # Reader and writer slice events and one ingest event go to the metrics hooks.
+    shards = read_store_meta(path)['shards']
+    paths = shard_paths(path, shards)
+    per_shard = pending_shard_slices(paths, folder_path, slice_limit)
+    needed = {}  # filename -> (file_path, content_hash, shards that still need it)
+    for shard, slices in enumerate(per_shard):
+        for filename, file_path, content_hash in slices:
+            needed.setdefault(filename, (file_path, content_hash, []))[2].append(shard)
+    filenames = sorted(needed, key=numerical_sort_key)
+    writing = [shard for shard in range(shards) if per_shard[shard]]
+    print(f"Ingesting {len(filenames)} slices into {len(writing)} of {shards} shards")
+
+    start_time = time.perf_counter()
+    slice_events, rows = [], 0
+    if filenames:
+        # Songs the shards know already, and which ones each shard has a name for
+        known, shard_songs = [], []
+        for shard_path in paths:
+            conn = sqlite3.connect(shard_path)
+            rows_of_shard = conn.execute('SELECT id, artist, track FROM songs').fetchall()
+            conn.close()
+            known.extend(rows_of_shard)
+            shard_songs.append({song_id for song_id, _, _ in rows_of_shard})
+        song_ids = SongIds(shards, known)
+
+        context = get_context()
+        results = context.Queue()
+        queues, writers = {}, {}
+        for shard in writing:
+            queues[shard] = context.Queue(maxsize=queue_slices)
+            writers[shard] = context.Process(target=shard_writer, args=(paths[shard], shard, queues[shard], results),
+                                             name=f"shard-{shard}")
+            writers[shard].start()
+        try:
+            tasks = [(filename, needed[filename][0], strategy) for filename in filenames]
+            with Pool(processes=min(readers or os.cpu_count(), len(tasks))) as pool:
+                for filename, (keys, hashes, song1, song2, counts, event) in zip(filenames, pool.imap(read_slice, tasks)):
+                    file_path, content_hash, targets = needed[filename]
+                    emit(event)
+                    slice_events.append(event)
+                    ids = np.array([song_ids.id(key, hashed) for key, hashed in zip(keys, hashes.tolist())], dtype=np.int64)
+                    song1, song2 = ids[song1], ids[song2]
+                    owner = song1 % shards
+                    for shard in targets:
+                        mine = owner == shard
+                        new_ids = set(np.unique(np.concatenate([song1[mine], song2[mine]])).tolist()) - shard_songs[shard]
+                        shard_songs[shard].update(new_ids)
+                        new_songs = [(song_id, *song_ids.keys[song_id]) for song_id in new_ids]
+                        put_checked(queues[shard], (filename, file_path, content_hash, new_songs, song1[mine], song2[mine], counts[mine]),
+                                    writers[shard])
+        finally:
+            for shard in writing:
+                if writers[shard].is_alive():
+                    put_checked(queues[shard], None, writers[shard])
+        errors = []
+        for _ in writing:
+            result = results.get()
+            if isinstance(result[1], Exception):
+                errors.append(result)
+                continue
+            shard, events, shard_rows = result
+            for event in events:
+                emit(event)
+            slice_events.extend(events)
+            rows += shard_rows
+        for shard in writing:
+            writers[shard].join()
+        if errors:
+            raise RuntimeError(f"shard {errors[0][0]} failed: {errors[0][1]!r}")
+    elapsed = time.perf_counter() - start_time
+    event = dict(ingest_event('sqlite-sharded', slice_events, elapsed), rows=rows)
+    emit(event)
+    print(f"Finished updating {shards} shards: {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed > 0 else 0:,.0f} rows/sec)")
+    return event
+
+
+class ShardedCoOccurrenceQuery:
+    # Router over the shards with the interface of CoOccurrenceQuery, so it can be passed
+    # to get_database_recommendations. A playlist's seeds are grouped by shard, every shard
+    # answers its group with one statement (in parallel threads, sqlite releases the GIL)
+    # and the results are put back in playlist order.
+
+    def __init__(self, path, cached_statements=256):
+        self.db_path = path
+        self.shards = read_store_meta(path)['shards']
+        self.queries = [CoOccurrenceQuery(shard_path, cached_statements) for shard_path in shard_paths(path, self.shards)]
+        self.schema_version = 2
+        self._executor = ThreadPoolExecutor(max_workers=self.shards, thread_name_prefix='shard')
+
+    def close(self):
+        self._executor.shutdown()
+        for query in self.queries:
+            query.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def shard_of(self, key):
+        return song_key_id(key) % self.shards
+
+    def fan_out(self, groups, function):
+        # Run function(query, items) for every non-empty shard group, {shard: result}
+        shards = [shard for shard, items in groups.items() if items]
+        if len(shards) == 1:
+            return {shards[0]: function(self.queries[shards[0]], groups[shards[0]])}
+        results = self._executor.map(lambda shard: function(self.queries[shard], groups[shard]), shards)
+        return dict(zip(shards, results))
+
+    def top_neighbours_batch(self, playlist, top_n=50):
+        groups = {}
+        for i, key in enumerate(playlist):
+            groups.setdefault(self.shard_of(key), []).append(i)
+        answers = self.fan_out(groups, lambda query, positions: query.top_neighbours_batch([playlist[i] for i in positions], top_n))
+        results = [None] * len(playlist)
+        for shard, positions in groups.items():
+            for i, result in zip(positions, answers[shard]):
+                results[i] = result
+        return results
+
+    def top_neighbours(self, artist_name, song_name, top_n=50):
+        return self.top_neighbours_batch([(artist_name, song_name)], top_n)[0][1]
+
+    def song_names(self, song_ids):
+        # A song's name is in the shard it hashes to, as song1 of its own pairs
+        groups = {}
+        for song_id in song_ids:
+            groups.setdefault(song_id % self.shards, []).append(song_id)
+        names = {}
+        for shard_names in self.fan_out(groups, lambda query, ids: query.song_names(ids)).values():
+            names.update(shard_names)
+        return names
+
+    def data_version(self):
+        # Sum of the shard counters, moves whenever any shard changes
+        return sum(query.data_version() for query in self.queries)
+
+    def find_top_co_occurrences(self, artist_name, song_name, top_n=10):
+        # Same output as find_top_co_occurrences_database: "artist - track: count times"
+        neighbours = self.top_neighbours(artist_name, song_name, top_n)
+        names = self.song_names(song_id for song_id, _ in neighbours)
+        return [f"{names[song_id][0]} - {names[song_id][1]}: {count} times" for song_id, count in neighbours]
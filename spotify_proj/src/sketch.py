@@ -0,0 +1,222 @@
+import math
+import os
+import random
+import numpy as np
+from src.slice_reader import iter_playlists
+from src.co_occurrence_matrix import CoOccurrenceMatrix
+
+EMPTY = -1
+
+
+class CountMinSketch:
+    # Count-min sketch over 64-bit pair keys. Estimates never undercount and overcount by at
+    # most epsilon * (total count) with probability 1 - delta.
+
+    def __init__(self, epsilon=1e-6, delta=0.01, seed=0):
+        # Width rounded up to a power of two so the multiply-shift hash can use the top bits
+        self.width_bits = max(1, math.ceil(math.log2(math.e / epsilon)))
+        self.width = 1 << self.width_bits
+        self.depth = max(1, math.ceil(math.log(1 / delta)))
+        rng = np.random.default_rng(seed)
+        self.multipliers = rng.integers(1, 2**63, size=self.depth, dtype=np.uint64) | np.uint64(1)
+        self.offsets = rng.integers(0, 2**63, size=self.depth, dtype=np.uint64)
+        self.table = np.zeros((self.depth, self.width), dtype=np.uint32)
+        self.total = 0
+
+    def _buckets(self, keys):
+        shift = np.uint64(64 - self.width_bits)
+        with np.errstate(over='ignore'):  # uint64 arithmetic wraps, which the hash relies on
+            return [((keys * a + b) >> shift).astype(np.int64) for a, b in zip(self.multipliers, self.offsets)]
+
+    def add(self, keys, counts=None):
+        if counts is None:
+            counts = np.ones(len(keys), dtype=np.uint32)
+        for row, buckets in zip(self.table, self._buckets(keys)):
+            np.add.at(row, buckets, counts)
+        self.total += int(counts.sum())
+
+    def estimate(self, keys):
+        estimates = None
+        for row, buckets in zip(self.table, self._buckets(keys)):
+            values = row[buckets]
+            estimates = values if estimates is None else np.minimum(estimates, values)
+        return estimates
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+def pair_keys(a, b):
+    # Order-independent 64-bit key of the pair (a, b)
+    low, high = np.minimum(a, b).astype(np.uint64), np.maximum(a, b).astype(np.uint64)
+    return (low << np.uint64(32)) | high
+
+
+class ApproxCoOccurrences:
+    # Bounded-memory approximate co-occurrence store. Pair counts go into a count-min sketch
+    # and every song keeps a fixed-size table of its `capacity` heaviest neighbours by
+    # estimated count (the heavy hitters). Memory is the sketch plus songs * capacity
+    # entries, however many slices are ingested. Pairs are buffered and processed in
+    # batches so both structures are updated with numpy.
+
+    def __init__(self, epsilon=1e-6, delta=0.01, capacity=100, batch_size=1 << 20, seed=0):
+        self.sketch = CountMinSketch(epsilon, delta, seed)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.songs = []
+        self.song_ids = {}
+        self.version = 0
+        self.candidate_ids = np.full((1024, capacity), EMPTY, dtype=np.int32)
+        self.candidate_counts = np.zeros((1024, capacity), dtype=np.uint32)
+        self._pending = []
+        self._pending_size = 0
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, key):
+        return key in self.song_ids
+
+    def intern(self, key):
+        song_id = self.song_ids.get(key)
+        if song_id is None:
+            song_id = len(self.songs)
+            self.song_ids[key] = song_id
+            self.songs.append(key)
+        return song_id
+
+    def add_playlist(self, tracks):
+        ids = np.fromiter((self.intern(key) for key in tracks), dtype=np.int32, count=len(tracks))
+        if len(ids) < 2:
+            return
+        first, second = np.triu_indices(len(ids), k=1)
+        a, b = ids[first], ids[second]
+        keep = a != b  # A song is not its own neighbour
+        self._pending.append((a[keep], b[keep]))
+        self._pending_size += int(keep.sum())
+        if self._pending_size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        a = np.concatenate([pair[0] for pair in self._pending])
+        b = np.concatenate([pair[1] for pair in self._pending])
+        self._pending = []
+        self._pending_size = 0
+        keys = pair_keys(a, b)
+        self.sketch.add(keys)
+        # Re-estimate each distinct pair once and offer it to both songs' candidate tables
+        keys, first = np.unique(keys, return_index=True)
+        a, b = a[first], b[first]
+        estimates = self.sketch.estimate(keys)
+        self._update_candidates(np.concatenate([a, b]), np.concatenate([b, a]), np.concatenate([estimates, estimates]))
+        self.version += 1
+
+    def _update_candidates(self, songs, neighbours, estimates):
+        # Merge the offered (song, neighbour, estimate) entries into the candidate tables of
+        # the touched songs and keep the `capacity` largest estimates of each
+        if len(self.songs) > len(self.candidate_ids):
+            rows = max(len(self.songs), 2 * len(self.candidate_ids))
+            self.candidate_ids = np.vstack([self.candidate_ids, np.full((rows - len(self.candidate_ids), self.capacity), EMPTY, dtype=np.int32)])
+            self.candidate_counts = np.vstack([self.candidate_counts, np.zeros((rows - len(self.candidate_counts), self.capacity), dtype=np.uint32)])
+        touched = np.unique(songs)
+        old_ids = self.candidate_ids[touched]
+        filled = old_ids != EMPTY
+        all_songs = np.concatenate([np.repeat(touched, filled.sum(axis=1)), songs])
+        all_ids = np.concatenate([old_ids[filled], neighbours])
+        all_counts = np.concatenate([self.candidate_counts[touched][filled], estimates])
+        # Sort by song, neighbour and estimate descending; keep one entry per (song, neighbour)
+        order = np.lexsort((-all_counts.astype(np.int64), all_ids, all_songs))
+        all_songs, all_ids, all_counts = all_songs[order], all_ids[order], all_counts[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (all_songs[1:] != all_songs[:-1]) | (all_ids[1:] != all_ids[:-1])
+        all_songs, all_ids, all_counts = all_songs[first], all_ids[first], all_counts[first]
+        # Rank the remaining entries of each song by estimate and keep the top `capacity`
+        order = np.lexsort((-all_counts.astype(np.int64), all_songs))
+        all_songs, all_ids, all_counts = all_songs[order], all_ids[order], all_counts[order]
+        starts = np.searchsorted(all_songs, touched)
+        rank = np.arange(len(all_songs)) - np.repeat(starts, np.diff(np.append(starts, len(all_songs))))
+        keep = rank < self.capacity
+        new_ids = np.full((len(touched), self.capacity), EMPTY, dtype=np.int32)
+        new_counts = np.zeros((len(touched), self.capacity), dtype=np.uint32)
+        row = np.searchsorted(touched, all_songs[keep])
+        new_ids[row, rank[keep]] = all_ids[keep]
+        new_counts[row, rank[keep]] = all_counts[keep]
+        self.candidate_ids[touched] = new_ids
+        self.candidate_counts[touched] = new_counts
+
+    def neighbours(self, song_id):
+        # (ids, estimated counts) of the song's heavy hitters, sorted by estimate descending
+        self.flush()
+        ids, counts = self.candidate_ids[song_id], self.candidate_counts[song_id]
+        filled = ids != EMPTY
+        return ids[filled], counts[filled]
+
+    def top_neighbours(self, key, top_n=10):
+        song_id = self.song_ids.get(key)
+        if song_id is None:
+            return []
+        ids, counts = self.neighbours(song_id)
+        return [(self.songs[i], c) for i, c in zip(ids[:top_n].tolist(), counts[:top_n].tolist())]
+
+    @property
+    def nbytes(self):
+        # Memory of the fixed-size structures (the vocabulary comes on top)
+        return self.sketch.nbytes + self.candidate_ids.nbytes + self.candidate_counts.nbytes
+
+
+def update_approx_co_occurrences_from_folder(folder_path, slice_limit=5, co_occurrences=None, **params):
+    # Approximate counterpart of update_co_occurrences_from_folder, params go to ApproxCoOccurrences
+    if co_occurrences is None:
+        co_occurrences = ApproxCoOccurrences(**params)
+    filenames = sorted(f for f in os.listdir(folder_path) if f.endswith('.json'))
+    for i, filename in enumerate(filenames[:slice_limit]):
+        print(f"Processing slice {i+1}/{slice_limit}: {filename}")
+        for playlist_artist_song_pairs in iter_playlists(os.path.join(folder_path, filename)):
+            co_occurrences.add_playlist(playlist_artist_song_pairs)
+    co_occurrences.flush()
+    return co_occurrences
+
+
+def measure_recall(folder_path, slice_limit=5, k=50, sample_size=1000, seed=0, **params):
+    # Recall@k of the approximate top-k neighbours against the exact counts on the same
+    # slices. Ties are counted fairly: an approximate neighbour is a hit when its exact count
+    # is at least the exact k-th largest count of the song.
+    exact = CoOccurrenceMatrix()
+    approx = ApproxCoOccurrences(**params)
+    filenames = sorted(f for f in os.listdir(folder_path) if f.endswith('.json'))
+    for filename in filenames[:slice_limit]:
+        for playlist_artist_song_pairs in iter_playlists(os.path.join(folder_path, filename)):
+            exact.add_playlist(playlist_artist_song_pairs)
+            approx.add_playlist(playlist_artist_song_pairs)
+    approx.flush()
+
+    rng = random.Random(seed)
+    sample = rng.sample(range(len(exact)), min(sample_size, len(exact)))
+    hits = total = 0
+    for song_id in sample:
+        ids, counts = exact.neighbours(song_id)
+        other = ids != song_id
+        ids, counts = ids[other], counts[other]
+        if len(ids) == 0:
+            continue
+        wanted = min(k, len(ids))
+        threshold = np.sort(counts)[::-1][wanted - 1]
+        exact_counts = dict(zip(ids.tolist(), counts.tolist()))
+        approx_ids, _ = approx.neighbours(song_id)
+        hits += sum(exact_counts.get(i, 0) >= threshold for i in approx_ids[:wanted].tolist())
+        total += wanted
+
+    report = {
+        'recall_at_k': float(hits / total) if total else 1.0,
+        'k': k,
+        'songs_sampled': len(sample),
+        'approx_bytes': approx.nbytes,
+        'exact_bytes': exact.upper.data.nbytes + exact.upper.indices.nbytes + exact.upper.indptr.nbytes,
+        'sketch_width': approx.sketch.width,
+        'sketch_depth': approx.sketch.depth,
+    }
+    print(f"recall@{k}: {report['recall_at_k']:.3f} ({report['approx_bytes']:,} bytes approximate vs {report['exact_bytes']:,} exact)")
+    return report
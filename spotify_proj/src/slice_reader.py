@@ -0,0 +1,49 @@
+import json
+import mmap
+import re
+
+# Start of the tracks array of one playlist
+TRACKS_START = re.compile(rb'"tracks"\s*:\s*\[')
+# The two fields we need. A quote inside a JSON string is always escaped, so these cannot
+# match in the middle of another value. Each pattern starts with a literal, which lets the
+# regex engine jump straight to candidate positions.
+ARTIST_FIELD = re.compile(rb'"artist_name"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+TRACK_FIELD = re.compile(rb'"track_name"\s*:\s*"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+
+def decode_strings(raws):
+    # Decode a whole playlist's raw values in one call. Raw control characters are not
+    # allowed inside JSON strings, so a NUL byte can join them for a plain utf-8 decode.
+    # If any value has escapes, the json parser decodes them all as one array instead.
+    if not raws:
+        return []
+    joined = b'\x00'.join(raws)
+    if b'\\' not in joined:
+        return joined.decode('utf-8').split('\x00')
+    return json.loads(b'["' + b'","'.join(raws) + b'"]')
+
+
+def read_tracks(buffer, start, end):
+    # Collect the (artist_name, track_name) keys between two "tracks" arrays. Every other
+    # field is skipped by the regex without being decoded.
+    artists = decode_strings(ARTIST_FIELD.findall(buffer, start, end))
+    tracks = decode_strings(TRACK_FIELD.findall(buffer, start, end))
+    return list(zip(artists, tracks))
+
+
+def iter_playlists(slice_path):
+    # Yield the (artist_name, track_name) keys of one playlist at a time, reading the
+    # slice through a memory map instead of building the whole JSON tree
+    with open(slice_path, 'rb') as file:
+        try:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty file, nothing to map
+            return
+        with buffer:
+            start = TRACKS_START.search(buffer)
+            while start is not None:
+                # A playlist's tracks end before the next playlist's tracks array starts
+                following = TRACKS_START.search(buffer, start.end())
+                end = following.start() if following is not None else len(buffer)
+                yield read_tracks(buffer, start.end(), end)
+                start = following
@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+import numpy as np
+
+# Deterministic generator of Million Playlist Dataset style slices, so the ingestion and
+# query paths can be benchmarked without the 30 GB download. The files follow the MPD
+# layout (info + playlists with a tracks array) and names (mpd.slice.<first>-<last>.json).
+#
+# Songs are split into genres. Each playlist picks a genre and draws most of its tracks
+# from it and the rest from the whole catalogue, both with Zipfian popularity, so songs
+# of one genre co-occur more often and recommendations have something to find. Playlist
+# lengths are log-normal around the MPD median (~50) and clipped to its 5..250 range.
+
+
+def zipf_cdf(n, exponent, rng):
+    # Cumulative popularity of n items whose Zipf ranks are shuffled, so popular songs are
+    # spread over artists and genres. Sampling is a searchsorted on uniform draws.
+    weights = (1.0 / np.arange(1, n + 1) ** exponent)[rng.permutation(n)]
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def sample(rng, cdf, size):
+    return np.minimum(np.searchsorted(cdf, rng.random(size), side='right'), len(cdf) - 1)
+
+
+def playlist_lengths(rng, count, median=50, sigma=0.8, low=5, high=250):
+    return np.clip(np.round(rng.lognormal(np.log(median), sigma, size=count)), low, high).astype(int)
+
+
+def make_catalogue(n_tracks, n_artists, n_genres):
+    # Track i belongs to genre i % n_genres and artist i % n_artists
+    tracks = []
+    for i in range(n_tracks):
+        artist = i % n_artists
+        tracks.append({
+            'artist_name': f"Artist {artist}",
+            'track_uri': f"spotify:track:{i:022d}",
+            'artist_uri': f"spotify:artist:{artist:022d}",
+            'track_name': f"Track {i}",
+            'album_uri': f"spotify:album:{i // 10:022d}",
+            'duration_ms': 120000 + (i * 7919) % 180000,
+            'album_name': f"Album {i // 10}",
+        })
+    return tracks
+
+
+def generate_playlist(rng, pid, length, catalogue, genres, genre_cdfs, global_cdf, genre_share):
+    genre = int(rng.integers(len(genres)))
+    in_genre = rng.random(length) < genre_share
+    track_ids = np.empty(length, dtype=np.int64)
+    track_ids[in_genre] = genres[genre][sample(rng, genre_cdfs[genre], int(in_genre.sum()))]
+    track_ids[~in_genre] = sample(rng, global_cdf, int((~in_genre).sum()))
+    tracks = [dict(pos=pos, **catalogue[track_id]) for pos, track_id in enumerate(track_ids.tolist())]
+    return {
+        'name': f"Genre {genre} mix {pid}",
+        'collaborative': 'false',
+        'pid': pid,
+        'modified_at': 1500000000 + pid,
+        'num_tracks': length,
+        'num_albums': len({track['album_uri'] for track in tracks}),
+        'num_followers': 1,
+        'tracks': tracks,
+        'num_edits': 1,
+        'duration_ms': sum(track['duration_ms'] for track in tracks),
+        'num_artists': len({track['artist_uri'] for track in tracks}),
+    }
+
+
+def generate_slices(folder_path, n_slices=5, playlists_per_slice=1000, n_tracks=100000, n_artists=20000,
+                    n_genres=50, zipf_exponent=1.1, genre_share=0.8, seed=0):
+    # Write n_slices slice files into folder_path and return their paths. The same
+    # arguments always produce byte-identical files.
+    os.makedirs(folder_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    catalogue = make_catalogue(n_tracks, n_artists, n_genres)
+    global_cdf = zipf_cdf(n_tracks, zipf_exponent, rng)
+    genres = [np.arange(genre, n_tracks, n_genres) for genre in range(n_genres)]
+    genre_cdfs = [zipf_cdf(len(members), zipf_exponent, rng) for members in genres]
+
+    paths = []
+    for s in range(n_slices):
+        first = s * playlists_per_slice
+        last = first + playlists_per_slice - 1
+        lengths = playlist_lengths(rng, playlists_per_slice)
+        playlists = [generate_playlist(rng, first + i, int(length), catalogue, genres, genre_cdfs,
+                                       global_cdf, genre_share) for i, length in enumerate(lengths)]
+        data = {
+            'info': {'generated_on': 'synthetic', 'slice': f"{first}-{last}", 'version': 'v1', 'seed': seed},
+            'playlists': playlists,
+        }
+        path = os.path.join(folder_path, f"mpd.slice.{first}-{last}.json")
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=4)
+        paths.append(path)
+        print(f"Wrote {path}")
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic MPD slices")
+    parser.add_argument('folder')
+    parser.add_argument('--slices', type=int, default=5)
+    parser.add_argument('--playlists', type=int, default=1000, help="playlists per slice")
+    parser.add_argument('--tracks', type=int, default=100000)
+    parser.add_argument('--artists', type=int, default=20000)
+    parser.add_argument('--genres', type=int, default=50)
+    parser.add_argument('--zipf', type=float, default=1.1, help="popularity exponent")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_slices(args.folder, args.slices, args.playlists, args.tracks, args.artists, args.genres, args.zipf, seed=args.seed)
@@ -0,0 +1,193 @@
+import sqlite3
+import struct
+from array import array
+import numpy as np
+
+# Flat binary file with the top-K neighbours of every song, built once after ingestion and
+# opened with numpy.memmap. All sections are 8-byte aligned:
+#   header | offsets int64[n+1] | ids int32[m] | counts int32/float32[m]
+#   | name_offsets int64[n+1] | names utf-8 "artist\0track" | sorted_ids int32[n]
+# A song's neighbours are ids[offsets[i]:offsets[i+1]], sorted by count descending.
+# sorted_ids lists the songs in byte order of their names for lookups by binary search.
+MAGIC = b'TOPKIDX\0'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ?7x')  # magic, version, k, songs, entries, name bytes, float counts
+
+
+def encode_key(key):
+    return f"{key[0]}\0{key[1]}".encode('utf-8')
+
+
+def aligned(size):
+    return (size + 7) // 8 * 8
+
+
+def name_table(songs):
+    # (name_offsets, names, sorted_ids) for a list of (artist, track) keys: the encoded names
+    # back to back and the ids in byte order of their names, for find_song
+    names = [encode_key(key) for key in songs]
+    name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in names], out=name_offsets[1:])
+    sorted_ids = np.array(sorted(range(len(names)), key=names.__getitem__), dtype=np.int32)
+    return name_offsets, np.frombuffer(b''.join(names), dtype=np.uint8), sorted_ids
+
+
+def find_song(names, name_offsets, sorted_ids, key):
+    # Binary search over the names in byte order, None if the song is unknown
+    target = encode_key(key)
+
+    def name_bytes(song_id):
+        return names[name_offsets[song_id]:name_offsets[song_id + 1]].tobytes()
+
+    lo, hi = 0, len(sorted_ids)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if name_bytes(sorted_ids[mid]) < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(sorted_ids) and name_bytes(sorted_ids[lo]) == target:
+        return int(sorted_ids[lo])
+    return None
+
+
+def write_topk_index(path, songs, offsets, ids, counts, k):
+    # songs[i] is the (artist, track) key of id i, the other arrays follow the layout above
+    name_offsets, names, sorted_ids = name_table(songs)
+    counts = np.asarray(counts)
+    float_counts = counts.dtype.kind == 'f'
+    counts = counts.astype(np.float32 if float_counts else np.int32)
+
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, k, len(songs), len(ids), int(name_offsets[-1]), float_counts))
+        for section in (np.asarray(offsets, dtype=np.int64), np.asarray(ids, dtype=np.int32), counts, name_offsets):
+            data = section.tobytes()
+            file.write(data + b'\0' * (aligned(len(data)) - len(data)))
+        blob = names.tobytes()
+        file.write(blob + b'\0' * (aligned(len(blob)) - len(blob)))
+        file.write(sorted_ids.tobytes())
+
+
+def top_k_rows(matrix, k=50, chunk_entries=1 << 25):
+    # Top-k entries of every row of a CSR matrix, as (offsets, ids, counts) with each row
+    # sorted by count descending. Rows are processed in chunks of about chunk_entries
+    # stored counts so the sort never needs the whole matrix at once.
+    n = matrix.shape[0]
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    id_chunks, count_chunks = [], []
+    row = 0
+    while row < n:
+        end = int(np.searchsorted(matrix.indptr, matrix.indptr[row] + chunk_entries, side='right')) - 1
+        end = min(max(end, row + 1), n)
+        start_entry, end_entry = matrix.indptr[row], matrix.indptr[end]
+        lengths = np.diff(matrix.indptr[row:end + 1])
+        rows = np.repeat(np.arange(row, end), lengths)
+        data = matrix.data[start_entry:end_entry]
+        # Sort by row, then by count descending; lexsort is stable so ties stay in id order
+        order = np.lexsort((-data, rows))
+        rank = np.arange(len(order)) - np.repeat(matrix.indptr[row:end] - start_entry, lengths)
+        keep = order[rank < k]
+        id_chunks.append(matrix.indices[start_entry:end_entry][keep])
+        count_chunks.append(data[keep])
+        offsets[row + 1:end + 1] = np.minimum(lengths, k)
+        row = end
+    np.cumsum(offsets, out=offsets)
+    ids = np.concatenate(id_chunks) if id_chunks else np.zeros(0, dtype=np.int32)
+    counts = np.concatenate(count_chunks) if count_chunks else np.zeros(0, dtype=matrix.dtype)
+    return offsets, ids, counts
+
+
+def build_topk_index(co_occurrences, path, k=50, chunk_entries=1 << 25):
+    # Build the index from a CoOccurrenceMatrix
+    offsets, ids, counts = top_k_rows(co_occurrences.symmetric, k, chunk_entries)
+    write_topk_index(path, co_occurrences.songs, offsets, ids, counts, k)
+
+
+def build_topk_index_from_database(db_path, path, k=50):
+    # Build the index from a schema v2 database, reading pairs_top in order. Database ids
+    # are renumbered densely in id order.
+    conn = sqlite3.connect(db_path)
+    if conn.execute('PRAGMA user_version').fetchone()[0] != 2:
+        conn.close()
+        raise ValueError(f"{db_path} is not a schema version 2 database, migrate it first")
+    db_ids, songs = [], []
+    for song_id, artist, track in conn.execute('SELECT id, artist, track FROM songs ORDER BY id'):
+        db_ids.append(song_id)
+        songs.append((artist, track))
+    dense_ids = {song_id: i for i, song_id in enumerate(db_ids)}
+    db_ids = np.array(db_ids, dtype=np.int64)
+
+    lengths = np.zeros(len(songs), dtype=np.int64)
+    neighbour_ids, counts = array('q'), array('d')
+    query = '''SELECT song1, song2, count FROM (
+                   SELECT song1, song2, count,
+                          ROW_NUMBER() OVER (PARTITION BY song1 ORDER BY count DESC, song2) AS rank
+                   FROM pairs)
+               WHERE rank <= ?
+               ORDER BY song1, rank'''
+    for song1, song2, count in conn.execute(query, (k,)):
+        lengths[dense_ids[song1]] += 1
+        neighbour_ids.append(song2)
+        counts.append(count)
+    conn.close()
+
+    offsets = np.zeros(len(songs) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    ids = np.searchsorted(db_ids, np.frombuffer(neighbour_ids, dtype=np.int64))
+    counts = np.frombuffer(counts, dtype=np.float64)
+    if np.array_equal(counts, np.round(counts)):
+        counts = counts.astype(np.int64)
+    write_topk_index(path, songs, offsets, ids, counts, k)
+
+
+class TopKIndex:
+    # Read side of the index. Opening it only maps the file, so a serving process starts
+    # immediately and sibling processes share the same pages.
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, version, self.k, n, entries, name_bytes, float_counts = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} top-K index")
+        position = HEADER.size
+
+        def section(dtype, count):
+            nonlocal position
+            view = np.frombuffer(self.buffer, dtype=dtype, count=count, offset=position)
+            position += aligned(view.nbytes)
+            return view
+
+        self.offsets = section(np.int64, n + 1)
+        self.ids = section(np.int32, entries)
+        self.counts = section(np.float32 if float_counts else np.int32, entries)
+        self.name_offsets = section(np.int64, n + 1)
+        self.names = section(np.uint8, name_bytes)
+        self.sorted_ids = section(np.int32, n)
+
+    def __len__(self):
+        return len(self.sorted_ids)
+
+    def _name_bytes(self, song_id):
+        return self.names[self.name_offsets[song_id]:self.name_offsets[song_id + 1]].tobytes()
+
+    def song_name(self, song_id):
+        return tuple(self._name_bytes(song_id).decode('utf-8').split('\0', 1))
+
+    def song_id(self, key):
+        return find_song(self.names, self.name_offsets, self.sorted_ids, key)
+
+    def __contains__(self, key):
+        return self.song_id(key) is not None
+
+    def neighbours(self, song_id):
+        # (ids, counts) of the top-K neighbours, already sorted, as views into the file
+        start, end = self.offsets[song_id], self.offsets[song_id + 1]
+        return self.ids[start:end], self.counts[start:end]
+
+    def top_neighbours(self, key, top_n=10):
+        song_id = self.song_id(key)
+        if song_id is None:
+            return []
+        ids, counts = self.neighbours(song_id)
+        return [(self.song_name(i), c) for i, c in zip(ids[:top_n].tolist(), counts[:top_n].tolist())]
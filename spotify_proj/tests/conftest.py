@@ -0,0 +1,10 @@
+import pytest
+from src.synthetic_mpd import generate_slices
+
+
+@pytest.fixture(scope='session')
+def slice_folder(tmp_path_factory):
+    # Three small synthetic slices, popular enough that songs share many playlists
+    folder = tmp_path_factory.mktemp('slices')
+    generate_slices(str(folder), n_slices=3, playlists_per_slice=40, n_tracks=300, n_artists=80, n_genres=5)
+    return str(folder)
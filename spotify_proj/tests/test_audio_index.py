@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from src.audio_index import build_audio_index, brute_force_search, NUMERICAL_FEATURES
+
+
+def song_data(n, genres, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {feature: rng.normal(size=n) for feature in NUMERICAL_FEATURES}
+    data['genre'] = rng.choice([f"genre {i}" for i in range(genres)], n)
+    data['artist_name'] = [f"Artist {i % 50}" for i in range(n)]
+    data['track_name'] = [f"Track {i}" for i in range(n)]
+    return data
+
+
+@pytest.fixture(scope='module')
+def index(tmp_path_factory):
+    return build_audio_index(song_data(3000, 4), str(tmp_path_factory.mktemp('audio_index')))
+
+
+def playlist_queries(index, count, size, seed=1):
+    rng = np.random.default_rng(seed)
+    seeds = [rng.choice(len(index), size, replace=False) for _ in range(count)]
+    queries = np.array([np.asarray(index.vectors[s]).mean(axis=0) for s in seeds])
+    return queries, [index.genre_distribution(s) for s in seeds], seeds
+
+
+@pytest.mark.parametrize('size', [1, 5])
+def test_search_is_exact(index, size):
+    queries, distributions, _ = playlist_queries(index, 40, size)
+    _, exact_distances = brute_force_search(index, queries, distributions, 10)
+    _, distances = index.search(queries, distributions, 10)
+    assert np.allclose(distances, exact_distances, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('nprobe', [None, 3])
+def test_search_matches_search_one(index, nprobe):
+    queries, distributions, seeds = playlist_queries(index, 40, 3)
+    weights = np.linspace(0.5, 1, len(NUMERICAL_FEATURES))
+    positions, distances = index.search(queries, distributions, 10, feature_weights=weights, nprobe=nprobe, excludes=seeds, block=7)
+    for i in range(len(queries)):
+        one_positions, one_distances = index.search_one(queries[i], distributions[i], 10, feature_weights=weights, nprobe=nprobe,
+                                                        exclude=seeds[i])
+        assert np.array_equal(positions[i], one_positions)
+        assert np.allclose(distances[i], one_distances)
+        assert not set(positions[i].tolist()) & set(seeds[i].tolist())
+
+
+def test_fewer_songs_than_k(tmp_path):
+    small = build_audio_index(song_data(6, 2), str(tmp_path / 'small'))
+    positions, distances = small.search(np.asarray(small.vectors[:2]), [small.genre_distribution([0]), small.genre_distribution([1])],
+                                        10, excludes=[[0], [1]])
+    assert (positions[:, :5] >= 0).all() and (positions[:, 5:] == -1).all()
+    assert np.isinf(distances[:, 5:]).all()
+
+
+def test_recommend_batch_leaves_seeds_out(index):
+    playlist = [index.song_name(position) for position in range(5)]
+    recommendations = index.recommend_batch([playlist, [("Nobody", "Nothing")], playlist[:1]], k=5)
+    assert len(recommendations[0]) == 5 and recommendations[1] == [] and len(recommendations[2]) == 5
+    assert not {name for name, _ in recommendations[0]} & set(playlist)
+    assert recommendations[2] == index.similar_songs(*playlist[0], k=5)
+    assert len(index.recommend(playlist, k=5, weighted=True)) == 5
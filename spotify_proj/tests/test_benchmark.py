@@ -0,0 +1,28 @@
+import os
+from src.benchmark import count_pairs, sample_queries, slice_filenames
+from src.collaborative_filtering import update_co_occurrences_from_folder
+from src.database import setup_database, bulk_update_co_occurrences_from_folder_database, CoOccurrenceQuery
+from src.slice_reader import iter_playlists
+from src.synthetic_mpd import generate_slices
+
+
+def test_backends_read_the_same_slices(tmp_path):
+    # With 11 slices mpd.slice.10-... sorts before mpd.slice.2-... alphabetically
+    folder = str(tmp_path / 'slices')
+    paths = generate_slices(folder, n_slices=11, playlists_per_slice=2, n_tracks=200, n_artists=20, n_genres=2)
+    first = [os.path.basename(path) for path in paths[:3]]
+    assert slice_filenames(folder, 3) == first
+
+    matrix = update_co_occurrences_from_folder(folder, slice_limit=3)
+    db_path = str(tmp_path / 'v2.db')
+    setup_database(db_path, 2)
+    bulk_update_co_occurrences_from_folder_database(folder, db_path, slice_limit=3)
+    songs = {key for path in paths[:3] for playlist in iter_playlists(path) for key in playlist}
+    assert set(matrix.songs) == songs
+    playlists, pairs = count_pairs(folder, 3)
+    assert playlists == 6
+    assert pairs == sum(len(p) * (len(p) - 1) // 2 for path in paths[:3] for p in iter_playlists(path))
+    with CoOccurrenceQuery(db_path) as query:
+        for playlist in sample_queries(folder, 3, 6, 1, seed=0):
+            assert playlist[0] in matrix
+            assert query.top_neighbours(*playlist[0], 5)
@@ -0,0 +1,81 @@
+import os
+from collections import defaultdict
+import pytest
+from src.collaborative_filtering import slice_to_csv, update_co_occurrences_from_folder, save_co_occurrences, load_co_occurrences
+from src.co_occurrence_matrix import CoOccurrenceMatrix
+
+
+def dict_counts(folder):
+    # The original nested dict of slice_to_csv over every slice
+    co_occurrences = defaultdict(lambda: defaultdict(int))
+    for filename in sorted(os.listdir(folder)):
+        slice_to_csv(os.path.join(folder, filename), co_occurrences)
+    return co_occurrences
+
+
+def assert_same_counts(matrix, reference):
+    assert len(matrix) == len(reference)
+    for key, neighbours in reference.items():
+        assert matrix.get(key) == dict(neighbours)
+
+
+@pytest.fixture(scope='module')
+def reference(slice_folder):
+    return dict_counts(slice_folder)
+
+
+def test_matrix_matches_dict(slice_folder, reference):
+    assert_same_counts(update_co_occurrences_from_folder(slice_folder, slice_limit=10), reference)
+
+
+def test_small_buffer_compacts_the_same_counts(slice_folder, reference):
+    matrix = CoOccurrenceMatrix(buffer_size=1000)
+    for filename in sorted(os.listdir(slice_folder)):
+        slice_to_csv(os.path.join(slice_folder, filename), matrix)
+    assert_same_counts(matrix, reference)
+
+
+def test_from_dict_and_merge(slice_folder, reference):
+    assert_same_counts(CoOccurrenceMatrix.from_dict(reference), reference)
+    filenames = sorted(os.listdir(slice_folder))
+    first = slice_to_csv(os.path.join(slice_folder, filenames[0]))
+    rest = CoOccurrenceMatrix()
+    for filename in filenames[1:]:
+        slice_to_csv(os.path.join(slice_folder, filename), rest)
+    assert_same_counts(first.merge(rest), reference)
+
+
+def test_top_neighbours_are_sorted_counts(slice_folder, reference):
+    matrix = update_co_occurrences_from_folder(slice_folder, slice_limit=10)
+    key = max(reference, key=lambda key: len(reference[key]))
+    top = matrix.top_neighbours(key, 10)
+    assert [count for _, count in top] == sorted(reference[key].values(), reverse=True)[:10]
+    assert all(reference[key][song] == count for song, count in top)
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_ingestion_matches_serial(slice_folder, reference, workers):
+    matrix = update_co_occurrences_from_folder(slice_folder, slice_limit=10, workers=workers)
+    assert_same_counts(matrix, reference)
+    # Partials merge in slice order, so songs get the ids a serial run gives them
+    assert matrix.songs == update_co_occurrences_from_folder(slice_folder, slice_limit=10).songs
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_snapshot_round_trip(slice_folder, reference, tmp_path, compress):
+    filenames = sorted(os.listdir(slice_folder))
+    matrix = update_co_occurrences_from_folder(slice_folder, slice_limit=2)
+    save_co_occurrences(matrix, str(tmp_path / 'snapshot.npz'), compress=compress)
+    loaded = load_co_occurrences(str(tmp_path / 'snapshot.npz'))
+    assert loaded.songs == matrix.songs
+    # The loaded matrix keeps ingesting where the saved one stopped
+    for filename in filenames[2:]:
+        slice_to_csv(os.path.join(slice_folder, filename), loaded)
+    assert_same_counts(loaded, reference)
+
+
+def test_snapshot_of_a_dict_and_of_nothing(reference, tmp_path):
+    save_co_occurrences(reference, str(tmp_path / 'dict.npz'))
+    assert_same_counts(load_co_occurrences(str(tmp_path / 'dict.npz')), reference)
+    save_co_occurrences(CoOccurrenceMatrix(), str(tmp_path / 'empty.npz'))
+    assert len(load_co_occurrences(str(tmp_path / 'empty.npz'))) == 0
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import pytest
+from src.database import (setup_database, update_co_occurrences_from_folder_database,
+                          bulk_update_co_occurrences_from_folder_database, CoOccurrenceQuery, migrate_database_to_v2)
+from src.slice_reader import iter_playlists
+
+
+def load(folder, db_path, schema_version=1, bulk=True):
+    setup_database(db_path, schema_version)
+    if bulk:
+        bulk_update_co_occurrences_from_folder_database(folder, db_path, slice_limit=10)
+    else:
+        update_co_occurrences_from_folder_database(folder, db_path, slice_limit=10)
+    return db_path
+
+
+def pair_counts(db_path):
+    # {("artist - track", "artist - track"): count} of a v1 or v2 database
+    conn = sqlite3.connect(db_path)
+    if conn.execute('PRAGMA user_version').fetchone()[0] == 2:
+        rows = conn.execute('''SELECT s1.artist || ' - ' || s1.track, s2.artist || ' - ' || s2.track, p.count
+                               FROM pairs p JOIN songs s1 ON s1.id = p.song1 JOIN songs s2 ON s2.id = p.song2''')
+    else:
+        rows = conn.execute('SELECT song1, song2, count FROM co_occurrences')
+    counts = {(song1, song2): count for song1, song2, count in rows}
+    conn.close()
+    return counts
+
+
+@pytest.fixture(scope='module')
+def databases(slice_folder, tmp_path_factory):
+    folder = tmp_path_factory.mktemp('db')
+    return {version: load(slice_folder, str(folder / f"v{version}.db"), version) for version in (1, 2)}
+
+
+def all_songs(folder):
+    songs = []
+    for filename in sorted(os.listdir(folder)):
+        for playlist in iter_playlists(os.path.join(folder, filename)):
+            songs.extend(key for key in playlist if key not in songs)
+    return songs
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_top_neighbours_batch_with_many_seeds(databases, slice_folder, version):
+    # More seeds than SQLite allows SELECTs in one compound statement
+    seeds = all_songs(slice_folder)[:250] * 3
+    assert len(seeds) > 500
+    with CoOccurrenceQuery(databases[version]) as query:
+        batch = query.top_neighbours_batch(seeds, 5)
+        assert len(batch) == len(seeds)
+        for key, (seed_id, neighbours) in list(zip(seeds, batch))[::37]:
+            assert [count for _, count in neighbours] == [count for _, count in query.top_neighbours(*key, 5)]
+            assert seed_id is not None and len(neighbours) > 0
+
+
+@pytest.mark.skipif(not hasattr(sqlite3.Connection, 'setlimit'), reason="needs Connection.setlimit (Python 3.11)")
+def test_batches_fit_the_old_parameter_limit(databases, slice_folder):
+    # SQLite before 3.32 allows 999 host parameters per statement
+    seeds = all_songs(slice_folder)[:250] * 2
+    with CoOccurrenceQuery(databases[2]) as query:
+        expected = query.top_neighbours_batch(seeds, 5)
+    # A fresh query object, the statements of the first one are already prepared
+    with CoOccurrenceQuery(databases[2]) as query:
+        query.connection().setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+        assert query.top_neighbours_batch(seeds, 5) == expected
+
+
+def test_recommendation_batch_matches_single_playlists(databases, slice_folder):
+    from src.collaborative_filtering import get_database_recommendations, get_database_recommendations_batch
+    songs = all_songs(slice_folder)
+    playlists = [songs[start:start + 40] for start in range(0, 240, 30)]
+    with CoOccurrenceQuery(databases[2]) as query:
+        query.SEEDS_PER_STATEMENT = 50  # So the batch's seeds take several statements
+        batch = get_database_recommendations_batch(playlists, query, 10)
+        for playlist, result in zip(playlists, batch):
+            assert result == get_database_recommendations(playlist, query, 10)
+
+
+def test_schema_versions_store_the_same_counts(databases):
+    assert pair_counts(databases[1]) == pair_counts(databases[2])
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_per_pair_loader_matches_bulk_loader(databases, slice_folder, tmp_path, version):
+    per_pair = load(slice_folder, str(tmp_path / 'per_pair.db'), version, bulk=False)
+    assert pair_counts(per_pair) == pair_counts(databases[version])
+
+
+@pytest.mark.parametrize('version, bulk', [(1, True), (2, True), (2, False)])
+def test_slices_are_ingested_once(databases, slice_folder, tmp_path, version, bulk):
+    # One slice per run, then a run with nothing left and a renamed copy of a slice: the
+    # manifest keeps every slice from being counted twice
+    db_path = str(tmp_path / 'incremental.db')
+    setup_database(db_path, version)
+    ingest = bulk_update_co_occurrences_from_folder_database if bulk else update_co_occurrences_from_folder_database
+    for _ in range(len(os.listdir(slice_folder)) + 1):
+        ingest(slice_folder, db_path, slice_limit=1)
+    assert pair_counts(db_path) == pair_counts(databases[version])
+
+    copies = tmp_path / 'copies'
+    copies.mkdir()
+    first = sorted(os.listdir(slice_folder))[0]
+    with open(os.path.join(slice_folder, first), 'rb') as source:
+        (copies / 'mpd.slice.1000-1039.json').write_bytes(source.read())
+    ingest(str(copies), db_path, slice_limit=10)
+    assert pair_counts(db_path) == pair_counts(databases[version])
+
+
+def test_deferred_index_matches_bulk_loader(databases, slice_folder, tmp_path):
+    db_path = str(tmp_path / 'deferred.db')
+    setup_database(db_path, 2)
+    bulk_update_co_occurrences_from_folder_database(slice_folder, db_path, slice_limit=2, defer_index=True)
+    bulk_update_co_occurrences_from_folder_database(slice_folder, db_path, slice_limit=10, defer_index=True)
+    assert pair_counts(db_path) == pair_counts(databases[2])
+
+
+def test_migrated_database_keeps_its_manifest(databases, slice_folder, tmp_path):
+    # Ingesting the same folder into the migrated database adds nothing
+    migrated = str(tmp_path / 'migrated.db')
+    migrate_database_to_v2(databases[1], migrated)
+    assert pair_counts(migrated) == pair_counts(databases[2])
+    with CoOccurrenceQuery(databases[1]) as old, CoOccurrenceQuery(migrated) as new:
+        assert new.data_version() > old.data_version()
+    bulk_update_co_occurrences_from_folder_database(slice_folder, migrated, slice_limit=10)
+    assert pair_counts(migrated) == pair_counts(databases[2])
+
+
+def test_same_size_edit_is_reported(slice_folder, tmp_path, capsys):
+    folder = tmp_path / 'slices'
+    folder.mkdir()
+    filename = sorted(os.listdir(slice_folder))[0]
+    with open(os.path.join(slice_folder, filename), 'rb') as source:
+        data = source.read()
+    (folder / filename).write_bytes(data)
+    db_path = load(str(folder), str(tmp_path / 'edited.db'), 2)
+    before = pair_counts(db_path)
+
+    bulk_update_co_occurrences_from_folder_database(str(folder), db_path, slice_limit=10)
+    assert "changed since it was ingested" not in capsys.readouterr().out
+    # Same length, different track
+    edited = data.replace(b'"Track 1"', b'"Track 2"', 1)
+    assert edited != data and len(edited) == len(data)
+    (folder / filename).write_bytes(edited)
+    bulk_update_co_occurrences_from_folder_database(str(folder), db_path, slice_limit=10)
+    assert "changed since it was ingested" in capsys.readouterr().out
+    assert pair_counts(db_path) == before
@@ -0,0 +1,42 @@
+import numpy as np
+from scipy import sparse
+from src.embeddings import ppmi_matrix, randomized_svd
+
+
+COUNTS = np.array([[0, 4, 1, 0],
+                   [4, 0, 2, 3],
+                   [1, 2, 0, 5],
+                   [0, 3, 5, 0]], dtype=float)
+
+
+def reference_ppmi(counts, alpha=1.0, shift=1.0):
+    # max(log(p(i, j) / (p(i) * p_alpha(j))) - log(shift), 0), straight from the definition
+    p = counts / counts.sum()
+    p_song = counts.sum(axis=1) / counts.sum()
+    context = counts.sum(axis=0) ** alpha
+    p_context = context / context.sum()
+    with np.errstate(divide='ignore'):
+        pmi = np.log(p / np.outer(p_song, p_context)) - np.log(shift)
+    return np.maximum(pmi, 0)
+
+
+def test_ppmi_matches_definition():
+    assert np.allclose(ppmi_matrix(COUNTS, alpha=1.0).toarray(), reference_ppmi(COUNTS), atol=1e-6)
+
+
+def test_ppmi_smoothing_and_shift():
+    result = ppmi_matrix(COUNTS, alpha=0.75, shift=1.5).toarray()
+    assert np.allclose(result, reference_ppmi(COUNTS, 0.75, 1.5), atol=1e-6)
+
+
+def test_ppmi_drops_self_pairs():
+    counts = COUNTS + np.diag([7, 7, 7, 7])
+    assert np.all(ppmi_matrix(counts).diagonal() == 0)
+
+
+def test_randomized_svd_recovers_singular_values():
+    rng = np.random.default_rng(0)
+    dense = rng.random((60, 60)) * (rng.random((60, 60)) < 0.2)
+    dense = dense + dense.T
+    _, s = randomized_svd(sparse.csr_matrix(dense.astype(np.float32)), 5, power_iterations=8)
+    assert np.allclose(s, np.linalg.svd(dense, compute_uv=False)[:5], rtol=1e-3)
@@ -0,0 +1,51 @@
+import pytest
+from src.benchmark import count_pairs
+from src.collaborative_filtering import update_co_occurrences_from_folder
+from src.database import setup_database, bulk_update_co_occurrences_from_folder_database
+from src.metrics import MetricsRecorder, add_metrics_hook, remove_metrics_hook, timed_query
+from src.scoring import PlaylistScorer
+
+
+@pytest.fixture
+def recorder():
+    recorder = add_metrics_hook(MetricsRecorder())
+    yield recorder
+    remove_metrics_hook(recorder)
+
+
+def assert_ingest_totals(recorder, slice_folder, backend):
+    playlists, pairs = count_pairs(slice_folder, 10)
+    slices = recorder.of_type('slice')
+    [ingest] = recorder.of_type('ingest')
+    assert len(slices) == ingest['slices'] == 3
+    assert all(event['backend'] == backend for event in slices + [ingest])
+    assert ingest['playlists'] == sum(event['playlists'] for event in slices) == playlists
+    assert ingest['pairs'] == sum(event['pairs'] for event in slices) == pairs
+    assert ingest['tracks'] == sum(event['tracks'] for event in slices)
+    for event in slices:
+        assert event['parse_seconds'] + event['pairs_seconds'] + event['store_seconds'] <= event['seconds']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_memory_ingestion_events(slice_folder, recorder, workers):
+    update_co_occurrences_from_folder(slice_folder, slice_limit=10, workers=workers)
+    assert_ingest_totals(recorder, slice_folder, 'memory')
+
+
+def test_database_ingestion_events(slice_folder, recorder, tmp_path):
+    setup_database(str(tmp_path / 'v2.db'), 2)
+    bulk_update_co_occurrences_from_folder_database(slice_folder, str(tmp_path / 'v2.db'), slice_limit=10)
+    assert_ingest_totals(recorder, slice_folder, 'sqlite')
+
+
+def test_query_events(slice_folder):
+    scorer = PlaylistScorer(update_co_occurrences_from_folder(slice_folder, slice_limit=1))
+    playlist = scorer.co_occurrences.songs[:3]
+    recorder = add_metrics_hook(MetricsRecorder())
+    try:
+        scorer.recommend(playlist, 5)
+        with timed_query('sqlite', 2, 7):
+            pass
+    finally:
+        remove_metrics_hook(recorder)
+    assert [(e['backend'], e['seeds'], e['top_n']) for e in recorder.of_type('query')] == [('memory', 3, 5), ('sqlite', 2, 7)]
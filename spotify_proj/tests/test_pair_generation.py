@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from src.pair_generation import PairStrategy, sample_distinct
+
+
+@pytest.mark.parametrize('total, count', [(10, 0), (10, 10), (1001, 1000), (124750, 1000), (10**12, 5000)])
+def test_sample_distinct(total, count):
+    picked = sample_distinct(np.random.default_rng(0), total, count)
+    assert len(picked) == count
+    assert np.all(np.diff(picked) > 0)
+    assert count == 0 or (picked[0] >= 0 and picked[-1] < total)
+
+
+def test_sample_distinct_is_uniform():
+    rng = np.random.default_rng(1)
+    hits = np.zeros(20)
+    for _ in range(20000):
+        hits[sample_distinct(rng, 20, 3)] += 1
+    assert np.abs(hits / hits.mean() - 1).max() < 0.1
+
+
+@pytest.mark.parametrize('window', [None, 5])
+def test_budget_samples_candidate_pairs(window):
+    strategy = PairStrategy(window=window, budget=100)
+    tracks = [(f"artist {i}", f"track {i}") for i in range(60)]
+    _, first, second, weights = strategy.pairs(tracks)
+    total = strategy.candidate_count(len(tracks))
+    assert len(first) == 100
+    assert len(set(zip(first.tolist(), second.tolist()))) == 100
+    assert np.all(first < second)
+    if window is not None:
+        assert np.all(second - first <= window)
+    assert weights.sum() == pytest.approx(total)
+    # The same playlist is always sampled the same way
+    _, first_again, second_again, _ = strategy.pairs(list(tracks))
+    assert np.array_equal(first, first_again) and np.array_equal(second, second_again)
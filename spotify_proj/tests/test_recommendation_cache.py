@@ -0,0 +1,80 @@
+import gc
+import weakref
+from src.co_occurrence_matrix import CoOccurrenceMatrix
+from src.recommendation_cache import RecommendationCache
+from src.scoring import PlaylistScorer
+
+PLAYLISTS = [
+    [("a", "1"), ("b", "2"), ("c", "3")],
+    [("a", "1"), ("b", "2"), ("d", "4")],
+    [("b", "2"), ("c", "3"), ("e", "5")],
+]
+
+
+def matrix(playlists=PLAYLISTS):
+    co_occurrences = CoOccurrenceMatrix(buffer_size=64)
+    for tracks in playlists:
+        co_occurrences.add_playlist(tracks)
+    co_occurrences.compact()
+    return co_occurrences
+
+
+def test_cache_does_not_keep_the_matrix_alive():
+    cache = RecommendationCache()
+    co_occurrences = matrix()
+    PlaylistScorer(co_occurrences, cache=cache).recommend([("a", "1")], 3)
+    assert len(cache.results) == 1
+    collected = weakref.ref(co_occurrences)
+    del co_occurrences
+    gc.collect()
+    assert collected() is None
+
+
+def test_new_matrix_is_a_new_source():
+    # Same version and possibly the same id() as the collected one, still no stale hits
+    cache = RecommendationCache()
+    first = PlaylistScorer(matrix(), cache=cache).recommend([("a", "1")], 3)
+    gc.collect()
+    other = matrix([[("a", "1"), ("e", "5")]])
+    assert other.version == 1
+    second = PlaylistScorer(other, cache=cache).recommend([("a", "1")], 3)
+    assert [name for name, _ in second] == [("e", "5")]
+    assert first != second
+
+
+def test_cache_invalidated_by_new_counts():
+    cache = RecommendationCache()
+    co_occurrences = matrix()
+    scorer = PlaylistScorer(co_occurrences, cache=cache)
+    before = scorer.recommend([("e", "5")], 3)
+    co_occurrences.add_playlist([("e", "5"), ("d", "4")])
+    co_occurrences.compact()
+    after = scorer.recommend([("e", "5")], 3)
+    assert ("d", "4") not in [name for name, _ in before]
+    assert ("d", "4") in [name for name, _ in after]
+    assert cache.results.invalidations == 1
+
+
+def test_database_paths_compare_by_value():
+    cache = RecommendationCache()
+    cache.validate("a.db", 1)
+    cache.results.put("key", "value")
+    cache.validate("".join(["a", ".db"]), 1)
+    assert cache.results.get("key") == "value"
+    cache.validate("b.db", 1)
+    assert cache.results.get("key") is None
+
+
+def test_scorers_with_different_k_share_a_cache():
+    cache = RecommendationCache()
+    co_occurrences = matrix()
+    wide = PlaylistScorer(co_occurrences, k=50, cache=cache)
+    narrow = PlaylistScorer(co_occurrences, k=1, cache=cache)
+    playlist = [("b", "2")]
+    expected_wide = PlaylistScorer(co_occurrences, k=50).recommend(playlist, 3)
+    expected_narrow = PlaylistScorer(co_occurrences, k=1).recommend(playlist, 3)
+    assert len(expected_narrow) == 1 < len(expected_wide)
+    for _ in range(2):
+        assert wide.recommend(playlist, 3) == expected_wide
+        assert narrow.recommend(playlist, 3) == expected_narrow
+    assert cache.results.hits == 2
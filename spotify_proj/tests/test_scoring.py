@@ -0,0 +1,68 @@
+import os
+import random
+from collections import defaultdict
+import pytest
+from src.collaborative_filtering import slice_to_csv, update_co_occurrences_from_folder
+from src.scoring import PlaylistScorer
+from src.slice_reader import iter_playlists
+from src.topk_index import TopKIndex, build_topk_index
+
+
+@pytest.fixture(scope='module')
+def reference(slice_folder):
+    co_occurrences = defaultdict(lambda: defaultdict(int))
+    for filename in sorted(os.listdir(slice_folder)):
+        slice_to_csv(os.path.join(slice_folder, filename), co_occurrences)
+    return co_occurrences
+
+
+@pytest.fixture(scope='module')
+def playlists(slice_folder):
+    rng = random.Random(0)
+    playlists = [p for filename in sorted(os.listdir(slice_folder)) for p in iter_playlists(os.path.join(slice_folder, filename))]
+    return [rng.sample(playlist, min(len(playlist), rng.randint(1, 6))) for playlist in rng.sample(playlists, 30)]
+
+
+def dict_scores(playlist, co_occurrences):
+    # The get_recommendations dict pipeline: each seed's neighbour counts normalized by their
+    # sum, summed over the seeds, seeds left out. k is above every song's degree here, so
+    # there are no ties at the cut-off to break differently.
+    combined = defaultdict(float)
+    for key in playlist:
+        neighbours = co_occurrences.get(key, {})
+        total = sum(neighbours.values())
+        for neighbour, count in neighbours.items():
+            combined[neighbour] += count / total
+    for key in playlist:
+        combined.pop(key, None)
+    return combined
+
+
+def assert_matches(results, playlists, reference, top_n):
+    for playlist, result in zip(playlists, results):
+        expected = dict_scores(playlist, reference)
+        assert len(result) == min(top_n, len(expected))
+        scores = [score for _, score in result]
+        assert scores == sorted(scores, reverse=True)
+        assert scores == pytest.approx(sorted(expected.values(), reverse=True)[:top_n])
+        for key, score in result:
+            assert score == pytest.approx(expected[key])
+
+
+def test_matrix_scorer_matches_dict_pipeline(slice_folder, reference, playlists):
+    scorer = PlaylistScorer(update_co_occurrences_from_folder(slice_folder, slice_limit=10), k=1000)
+    assert_matches(scorer.recommend_batch(playlists, 10), playlists, reference, 10)
+    assert [scorer.recommend(playlist, 10) for playlist in playlists] == scorer.recommend_batch(playlists, 10)
+
+
+def test_index_scorer_matches_dict_pipeline(slice_folder, reference, playlists, tmp_path):
+    build_topk_index(update_co_occurrences_from_folder(slice_folder, slice_limit=10), str(tmp_path / 'top.idx'), k=1000)
+    scorer = PlaylistScorer(TopKIndex(str(tmp_path / 'top.idx')), k=1000)
+    assert_matches(scorer.recommend_batch(playlists, 10), playlists, reference, 10)
+
+
+def test_unknown_seeds_are_skipped(slice_folder, reference, playlists):
+    scorer = PlaylistScorer(update_co_occurrences_from_folder(slice_folder, slice_limit=10), k=1000)
+    assert scorer.recommend([('Nobody', 'Nothing')]) == []
+    playlist = playlists[0] + [('Nobody', 'Nothing')]
+    assert scorer.recommend(playlist) == scorer.recommend(playlists[0])
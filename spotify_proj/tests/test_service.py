@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+import pytest
+from src.collaborative_filtering import update_co_occurrences_from_folder, save_co_occurrences, load_co_occurrences
+from src.scoring import PlaylistScorer
+from src.service import MicroBatcher, ServiceError, snapshot_service
+from src.slice_reader import iter_playlists
+
+
+@pytest.fixture(scope='module')
+def snapshot(slice_folder, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('service') / 'snapshot.npz')
+    save_co_occurrences(update_co_occurrences_from_folder(slice_folder, slice_limit=10), path)
+    return path
+
+
+async def request(port, method, path, payload=None):
+    # One HTTP/1.1 request on its own connection, (status, decoded JSON body)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    response = json.loads(await reader.read())
+    writer.close()
+    return status, response
+
+
+async def run_requests(service, requests):
+    server = await service.start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await asyncio.gather(*(request(port, *r) for r in requests))
+    finally:
+        await service.stop()
+
+
+def test_batched_answers_match_the_scorer(slice_folder, snapshot):
+    playlists = [p[:3] for p in iter_playlists(os.path.join(slice_folder, sorted(os.listdir(slice_folder))[0]))][:20]
+    service = snapshot_service(snapshot, cache=None, batch_window=0.05)
+    responses = asyncio.run(run_requests(service, [('POST', '/recommend', {'playlist': p, 'top_n': 1 + i % 5}) for i, p in enumerate(playlists)]))
+    scorer = PlaylistScorer(load_co_occurrences(snapshot))
+    for i, (playlist, (status, response)) in enumerate(zip(playlists, responses)):
+        assert status == 200
+        expected = scorer.recommend(playlist, 1 + i % 5)
+        assert [((r['artist'], r['track']), r['score']) for r in response['recommendations']] == expected
+    # Requests sent together were coalesced
+    assert service.batcher.batches < len(playlists)
+    assert service.batcher.batched_requests == len(playlists)
+
+
+def test_bad_requests(snapshot):
+    service = snapshot_service(snapshot, cache=None)
+    responses = asyncio.run(run_requests(service, [
+        ('POST', '/recommend', {'songs': []}),
+        ('POST', '/recommend', {'playlist': [], 'top_n': 0}),
+        ('GET', '/recommend'),
+        ('GET', '/nowhere'),
+        ('GET', '/health'),
+    ]))
+    assert [status for status, _ in responses] == [400, 400, 405, 404, 200]
+    assert responses[-1][1]['backend'] == 'memory'
+
+
+def test_bad_content_length(snapshot):
+    async def send(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b"POST /recommend HTTP/1.1\r\nContent-Length: ten\r\n\r\n")
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        writer.close()
+        return status
+
+    async def run(service):
+        server = await service.start('127.0.0.1', 0)
+        try:
+            return await send(server.sockets[0].getsockname()[1])
+        finally:
+            await service.stop()
+
+    service = snapshot_service(snapshot, cache=None)
+    assert asyncio.run(run(service)) == 400
+    assert service.responses[400] == 1
+
+
+def test_full_queue_is_rejected():
+    async def fill():
+        batcher = MicroBatcher(None, None, 1, max_pending=1)
+        batcher.submit([], 10)
+        with pytest.raises(ServiceError) as error:
+            batcher.submit([], 10)
+        return error.value.status
+
+    assert asyncio.run(fill()) == 503
@@ -0,0 +1,77 @@
+import sqlite3
+import pytest
+from src import sharded_store
+from src.sharded_store import setup_sharded_store, update_sharded_store_from_folder, ShardedCoOccurrenceQuery, SongIds, shard_paths
+from src.database import CoOccurrenceQuery
+from test_database import load, pair_counts, all_songs
+
+
+def store_counts(path, shards):
+    counts = {}
+    for shard_path in shard_paths(path, shards):
+        counts.update(pair_counts(shard_path))
+    return counts
+
+
+@pytest.fixture(scope='module')
+def store(slice_folder, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('store') / 'store')
+    setup_sharded_store(path, shards=3)
+    update_sharded_store_from_folder(slice_folder, path, slice_limit=10, readers=2)
+    return path
+
+
+@pytest.fixture(scope='module')
+def reference(slice_folder, tmp_path_factory):
+    return load(slice_folder, str(tmp_path_factory.mktemp('reference') / 'v1.db'), 1)
+
+
+def test_sharded_store_matches_v1_counts(store, reference):
+    assert store_counts(store, 3) == pair_counts(reference)
+
+
+def test_rows_live_in_the_shard_of_song1(store):
+    for shard, shard_path in enumerate(shard_paths(store, 3)):
+        conn = sqlite3.connect(shard_path)
+        assert conn.execute('SELECT COUNT(*) FROM pairs WHERE song1 % 3 != ?', (shard,)).fetchone()[0] == 0
+        conn.close()
+
+
+def test_rerun_applies_nothing(store, reference, slice_folder):
+    event = update_sharded_store_from_folder(slice_folder, store, slice_limit=10)
+    assert event['rows'] == 0
+    assert store_counts(store, 3) == pair_counts(reference)
+
+
+def test_top_neighbours_batch_with_many_seeds(store, reference, slice_folder):
+    seeds = all_songs(slice_folder)[:200] * 3
+    assert len(seeds) > 500
+    with ShardedCoOccurrenceQuery(store) as router, CoOccurrenceQuery(reference) as single:
+        for shard_query in router.queries:
+            shard_query.SEEDS_PER_STATEMENT = 50
+        batch = router.top_neighbours_batch(seeds, 5)
+        assert len(batch) == len(seeds)
+        for key, (seed_id, neighbours) in list(zip(seeds, batch))[::23]:
+            assert seed_id is not None
+            assert [count for _, count in neighbours] == [count for _, count in single.top_neighbours(*key, 5)]
+
+
+def test_song_ids_resolve_collisions():
+    song_ids = SongIds(4, [(9, "Artist", "Track")])
+    assert song_ids.id(("Artist", "Track")) == 9
+    assert song_ids.id(("Other", "Song"), hashed=9) == 13
+    assert song_ids.id(("Third", "Song"), hashed=9) == 17
+    assert song_ids.id(("Last", "Song"), hashed=(1 << 63) - 3) == (1 << 63) - 3
+    assert song_ids.id(("Wrapped", "Song"), hashed=(1 << 63) - 3) == ((1 << 63) - 3) % 4
+
+
+def test_colliding_songs_are_stored_apart(slice_folder, tmp_path, monkeypatch, reference):
+    # Every song hashes to one of two ids, so nearly all of them collide
+    monkeypatch.setattr(sharded_store, 'song_key_id', lambda key: len(key[1]) % 2)
+    path = str(tmp_path / 'store')
+    setup_sharded_store(path, shards=2)
+    update_sharded_store_from_folder(slice_folder, path, slice_limit=10, readers=1)
+    assert store_counts(path, 2) == pair_counts(reference)
+    key = all_songs(slice_folder)[0]
+    with ShardedCoOccurrenceQuery(path) as router, CoOccurrenceQuery(reference) as single:
+        assert [count for _, count in router.top_neighbours(*key, 5)] == [count for _, count in single.top_neighbours(*key, 5)]
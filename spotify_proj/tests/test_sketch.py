@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from src.collaborative_filtering import update_co_occurrences_from_folder
+from src.sketch import CountMinSketch, update_approx_co_occurrences_from_folder, measure_recall
+
+
+@pytest.fixture(scope='module')
+def exact(slice_folder):
+    return update_co_occurrences_from_folder(slice_folder, slice_limit=10)
+
+
+def test_sketch_never_underestimates():
+    # A narrow sketch so buckets collide a lot
+    rng = np.random.default_rng(1)
+    keys = rng.integers(0, 2**40, size=5000, dtype=np.uint64)
+    counts = rng.integers(1, 20, size=len(keys), dtype=np.uint32)
+    sketch = CountMinSketch(epsilon=0.01, delta=0.1)
+    sketch.add(keys, counts)
+    true = {}
+    for key, count in zip(keys.tolist(), counts.tolist()):
+        true[key] = true.get(key, 0) + count
+    unique = np.array(list(true), dtype=np.uint64)
+    estimates = sketch.estimate(unique)
+    assert (estimates >= np.array([true[k] for k in unique.tolist()])).all()
+    assert sketch.total == int(counts.sum())
+
+
+@pytest.mark.parametrize('epsilon', [1e-6, 1e-3])
+def test_neighbour_estimates_never_undercount(slice_folder, exact, epsilon):
+    approx = update_approx_co_occurrences_from_folder(slice_folder, slice_limit=10, epsilon=epsilon, capacity=20)
+    assert approx.songs == exact.songs
+    for key in approx.songs:
+        counts = exact.get(key, {})
+        for neighbour, estimate in approx.top_neighbours(key, top_n=20):
+            assert estimate >= counts[neighbour]
+
+
+def test_wide_sketch_is_exact(slice_folder, exact):
+    # With enough width and a capacity above every song's degree the heavy hitters are the
+    # full neighbour lists, less the song itself
+    approx = update_approx_co_occurrences_from_folder(slice_folder, slice_limit=10, capacity=300, batch_size=1000)
+    for key in exact.songs:
+        counts = {neighbour: count for neighbour, count in exact.get(key, {}).items() if neighbour != key}
+        assert dict(approx.top_neighbours(key, top_n=300)) == counts
+    assert measure_recall(slice_folder, slice_limit=10, k=10, sample_size=50, capacity=300)['recall_at_k'] == 1.0
@@ -0,0 +1,39 @@
+import json
+import os
+from src.slice_reader import iter_playlists
+
+
+def json_playlists(path):
+    # What the code read before streaming: json.load of the whole slice
+    with open(path) as file:
+        data = json.load(file)
+    return [[(track['artist_name'], track['track_name']) for track in playlist['tracks']] for playlist in data['playlists']]
+
+
+def write_slice(path, playlists, **dump_options):
+    data = {'info': {'slice': '0-1'}, 'playlists': [
+        {'name': f"List {i}", 'pid': i, 'tracks': [dict(pos=pos, artist_name=artist, track_uri='spotify:track:x', track_name=track)
+                                                    for pos, (artist, track) in enumerate(tracks)]}
+        for i, tracks in enumerate(playlists)]}
+    with open(path, 'w') as file:
+        json.dump(data, file, **dump_options)
+
+
+def test_matches_json_load(slice_folder):
+    for filename in sorted(os.listdir(slice_folder)):
+        path = os.path.join(slice_folder, filename)
+        assert list(iter_playlists(path)) == json_playlists(path)
+
+
+def test_escapes_and_unicode(tmp_path):
+    playlists = [[('Beyoncé', 'Déjà "Vu"'), ('AC\\DC', 'Back\nIn Black')], [], [('Sigur Rós', 'Hoppípolla'), ('a', '')]]
+    for options in ({}, {'indent': 4}, {'ensure_ascii': False}):
+        path = str(tmp_path / 'slice.json')
+        write_slice(path, playlists, **options)
+        assert list(iter_playlists(path)) == json_playlists(path) == playlists
+
+
+def test_empty_file(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_bytes(b'')
+    assert list(iter_playlists(str(path))) == []
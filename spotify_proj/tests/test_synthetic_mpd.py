@@ -0,0 +1,29 @@
+import json
+import os
+from src.slice_reader import iter_playlists
+from src.synthetic_mpd import generate_slices
+
+
+def test_same_arguments_same_files(tmp_path):
+    first = generate_slices(str(tmp_path / 'a'), n_slices=2, playlists_per_slice=20, n_tracks=500, n_artists=50, n_genres=4, seed=3)
+    second = generate_slices(str(tmp_path / 'b'), n_slices=2, playlists_per_slice=20, n_tracks=500, n_artists=50, n_genres=4, seed=3)
+    assert [os.path.basename(path) for path in first] == ['mpd.slice.0-19.json', 'mpd.slice.20-39.json']
+    for a, b in zip(first, second):
+        with open(a, 'rb') as file_a, open(b, 'rb') as file_b:
+            assert file_a.read() == file_b.read()
+
+
+def test_slices_follow_the_mpd_layout(slice_folder):
+    pid = 0
+    for filename in sorted(os.listdir(slice_folder), key=lambda name: int(name.split('.')[2].split('-')[0])):
+        with open(os.path.join(slice_folder, filename)) as file:
+            data = json.load(file)
+        assert data['info']['slice'] == filename.split('.')[2]
+        for playlist, tracks in zip(data['playlists'], iter_playlists(os.path.join(slice_folder, filename))):
+            assert playlist['pid'] == pid
+            assert playlist['num_tracks'] == len(playlist['tracks']) == len(tracks)
+            assert 5 <= len(tracks) <= 250
+            assert [track['pos'] for track in playlist['tracks']] == list(range(len(tracks)))
+            assert tracks == [(track['artist_name'], track['track_name']) for track in playlist['tracks']]
+            pid += 1
+    assert pid == 120
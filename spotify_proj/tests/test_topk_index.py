@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from src.collaborative_filtering import update_co_occurrences_from_folder
+from src.database import setup_database, bulk_update_co_occurrences_from_folder_database
+from src.topk_index import TopKIndex, build_topk_index, build_topk_index_from_database, top_k_rows
+
+
+@pytest.fixture(scope='module')
+def matrix(slice_folder):
+    return update_co_occurrences_from_folder(slice_folder, slice_limit=10)
+
+
+def assert_top_k(index, matrix, k):
+    # Every song's list holds k of its largest exact counts, largest first
+    assert len(index) == len(matrix)
+    for key in matrix.songs:
+        exact = matrix.get(key, {})
+        top = index.top_neighbours(key, top_n=k)
+        assert [count for _, count in top] == sorted(exact.values(), reverse=True)[:k]
+        assert all(exact[neighbour] == count for neighbour, count in top)
+
+
+def test_index_matches_matrix(matrix, tmp_path):
+    build_topk_index(matrix, str(tmp_path / 'top.idx'), k=10)
+    index = TopKIndex(str(tmp_path / 'top.idx'))
+    assert_top_k(index, matrix, 10)
+    for song_id, key in enumerate(matrix.songs):
+        assert index.song_id(key) == song_id
+        assert index.song_name(song_id) == key
+    assert ('Nobody', 'Nothing') not in index
+
+
+def test_small_chunks_give_the_same_rows(matrix):
+    expected = top_k_rows(matrix.symmetric, 10)
+    for got, want in zip(top_k_rows(matrix.symmetric, 10, chunk_entries=64), expected):
+        assert np.array_equal(got, want)
+
+
+def test_index_from_database_matches_matrix(slice_folder, matrix, tmp_path):
+    db_path = str(tmp_path / 'v2.db')
+    setup_database(db_path, 2)
+    bulk_update_co_occurrences_from_folder_database(slice_folder, db_path, slice_limit=10)
+    build_topk_index_from_database(db_path, str(tmp_path / 'top.idx'), k=10)
+    assert_top_k(TopKIndex(str(tmp_path / 'top.idx')), matrix, 10)